@@ -0,0 +1,63 @@
+"""Throughput and peak allocations of an uncrypted stream with leading nulls
+
+    python benchmarks/bench_allocations.py [MB]
+"""
+import sys
+import tracemalloc
+from io import BytesIO
+
+from common import (
+    MB,
+    TRACK_ID,
+    NullStream,
+    baselineStream,
+    fakeTrack,
+    getCollection,
+    measure,
+    serving,
+)
+from deemix.decryption import streamTrack
+
+
+def traced(function, *args):
+    """Returns the seconds function took and its peak of traced allocations"""
+    tracemalloc.start()
+    try:
+        seconds = measure(function, *args)
+        return seconds, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(size=100):
+    data = b"\x00" * 4000 + b"\x01" * (size * MB)
+    track = fakeTrack("https://cdn/api/1/track")
+
+    output = BytesIO()
+    with serving(data):
+        streamTrack(output, track)
+    assert output.getvalue() == data.lstrip(b"\x00"), "leading nulls not stripped"
+
+    def baseline():
+        baselineStream(NullStream(), data, TRACK_ID, getCollection(), crypted=False)
+
+    def current():
+        with serving(data):
+            streamTrack(NullStream(), track, 0, getCollection())
+
+    print(f"{size} MB uncrypted stream with 4000 leading nulls")
+    for name, function in [("baseline loop", baseline), ("streamTrack", current)]:
+        seconds = measure(function)
+        tracedSeconds, peak = traced(function)
+        print(
+            f"  {name:13} {size / seconds:7.0f} MB/s, traced {size / tracedSeconds:6.0f}"
+            f" MB/s, peak {peak / 1024:6.0f} KiB"
+        )
+
+    # Allocations slow down the traced run, the peak of streamTrack is its
+    # reused buffer and the chunks of the fake response
+    print("  the traced throughput drops with the allocations made per buffer")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,42 @@
+"""Decryption of a 2048 bytes stripe, new cipher per stripe vs BlowfishContext
+
+    python benchmarks/bench_blowfish.py [stripes]
+"""
+import os
+import sys
+from timeit import timeit
+
+from common import TRACK_ID, encrypt
+from Cryptodome.Cipher import Blowfish
+
+from deemix.utils.crypto import BLOWFISH_IV, generateBlowfishKey, getBlowfishContext
+
+
+def main(stripes=20000):
+    plain = os.urandom(2048)
+    crypted = encrypt(TRACK_ID, plain)
+    key = generateBlowfishKey(TRACK_ID)
+    context = getBlowfishContext(TRACK_ID)
+
+    def rekeyed():
+        return Blowfish.new(key, Blowfish.MODE_CBC, BLOWFISH_IV).decrypt(crypted)
+
+    def cached():
+        stripe = bytearray(crypted)
+        context.decryptStripe(stripe)
+        return stripe
+
+    assert rekeyed() == plain and cached() == plain, "outputs differ"
+    print(f"{stripes} stripes of 2048 bytes, identical output")
+    for name, function in [
+        ("Blowfish.new per stripe", rekeyed),
+        ("BlowfishContext", cached),
+    ]:
+        seconds = timeit(function, number=stripes)
+        print(f"  {name:24} {seconds / stripes * 1e6:6.1f} us per stripe")
+    seconds = timeit(lambda: generateBlowfishKey.__wrapped__(TRACK_ID), number=stripes)
+    print(f"  key derivation, uncached {seconds / stripes * 1e6:6.1f} us per track")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
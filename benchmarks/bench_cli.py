@@ -0,0 +1,166 @@
+"""The CLI with many links, resolved before the downloads vs resolved ahead
+in a pool while the first ones download
+
+    python benchmarks/bench_cli.py [links]
+
+The link generation and the downloads are simulated, the links go through
+the real click command.
+"""
+import os
+import sys
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from io import StringIO
+from time import perf_counter, sleep
+from types import SimpleNamespace
+
+from click.testing import CliRunner
+from common import measure
+
+import deemix.__main__ as cli
+from deemix.downloader import Downloader
+from deemix.errors import GenerationError
+from deemix.settings import DEFAULTS
+from deemix.types.DownloadObjects import Collection
+
+state = {"start": 0, "first": None}
+lock = threading.Lock()
+
+
+class Album(Collection):
+    __type__ = "Collection"
+
+    def __init__(self, uuid, size):  # pylint: disable=W0231
+        self.uuid = uuid
+        self.size = size
+        self.bitrate = 9
+        self.isCanceled = False
+
+
+def generate(dz, link, bitrate, plugins, listener):
+    # The api calls resolving the link
+    sleep(0.3)
+    i = int(link.rsplit("/", 1)[1])
+    if i % 17 == 0:
+        raise GenerationError(link, "Link ID not recognized")
+    if i % 20 == 1:
+        # An artist, with many albums
+        return [Album(f"{i}-{k}", 2) for k in range(3)]
+    return Album(str(i), 3)
+
+
+class SimulatedDownloader(Downloader):
+    def iterCollectionExtraData(self):
+        for k in range(self.downloadObject.size):
+            trackId = f"{self.downloadObject.uuid}/{k}"
+            yield {
+                "trackAPI": {
+                    "id": trackId,
+                    "title": "Title",
+                    "artist": {"name": "Artist"},
+                }
+            }
+
+    def getTrack(self, extraData, track=None):
+        sleep(0.05)
+        return track or SimpleNamespace(id=extraData["trackAPI"]["id"])
+
+    def prepareDownload(self, extraData, track=None):
+        return {"track": self.getTrack(extraData, track), "downloaded": True}
+
+    def streamDownload(self, job, restarted=False):
+        with lock:
+            if state["first"] is None:
+                state["first"] = perf_counter() - state["start"]
+        sleep(0.1)
+        return True
+
+    def tagDownload(self, job):
+        return True
+
+    def completeDownload(self, job):
+        return {"id": job["track"].id}
+
+    def reportResult(self, result):
+        pass
+
+    def afterDownloadCollection(self, tracks):
+        print(
+            "done", self.downloadObject.uuid, len([track.result() for track in tracks])
+        )
+
+
+class FakeDeezer:
+    def login_via_arl(self, arl):
+        return True
+
+
+def resolveFirst(links):
+    """The CLI before the scheduler, every link resolved then downloaded"""
+    objects = []
+    for link in links:
+        try:
+            result = generate(None, link, 3, {}, None)
+        except GenerationError as e:
+            print(f"{e.link}: {e.message}")
+            continue
+        objects += result if isinstance(result, list) else [result]
+    for downloadObject in objects:
+        SimulatedDownloader(None, downloadObject, DEFAULTS).start()
+
+
+def run(function):
+    """Returns the output, the seconds taken and when the first download started"""
+    state["start"] = perf_counter()
+    state["first"] = None
+    output = StringIO()
+    with redirect_stdout(output):
+        seconds = measure(function)
+    return output.getvalue(), seconds, state["first"]
+
+
+def main(size=60):
+    folder = tempfile.mkdtemp()
+    os.makedirs(f"{folder}/config")
+    with open(f"{folder}/config/.arl", "w", encoding="utf-8") as f:
+        f.write("arl")
+    links = [f"https://deezer.com/album/{i}" for i in range(1, size + 1)]
+    with open(f"{folder}/links.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(links))
+
+    cli.Deezer = FakeDeezer
+    cli.Spotify = None
+    cli.setupMetadataCache = lambda path: None
+    cli.Downloader = SimulatedDownloader
+    cli.generateDownloadObject = generate
+    os.chdir(folder)
+
+    def runCLI():
+        result = CliRunner().invoke(
+            cli.download, ["--portable", f"{folder}/links.txt"], catch_exceptions=False
+        )
+        print(result.output, end="")
+
+    print(f"{size} links, 0.3s each to resolve")
+    baseline = run(lambda: resolveFirst(links))
+    current = run(runCLI)
+    for name, (_, seconds, first) in [
+        ("resolved first", baseline),
+        ("resolved ahead", current),
+    ]:
+        print(f"  {name}: {seconds:6.2f}s, first download after {first:.2f}s")
+
+    def split(output):
+        # The links read from the file keep their line break
+        lines = output.replace("\n:", ":").splitlines()
+        errors = [line for line in lines if "recognized" in line]
+        done = [line for line in lines if line.startswith("done")]
+        return done, errors
+
+    assert split(baseline[0]) == split(current[0]), "downloads or errors differ"
+    print("  same downloads in the same order, same errors in order")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,80 @@
+"""Thread and async engines streaming many tracks from a throttled local CDN
+
+    python benchmarks/bench_engines.py [tracks]
+
+Every stream is served at about 6 MB/s, like a CDN capping each connection.
+"""
+import asyncio
+import hashlib
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from common import MB, TRACK_ID, CDN, encrypt, fakeTrack, measure
+from deemix.decryption import streamTrack
+
+try:
+    import aiohttp
+    from deemix.asyncdownloader import CPU_WORKERS, streamTrackAsync
+except ImportError:
+    aiohttp = None
+
+SIZE = 2 * MB
+
+
+def threadEngine(cdn, tracks, workers):
+    def download(_):
+        output = BytesIO()
+        streamTrack(output, fakeTrack(cdn.url))
+        return hashlib.md5(output.getvalue()).hexdigest()
+
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(download, range(tracks)))
+
+
+async def asyncEngine(cdn, tracks, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(CPU_WORKERS)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def download():
+            async with semaphore:
+                output = BytesIO()
+                await streamTrackAsync(
+                    session, output, fakeTrack(cdn.url), executor=executor
+                )
+                return hashlib.md5(output.getvalue()).hexdigest()
+
+        results = await asyncio.gather(*[download() for _ in range(tracks)])
+    executor.shutdown()
+    return results
+
+
+def main(tracks=64):
+    plain = b"\x01" + os.urandom(SIZE - 1)
+    digest = hashlib.md5(plain).hexdigest()
+    cdn = CDN(encrypt(TRACK_ID, plain), pace=0.01)
+    engines = [
+        ("threads x3 (queueConcurrency)", lambda: threadEngine(cdn, tracks, 3)),
+        (f"threads x{tracks}", lambda: threadEngine(cdn, tracks, tracks)),
+    ]
+    if aiohttp:
+        engines.append(
+            (f"async x{tracks}", lambda: asyncio.run(asyncEngine(cdn, tracks, tracks)))
+        )
+    else:
+        print("aiohttp isn't installed, the async engine is skipped")
+
+    print(f"{tracks} tracks of 2 MiB")
+    for name, engine in engines:
+        results = []
+        seconds = measure(lambda: results.extend(engine()))
+        assert results == [digest] * tracks, f"{name}: outputs differ"
+        print(f"  {name:30} {seconds:6.2f}s {tracks * SIZE / seconds / MB:6.1f} MB/s")
+    cdn.close()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,101 @@
+"""gw requests made to parse the tracks of a playlist, one page per track vs
+the batched song lists, against a local gw-light server
+
+    python benchmarks/bench_gw_tracks.py [tracks]
+"""
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import common  # pylint: disable=W0611
+from deezer.gw import GW
+from deezer.utils import map_track
+from fakedeezer import FakeDeezer, GWServer, apiAlbum, gwTrack
+
+from deemix.downloader import Downloader
+from deemix.settings import DEFAULTS
+from deemix.types.Track import Track
+from deemix.utils.cache import metadataCache
+
+# Songs gw leaves out of the song lists
+UNAVAILABLE = [7, 250]
+
+
+def getSignature(track):
+    return (
+        track.id,
+        track.title,
+        track.trackToken,
+        track.fallbackID,
+        track.MD5,
+        track.filesizes,
+        track.album.id,
+        track.ISRC,
+        track.lyrics.unsync,
+    )
+
+
+def parseAll(server, tracks, prefetch):
+    """Returns the parsed tracks and the gw calls made"""
+    server.calls.clear()
+    dz = FakeDeezer()
+    dz.gw = GW(server.getSession(), {})
+    dz.gw.api_token = "token"
+    albumAPI = dict(apiAlbum(), nb_disk=1)
+    downloadObject = SimpleNamespace(
+        bitrate=3,
+        isCanceled=False,
+        uuid="benchmark",
+        collection={"tracks": tracks, "albumAPI": albumAPI, "playlistAPI": None},
+    )
+    downloader = Downloader(dz, downloadObject, DEFAULTS)
+    if prefetch:
+        extraDataList = list(downloader.iterCollectionExtraData())
+    else:
+        extraDataList = [{"trackAPI": track, "albumAPI": albumAPI} for track in tracks]
+
+    def parse(extraData):
+        return Track().parseData(
+            dz,
+            track_id=extraData["trackAPI"]["id"],
+            trackAPI=extraData["trackAPI"],
+            albumAPI=extraData["albumAPI"],
+        )
+
+    with ThreadPoolExecutor(DEFAULTS["queueConcurrency"]) as executor:
+        parsed = list(executor.map(parse, extraDataList))
+    return parsed, dict(server.calls)
+
+
+def main(size=500):
+    # Every track is parsed from scratch
+    metadataCache.memorySize = 0
+    server = GWServer(unavailable=UNAVAILABLE)
+    tracks = []
+    for i in range(1, size + 1):
+        # Collections come without a token
+        track = map_track(gwTrack(i))
+        del track["track_token"]
+        track["track_token_expire"] = 0
+        tracks.append(track)
+
+    print(f"{size} playlist tracks, {server.latency * 1000:.0f}ms per gw call")
+    results = {}
+    for name, prefetch in [("page per track", False), ("song lists", True)]:
+        seconds = common.measure(
+            lambda: results.setdefault(name, parseAll(server, tracks, prefetch))
+        )
+        calls = results[name][1]
+        print(
+            f"  {name:15} {sum(calls.values()):4} gw calls in {seconds:5.2f}s {calls}"
+        )
+    baseline, current = (results[name][0] for name in results)
+    assert [getSignature(track) for track in baseline] == [
+        getSignature(track) for track in current
+    ], "parsed tracks differ"
+    print("  parsed tracks identical")
+    server.close()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,79 @@
+"""Decryption and tagging of crypted FLAC files, threads vs the process pool
+
+    python benchmarks/bench_processes.py [files] [workers...]
+
+The process pool only helps with more than one core, the scaling follows
+os.cpu_count().
+"""
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from common import ALL_TAGS, MB, TRACK_ID, encrypt, getTaggedTrack, makeFLAC, measure
+
+from deemix.processpool import decryptFile, processPool
+from deemix.settings import DEFAULTS
+from deemix.tagger import tagFLAC
+
+SIZE = 8 * MB
+
+
+def main(files=32, *workerCounts):
+    workerCounts = workerCounts or (1, 4, 8, 16)
+    folder = Path(tempfile.mkdtemp())
+    coverPath = folder / "cover.jpg"
+    coverPath.write_bytes(b"\xff\xd8\xff" + os.urandom(60000))
+    track = getTaggedTrack(str(coverPath))
+    crypted = encrypt(TRACK_ID, makeFLAC(SIZE))
+
+    def prepare():
+        paths = [folder / f"{i}.flac" for i in range(files)]
+        for path in paths:
+            path.write_bytes(crypted)
+        return paths
+
+    def inThread(path):
+        decryptFile(str(path), TRACK_ID)
+        tagFLAC(path, track, ALL_TAGS)
+
+    def inPool(path):
+        processPool.decrypt(path, TRACK_ID)
+        processPool.tag(path, ".flac", track, ALL_TAGS)
+
+    print(f"{files} crypted FLAC files of {SIZE // MB} MB, {os.cpu_count()} cores")
+    paths = prepare()
+    workers = DEFAULTS["taggingConcurrency"]
+    with ThreadPoolExecutor(workers) as executor:
+        baseline = measure(lambda: list(executor.map(inThread, paths)))
+    expected = paths[0].read_bytes()
+    print(
+        f"  threads x{workers}:     {baseline:6.2f}s {files * SIZE / MB / baseline:5.0f} MB/s"
+    )
+
+    for workers in workerCounts:
+        processPool.configure(workers)
+        paths = prepare()
+        with ThreadPoolExecutor(max(workers, 2)) as executor:
+            # The workers are spawned before the timing
+            list(
+                executor.map(
+                    lambda _: processPool.tag(coverPath, ".jpg", track, ALL_TAGS),
+                    range(workers * 2),
+                )
+            )
+            seconds = measure(lambda: list(executor.map(inPool, paths)))
+        assert all(path.read_bytes() == expected for path in paths), "outputs differ"
+        print(
+            f"  processes x{workers:<3}  {seconds:6.2f}s {files * SIZE / MB / seconds:5.0f}"
+            f" MB/s, x{baseline / seconds:.2f}"
+        )
+    processPool.configure(0)
+    shutil.rmtree(folder)
+    print("  outputs identical")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,115 @@
+"""A discography of small albums, one downloader after the other vs the
+shared scheduler, with simulated stage costs
+
+    python benchmarks/bench_scheduler.py
+"""
+import threading
+from random import Random
+from time import sleep
+from types import SimpleNamespace
+
+from common import measure
+
+from deemix.downloader import Downloader
+from deemix.scheduler import Scheduler
+from deemix.settings import DEFAULTS
+from deemix.types.DownloadObjects import Collection
+
+random = Random(1)
+SIZES = [random.choice([1, 2, 3, 4, 5, 12]) for _ in range(20)]
+
+
+class Album(Collection):
+    def __init__(self, uuid, size):  # pylint: disable=W0231
+        self.uuid = uuid
+        self.size = size
+        self.bitrate = 9
+        self.isCanceled = False
+
+
+class SimulatedDownloader(Downloader):
+    """Sleeps for the api calls and the stream, records the completion hooks"""
+
+    events = []
+    lock = threading.Lock()
+
+    def iterCollectionExtraData(self):
+        for i in range(self.downloadObject.size):
+            trackId = f"{self.downloadObject.uuid}-{i}"
+            yield {
+                "trackAPI": {
+                    "id": trackId,
+                    "title": "Title",
+                    "artist": {"name": "Artist"},
+                }
+            }
+
+    def getTrack(self, extraData, track=None):
+        sleep(0.1)
+        return track or SimpleNamespace(id=extraData["trackAPI"]["id"])
+
+    def prepareDownload(self, extraData, track=None):
+        sleep(0.05)
+        return {"track": self.getTrack(extraData, track), "downloaded": True}
+
+    def streamDownload(self, job, restarted=False):
+        # Every track has its own duration, the same in both runs
+        sleep(0.4 + 0.4 * Random(job["track"].id).random())
+        return True
+
+    def tagDownload(self, job):
+        sleep(0.02)
+        return True
+
+    def completeDownload(self, job):
+        return {"id": job["track"].id}
+
+    def reportResult(self, result):
+        pass
+
+    def afterDownloadCollection(self, tracks):
+        with self.lock:
+            ids = [track.result()["id"] for track in tracks]
+            self.events.append((self.downloadObject.uuid, ids))
+
+    def sendFinished(self):
+        with self.lock:
+            self.events.append(("finished", self.downloadObject.uuid))
+
+
+def getDownloaders():
+    return [
+        SimulatedDownloader(None, Album(f"album{i}", size), DEFAULTS)
+        for i, size in enumerate(SIZES)
+    ]
+
+
+def main():
+    events = SimulatedDownloader.events
+    print(
+        f"{len(SIZES)} albums, {sum(SIZES)} tracks,"
+        f" queueConcurrency {DEFAULTS['queueConcurrency']}"
+    )
+    baseline = measure(lambda: [downloader.start() for downloader in getDownloaders()])
+    expected = list(events)
+    print(f"  one downloader after the other {baseline:6.2f}s")
+
+    events.clear()
+    scheduler = Scheduler(DEFAULTS)
+    scheduler.add(getDownloaders())
+    seconds = measure(scheduler.start)
+    print(f"  shared scheduler               {seconds:6.2f}s x{baseline / seconds:.2f}")
+    assert events == expected, "completion hooks differ"
+    print("  completion hooks: same objects, same order, tracks in order")
+
+    events.clear()
+    scheduler = Scheduler(DEFAULTS)
+    downloaders = getDownloaders()
+    scheduler.add(downloaders[:-1])
+    scheduler.add(downloaders[-1], priority=1)
+    scheduler.start()
+    print(f"  first completion with the last album prioritized: {events[0][0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Converting a Spotify playlist, half of it cached, with the cache.json of
+older versions vs the SQLite cache
+
+    python benchmarks/bench_spotify_cache.py [cached] [tracks]
+
+The old cache rewrote the whole cache.json on every miss, JSONCache below
+does the same behind the interface of SpotifyCache.
+"""
+import json
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from random import Random
+from types import SimpleNamespace
+
+from common import measure
+
+from deemix.plugins.spotify import Spotify, SpotifyCache
+from deemix.settings import DEFAULTS
+from deemix.types.DownloadObjects import Convertable
+
+
+class JSONCache:
+    """The cache of older versions, cache.json saved after every change"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "r", encoding="utf-8") as f:
+            self.cache = json.load(f)
+        self.cache.setdefault("unmatched", {})
+        self.lock = threading.Lock()
+
+    def get(self, kind, key):
+        return self.cache[kind].get(str(key))
+
+    def set(self, kind, key, value):
+        with self.lock:
+            self.cache[kind][str(key)] = value
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.cache, f)
+
+    def setMany(self, kind, values):
+        for key, value in values.items():
+            self.set(kind, key, value)
+
+    def delete(self, kind, key):
+        with self.lock:
+            self.cache[kind].pop(str(key), None)
+
+    def items(self, kind):
+        return list(self.cache[kind].items())
+
+    def flush(self):
+        pass
+
+
+def spotifyTrack(i):
+    return {
+        "id": f"sp{i}",
+        "name": f"Title {i}",
+        "artists": [{"name": f"Artist {i % 300}"}],
+        "album": {"name": f"Album {i % 900}"},
+        "external_ids": {"isrc": f"ISRC{i:08d}"},
+        "explicit": False,
+    }
+
+
+class FakeAPI:
+    def get_track_by_ISRC(self, isrc):
+        return {"id": int(isrc[4:]), "title": "Title"}
+
+
+def getPlaylist(tracklist):
+    return Convertable(
+        {
+            "type": "spotify_playlist",
+            "id": "1",
+            "bitrate": 9,
+            "title": "Playlist",
+            "artist": "Artist",
+            "cover": "",
+            "explicit": False,
+            "size": len(tracklist),
+            "collection": {"tracks": [], "playlistAPI": {}},
+            "plugin": "spotify",
+            "conversion_data": tracklist,
+        }
+    )
+
+
+def getPlugin(folder):
+    plugin = Spotify(configFolder=folder)
+    plugin.loadSettings = lambda: None
+    plugin.enabled = True
+    return plugin
+
+
+def main(cached=10000, size=200):
+    random = Random(3)
+    cache = {
+        "tracks": {
+            f"sp{i}": {
+                "isrc": f"ISRC{i:08d}",
+                "data": {"title": f"Title {i}", "artist": "Artist", "album": "Album"},
+            }
+            for i in range(cached)
+        },
+        "albums": {
+            f"al{i}": {"upc": f"{i:012d}", "data": {"title": "Title", "artist": "A"}}
+            for i in range(2000)
+        },
+    }
+    # Half the playlist is cached already
+    tracklist = [spotifyTrack(i) for i in random.sample(range(cached), size // 2)]
+    tracklist += [spotifyTrack(i) for i in range(cached, cached + size - size // 2)]
+    random.shuffle(tracklist)
+    dz = SimpleNamespace(api=FakeAPI())
+    settings = {**DEFAULTS, "metadataConcurrency": 3}
+
+    results = {}
+    for name in ["cache.json", "cache.db"]:
+        folder = Path(tempfile.mkdtemp())
+        (folder / "spotify").mkdir()
+        (folder / "spotify" / "cache.json").write_text(json.dumps(cache))
+        plugin = getPlugin(folder)
+        if name == "cache.json":
+            plugin.cache = JSONCache(folder / "spotify" / "cache.json")
+        else:
+            imported = measure(plugin.setup)
+        converted = []
+        seconds = measure(
+            lambda: converted.append(
+                plugin.convert(dz, getPlaylist(tracklist), settings)
+            )
+        )
+        results[name] = (converted[0].collection["tracks"], seconds)
+
+    print(f"{size} tracks, {size - size // 2} misses, {cached} cached")
+    for name, (_, seconds) in results.items():
+        print(f"  {name}: {seconds:7.2f}s")
+    print(f"  cache.json imported once in {imported:.2f}s")
+    assert results["cache.json"][0] == results["cache.db"][0], "tracks differ"
+    print("  same converted tracks")
+
+    # Everything is still there when reopened
+    reopened = getPlugin(folder).setup()
+    rows = dict(
+        reopened.cache.db.execute(
+            "SELECT kind, COUNT(*) FROM spotify GROUP BY kind"
+        ).fetchall()
+    )
+    assert rows == {"albums": 2000, "tracks": cached + size - size // 2}, rows
+    assert reopened.cache.get("tracks", "sp5") == cache["tracks"]["sp5"]
+    print(f"  rows after reopening: {rows}")
+
+    # Concurrent writers and readers on one cache
+    shared = SpotifyCache(folder / "threads.db")
+
+    def work(k):
+        for i in range(2000):
+            shared.set("tracks", f"{k}-{i}", {"isrc": str(i)})
+            assert shared.get("tracks", f"{k}-{i}") == {"isrc": str(i)}
+
+    threads = [threading.Thread(target=work, args=(k,)) for k in range(8)]
+
+    def runThreads():
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        shared.flush()
+
+    seconds = measure(runThreads)
+    count = shared.db.execute("SELECT COUNT(*) FROM spotify").fetchone()[0]
+    assert count == 8 * 2000, count
+    print(f"  8 threads doing 2000 set+get each: {seconds:.2f}s, {count} rows")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,113 @@
+"""Converting a Spotify playlist one track at a time vs with the metadata
+workers, through the real Deezer client against a local api
+
+    python benchmarks/bench_spotify_convert.py [tracks]
+
+One track at a time is metadataConcurrency 1, what convert did before.
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+from common import measure
+from deezer import Deezer
+from fakedeezer import APIServer
+
+from deemix.plugins.spotify import Spotify
+from deemix.settings import DEFAULTS
+from deemix.types.DownloadObjects import Convertable
+
+
+class Listener:
+    def __init__(self, playlist=None, cancelAt=None):
+        self.events = []
+        self.playlist = playlist
+        self.cancelAt = cancelAt
+
+    def send(self, key, value=None):
+        self.events.append((key, value))
+        if self.cancelAt and key == "updateQueue":
+            if value["conversion"] >= self.cancelAt:
+                self.playlist.isCanceled = True
+
+
+def spotifyTrack(i):
+    return {
+        "id": f"sp{i}",
+        "name": f"Title {i}",
+        "artists": [{"name": f"Artist {i}"}],
+        "album": {"name": f"Album {i}"},
+        "external_ids": {"isrc": f"ISRC{i:08d}"},
+        "explicit": False,
+    }
+
+
+def getPlaylist(size):
+    return Convertable(
+        {
+            "type": "spotify_playlist",
+            "id": "1",
+            "bitrate": 9,
+            "title": "Playlist",
+            "artist": "Artist",
+            "cover": "",
+            "explicit": False,
+            "size": size,
+            "collection": {"tracks": [], "playlistAPI": {}},
+            "plugin": "spotify",
+            "conversion_data": [spotifyTrack(i) for i in range(1, size + 1)],
+        }
+    )
+
+
+def getPlugin():
+    folder = Path(tempfile.mkdtemp())
+    plugin = Spotify(configFolder=folder)
+    plugin.loadSettings = lambda: None
+    plugin.setup()
+    plugin.enabled = True
+    plugin.settings["fallbackSearch"] = True
+    return plugin
+
+
+def main(size=300):
+    api = APIServer()
+    dz = api.redirect(Deezer())
+
+    def run(settings, cancelAt=None):
+        playlist = getPlaylist(size)
+        listener = Listener(playlist, cancelAt)
+        api.reset()
+        converted = []
+        seconds = measure(
+            lambda: converted.append(
+                getPlugin().convert(dz, playlist, settings, listener)
+            )
+        )
+        tracks = converted[0].collection["tracks"]
+        return tracks, seconds, listener.events, api.calls, api.maxInFlight
+
+    print(f"{size} tracks, {api.latency * 1000:.0f}ms api latency, 1 in 10 searched")
+    runs = {
+        "one at a time": run({**DEFAULTS, "metadataConcurrency": 1}),
+        "workers": run(DEFAULTS),
+    }
+    for name, (_, seconds, _, calls, inFlight) in runs.items():
+        print(f"  {name}: {seconds:6.2f}s, {calls} requests, {inFlight} in flight")
+    before, after = runs.values()
+    assert before[0] == after[0], "tracks differ"
+    assert before[2] == after[2], "progress events differ"
+    assert before[3] == after[3], "requests differ"
+    print(f"  same tracks in the same order, same {len(after[2])} progress events")
+
+    tracks, seconds, _, calls, _ = run(DEFAULTS, cancelAt=20)
+    converted = len([track for track in tracks if track])
+    print(
+        f"  canceled at 20%: stopped after {seconds:.2f}s,"
+        f" {converted} converted, {calls} requests"
+    )
+    api.close()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
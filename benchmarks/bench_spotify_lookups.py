@@ -0,0 +1,220 @@
+"""Spotify lookups one id per request vs coalesced in batches, and playlist
+pages one after the other vs at once, with a fake Spotify client
+
+    python benchmarks/bench_spotify_lookups.py
+
+One id per request is a loader calling sp.track and sp.album for every
+lookup, one page after the other is PLAYLIST_PAGE_WORKERS set to 1.
+"""
+import tempfile
+import threading
+from collections import Counter
+from pathlib import Path
+from time import perf_counter, sleep
+from types import SimpleNamespace
+
+from common import measure
+
+import deemix.plugins.spotify as spotify
+from deemix.utils.pipeline import mapAhead
+
+LATENCY = 0.05
+PLAYLIST_SIZE = 1000
+
+
+def spotifyTrack(i):
+    return {
+        "id": f"t{i}",
+        "name": f"Title {i}",
+        "artists": [{"name": "Artist"}],
+        "album": {"name": "Album"},
+        "external_ids": {"isrc": f"ISRC{i:08d}"},
+        "explicit": i % 7 == 0,
+    }
+
+
+def spotifyAlbum(i):
+    return {
+        "id": f"a{i}",
+        "name": f"Album {i}",
+        "artists": [{"name": "Artist"}],
+        "external_ids": {"upc": f"{i:012d}"},
+    }
+
+
+def getPage(offset, limit=100):
+    items = [
+        {"track": spotifyTrack(i) if i % 50 else None}
+        for i in range(offset, min(offset + limit, PLAYLIST_SIZE))
+    ]
+    following = None
+    if offset + limit < PLAYLIST_SIZE:
+        following = f"next?offset={offset + limit}"
+    return {
+        "items": items,
+        "limit": limit,
+        "offset": offset,
+        "total": PLAYLIST_SIZE,
+        "next": following,
+    }
+
+
+class FakeSpotify:
+    """Counts the requests, the ones over the rate limit wait their turn like
+    after a 429 and its Retry-After"""
+
+    def __init__(self, rateLimit=0):
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.rateLimit = rateLimit
+        self.nextSlot = 0.0
+
+    def request(self, name):
+        wait = 0
+        with self.lock:
+            self.calls[name] += 1
+            if self.rateLimit:
+                now = perf_counter()
+                self.nextSlot = max(self.nextSlot, now) + 1 / self.rateLimit
+                wait = self.nextSlot - now
+        sleep(LATENCY + wait)
+
+    def track(self, trackId):
+        self.request("track")
+        return spotifyTrack(int(trackId[1:]))
+
+    def tracks(self, trackIds):
+        self.request("tracks")
+        assert len(trackIds) <= 50
+        return {
+            "tracks": [
+                spotifyTrack(int(i[1:])) if i != "tbad" else None for i in trackIds
+            ]
+        }
+
+    def album(self, albumId):
+        self.request("album")
+        return spotifyAlbum(int(albumId[1:]))
+
+    def albums(self, albumIds):
+        self.request("albums")
+        assert len(albumIds) <= 20
+        return {"albums": [spotifyAlbum(int(i[1:])) for i in albumIds]}
+
+    def playlist(self, playlistId):
+        self.request("playlist")
+        return {
+            "id": playlistId,
+            "name": "Playlist",
+            "owner": {"display_name": "Owner", "id": "owner", "href": ""},
+            "tracks": {**getPage(0), "href": ""},
+            "images": [],
+            "snapshot_id": "snapshot",
+            "collaborative": False,
+            "description": "",
+            "external_urls": {"spotify": ""},
+            "public": True,
+        }
+
+    def playlist_items(self, playlistId, limit, offset, additional_types):
+        self.request("playlist_items")
+        return getPage(offset, limit)
+
+
+class SingleLoader:
+    """Every lookup in its own request"""
+
+    def __init__(self, fetchOne):
+        self.fetchOne = fetchOne
+
+    def get(self, key):
+        return self.fetchOne(key)
+
+
+def getPlugin(client, batched=True):
+    plugin = spotify.Spotify(configFolder=Path(tempfile.mkdtemp()))
+    plugin.loadSettings = lambda: None
+    plugin.setup()
+    plugin.enabled = True
+    plugin.sp = client
+    if not batched:
+        plugin.trackLoader = SingleLoader(client.track)
+        plugin.albumLoader = SingleLoader(client.album)
+    return plugin
+
+
+def main():
+    dz = SimpleNamespace(api=SimpleNamespace(get_artist=lambda i: {"id": i}))
+    # The links are resolved, not the Deezer items behind them
+    spotify.generateTrackItem = lambda dz, link, bitrate: link
+    spotify.generateAlbumItem = lambda dz, link, bitrate: link
+    links = [("track", f"t{i}") for i in range(1, 121)]
+    links += [("album", f"a{i}") for i in range(1, 41)]
+
+    def generate(plugin, workers):
+        def generateOne(link):
+            kind, linkId = link
+            if kind == "track":
+                return plugin.generateTrackItem(dz, linkId, 9)
+            return plugin.generateAlbumItem(dz, linkId, 9)
+
+        return [future.result() for future in mapAhead(generateOne, links, workers)]
+
+    print(f"{LATENCY * 1000:.0f}ms per Spotify request, {len(links)} links")
+    for workers, rateLimit in [(3, 0), (16, 0), (3, 20), (16, 20)]:
+        limit = f"{rateLimit} req/s" if rateLimit else "no limit"
+        results = []
+        for batched in [False, True]:
+            client = FakeSpotify(rateLimit)
+            plugin = getPlugin(client, batched)
+            seconds = measure(lambda: results.append(generate(plugin, workers)))
+            name = "batched" if batched else "one per request"
+            print(
+                f"  {workers:2} workers, {limit}, {name}: {seconds:.2f}s,"
+                f" requests {dict(client.calls)}"
+            )
+        assert results[0] == results[1], "links resolved differently"
+
+    results = []
+    pageWorkers = spotify.PLAYLIST_PAGE_WORKERS
+    for workers in [1, pageWorkers]:
+        spotify.PLAYLIST_PAGE_WORKERS = workers
+        client = FakeSpotify()
+        plugin = getPlugin(client)
+        seconds = measure(
+            lambda: results.append(plugin.generatePlaylistItem(dz, "p1", 9))
+        )
+        cached = plugin.cache.db.execute("SELECT COUNT(*) FROM spotify").fetchone()[0]
+        print(
+            f"  playlist of {PLAYLIST_SIZE}, {workers} page workers: {seconds:.2f}s,"
+            f" requests {dict(client.calls)}, explicit {results[-1].explicit},"
+            f" ISRCs cached {cached}"
+        )
+    spotify.PLAYLIST_PAGE_WORKERS = pageWorkers
+    assert results[0].conversion_data == results[1].conversion_data
+    print("  same playlist items in the same order")
+
+    # A batch without one of its ids looks it up alone
+    client = FakeSpotify()
+    plugin = getPlugin(client)
+    found = {}
+
+    def getTrack(trackId):
+        try:
+            found[trackId] = plugin.getTrack(trackId)["isrc"]
+        except ValueError:
+            found[trackId] = None
+
+    threads = [
+        threading.Thread(target=getTrack, args=(trackId,))
+        for trackId in ["t1", "tbad", "t2"]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"  batch missing an id: requests {dict(client.calls)}, ISRCs {found}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""A Spotify playlist converted before its download vs downloaded while it's
+converted, with simulated lookups and downloads
+
+    python benchmarks/bench_spotify_stream.py [tracks]
+"""
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from time import perf_counter, sleep
+from types import SimpleNamespace
+
+from common import measure
+
+from deemix.downloader import Downloader
+from deemix.plugins.spotify import Spotify
+from deemix.scheduler import Scheduler
+from deemix.settings import DEFAULTS
+from deemix.types.DownloadObjects import Convertable
+
+state = {"start": 0, "first": None, "batches": [], "tracks": None}
+lock = threading.Lock()
+
+
+class FakeAPI:
+    def get_track_by_ISRC(self, isrc):
+        sleep(0.02)
+        i = int(isrc[4:])
+        return {"id": i, "title": f"Title {i}", "artist": {"name": "Artist"}}
+
+
+class SimulatedDownloader(Downloader):
+    """Records the prefetch batches and the first download, sleeps to stream"""
+
+    def prefetchTracks(self, tracks):
+        state["batches"].append(len(tracks))
+        return tracks
+
+    def prefetchURLs(self, tracks):
+        return tracks
+
+    def prefetchAlbums(self, tracks):
+        return {}
+
+    def getTrack(self, extraData, track=None):
+        return track or SimpleNamespace(id=extraData["trackAPI"]["id"])
+
+    def prepareDownload(self, extraData, track=None):
+        return {
+            "track": self.getTrack(extraData, track),
+            "downloaded": True,
+            "position": extraData["trackAPI"]["position"],
+        }
+
+    def streamDownload(self, job, restarted=False):
+        with lock:
+            if state["first"] is None:
+                state["first"] = perf_counter() - state["start"]
+        sleep(0.01)
+        return True
+
+    def tagDownload(self, job):
+        return True
+
+    def completeDownload(self, job):
+        return {"id": job["track"].id, "position": job["position"]}
+
+    def reportResult(self, result):
+        pass
+
+    def afterDownloadCollection(self, tracks):
+        # What the m3u8 is written from
+        state["tracks"] = [track.result() for track in tracks]
+
+
+def getPlaylist(size):
+    return Convertable(
+        {
+            "type": "spotify_playlist",
+            "id": "1",
+            "bitrate": 9,
+            "title": "Playlist",
+            "artist": "Artist",
+            "cover": "",
+            "explicit": False,
+            "size": size,
+            "collection": {"tracks": [], "playlistAPI": {"id": "1"}},
+            "plugin": "spotify",
+            "conversion_data": [
+                {
+                    "id": f"sp{i}",
+                    "name": f"Title {i}",
+                    "artists": [{"name": "Artist"}],
+                    "album": {"name": "Album"},
+                    "external_ids": {"isrc": f"ISRC{i:08d}"},
+                    "explicit": False,
+                }
+                for i in range(1, size + 1)
+            ],
+        }
+    )
+
+
+def getPlugin():
+    plugin = Spotify(configFolder=Path(tempfile.mkdtemp()))
+    plugin.loadSettings = lambda: None
+    plugin.setup()
+    plugin.enabled = True
+    return plugin
+
+
+def run(size, stream):
+    dz = SimpleNamespace(api=FakeAPI())
+    plugin = getPlugin()
+    result = {"playlist": getPlaylist(size)}
+
+    def download():
+        scheduler = Scheduler(DEFAULTS)
+        if stream:
+            playlist, tracks = plugin.convertStream(dz, result["playlist"], DEFAULTS)
+            scheduler.add(SimulatedDownloader(dz, playlist, DEFAULTS, None, tracks))
+        else:
+            playlist = plugin.convert(dz, result["playlist"], DEFAULTS)
+            scheduler.add(SimulatedDownloader(dz, playlist, DEFAULTS))
+        scheduler.start()
+        result["playlist"] = playlist
+
+    state.update(start=perf_counter(), first=None, batches=[], tracks=None)
+    seconds = measure(download)
+    return {
+        "seconds": seconds,
+        "first": state["first"],
+        "batches": state["batches"],
+        "tracks": state["tracks"],
+        "collection": result["playlist"].collection["tracks"],
+        "size": result["playlist"].size,
+    }
+
+
+def main(size=500):
+    print(f"{size} tracks, 20ms per ISRC lookup")
+    runs = {
+        "convert, then download": run(size, False),
+        "streamed": run(size, True),
+    }
+    for name, result in runs.items():
+        print(
+            f"  {name}: {result['seconds']:.2f}s,"
+            f" first download after {result['first']:.2f}s,"
+            f" prefetch batches {result['batches']}"
+        )
+    before, after = runs.values()
+    assert after["tracks"] == before["tracks"], "m3u8 differs"
+    assert [track["position"] for track in after["tracks"]] == list(range(1, size + 1))
+    assert after["collection"] == before["collection"], "collection differs"
+    assert after["size"] == before["size"] == size
+    print("  same m3u8 order, positions and collection tracks")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
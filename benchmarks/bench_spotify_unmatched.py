@@ -0,0 +1,125 @@
+"""Syncs of a Spotify playlist with tracks missing on Deezer, looked up on
+every sync vs cached and re-checked with backoff
+
+    python benchmarks/bench_spotify_unmatched.py [tracks] [missing]
+
+Looked up on every sync is unmatchedRecheckHours 0, what the conversion did
+before. The clock of the plugin is moved forward between the syncs.
+"""
+import sys
+import tempfile
+import threading
+from collections import Counter
+from time import sleep, time
+from types import SimpleNamespace
+from unittest import mock
+
+from common import measure
+from deezer.errors import DataException
+
+import deemix.plugins.spotify as spotify
+from deemix.settings import DEFAULTS
+
+SYNCS = [
+    ("sync 1", 0),
+    ("sync 2, 1h later", 3600),
+    ("sync 3, 25h later", 24 * 3600),
+    ("sync 4, 26h later", 3600),
+    ("sync 5, 49h later", 23 * 3600),
+]
+
+
+class FakeAPI:
+    """The tracks below missing aren't on Deezer, the search finds nothing"""
+
+    def __init__(self, missing):
+        self.missing = missing
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def hit(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        sleep(0.01)
+
+    def get_track_by_ISRC(self, isrc):
+        self.hit("isrc")
+        if int(isrc[4:]) < self.missing:
+            raise DataException("DataException: track/isrc no data")
+        return {"id": isrc[4:], "title": "Title"}
+
+    def get_track_id_from_metadata(self, artist, title, album):
+        self.hit("search")
+        return "0"
+
+
+def getPlugin():
+    plugin = spotify.Spotify(configFolder=tempfile.mkdtemp())
+    plugin.enabled = True
+    plugin.settings["fallbackSearch"] = True
+    plugin.cache.open(plugin.configFolder.parent / "cache.db")
+    return plugin
+
+
+def main(size=200, missing=50):
+    tracklist = [
+        {
+            "id": f"sp{i}",
+            "name": f"Title {i}",
+            "album": {"name": "Album"},
+            "artists": [{"name": "Artist"}],
+            "external_ids": {"isrc": f"ISRC{i:08d}"},
+        }
+        for i in range(size)
+    ]
+    settings = {**DEFAULTS, "metadataConcurrency": 4}
+    print(f"{size} tracks, {missing} missing on Deezer, fallbackSearch on")
+
+    results = {}
+    for name, hours in [("every sync", 0), ("cached", 24)]:
+        plugin = getPlugin()
+        plugin.settings["unmatchedRecheckHours"] = hours
+        now = [time()]
+        results[name] = []
+        with mock.patch.object(spotify, "time", lambda: now[0]):
+            for label, later in SYNCS:
+                now[0] += later
+                api = FakeAPI(missing)
+                playlist = SimpleNamespace(
+                    isCanceled=False,
+                    conversion_data=tracklist,
+                    size=size,
+                    uuid="1",
+                    title="Playlist",
+                )
+                tracks = []
+                seconds = measure(
+                    lambda: tracks.extend(
+                        plugin.convertTracks(
+                            SimpleNamespace(api=api), playlist, settings
+                        )
+                    )
+                )
+                results[name].append(tracks)
+                print(
+                    f"  {name}, {label}: {seconds:.2f}s,"
+                    f" {sum(api.calls.values())} requests {dict(api.calls)}"
+                )
+            if name == "cached":
+                report = plugin.getUnmatched(days=2)
+                print(f"  missing for 2 days: {len(report)}, the first {report[0]}")
+
+                # A track that comes to Deezer leaves the report
+                now[0] += 30 * 86400
+                api = FakeAPI(0)
+                list(plugin.convertTracks(SimpleNamespace(api=api), playlist, settings))
+                print(
+                    f"  30 days later, all on Deezer: {dict(api.calls)},"
+                    f" missing {len(plugin.getUnmatched())}"
+                )
+    assert results["every sync"] == results["cached"], "tracks differ"
+    print("  same converted tracks in every sync")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
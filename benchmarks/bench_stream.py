@@ -0,0 +1,43 @@
+"""Throughput of streamTrack decrypting a track, against the baseline loop
+
+    python benchmarks/bench_stream.py [MB]
+"""
+import os
+import sys
+from io import BytesIO
+
+from common import (
+    MB,
+    TRACK_ID,
+    NullStream,
+    baselineStream,
+    encrypt,
+    fakeTrack,
+    getCollection,
+    measure,
+    serving,
+)
+from deemix.decryption import streamTrack
+
+
+def main(size=50):
+    data = encrypt(TRACK_ID, b"\x01" + os.urandom(size * MB - 1))
+    track = fakeTrack("https://cdn/mobile/1/track")
+
+    expected = BytesIO()
+    baselineStream(expected, data, TRACK_ID)
+    output = BytesIO()
+    with serving(data):
+        streamTrack(output, track)
+    assert output.getvalue() == expected.getvalue(), "outputs differ"
+
+    baseline = measure(baselineStream, NullStream(), data, TRACK_ID, getCollection())
+    with serving(data):
+        current = measure(streamTrack, NullStream(), track, 0, getCollection())
+    print(f"{size} MB crypted stream, identical output")
+    print(f"  baseline loop: {size / baseline:7.1f} MB/s")
+    print(f"  streamTrack:   {size / current:7.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,122 @@
+"""Helpers shared by the benchmarks, run them from the repository root"""
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+from types import SimpleNamespace
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "tests"))
+
+# pylint: disable=C0413,W0611
+from Cryptodome.Cipher import Blowfish
+
+import deemix.decryption
+from deemix.types.DownloadObjects import Collection
+from deemix.utils.crypto import BLOWFISH_IV, generateBlowfishKey
+from stubs import (
+    ALL_TAGS,
+    CDN,
+    TRACK_ID,
+    encrypt,
+    fakeTrack,
+    getTaggedTrack,
+    makeFLAC,
+)
+
+MB = 1024 * 1024
+
+
+class FakeResponse:
+    """In memory response of requests, the body is sent in chunkSize chunks"""
+
+    def __init__(self, data, chunkSize=None):
+        self.data = data
+        self.chunkSize = chunkSize
+        self.status_code = 200
+        self.headers = {"Content-Length": str(len(data))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunkSize):
+        chunkSize = self.chunkSize or chunkSize
+        view = memoryview(self.data)
+        for position in range(0, len(self.data), chunkSize):
+            yield bytes(view[position : position + chunkSize])
+
+
+@contextmanager
+def serving(data, chunkSize=None):
+    """Makes streamTrack read data without any network"""
+    session = SimpleNamespace(get=lambda *args, **kwargs: FakeResponse(data, chunkSize))
+    getSession = deemix.decryption.getSession
+    deemix.decryption.getSession = lambda: session
+    try:
+        yield
+    finally:
+        deemix.decryption.getSession = getSession
+
+
+class NullStream:
+    def write(self, data):
+        return len(data)
+
+
+def baselineStream(outputStream, data, trackId, downloadObject=None, crypted=True):
+    """The stream loop as it was before the optimizations, for comparison
+
+    Chunks of 6144 bytes, a new Blowfish cipher for every stripe, the
+    leading nulls found byte by byte and the progress computed per chunk.
+    """
+    key = generateBlowfishKey(str(trackId))
+    isStart = True
+    for position in range(0, len(data), 2048 * 3):
+        chunk = data[position : position + 2048 * 3]
+        if crypted and len(chunk) >= 2048:
+            decrypted = Blowfish.new(key, Blowfish.MODE_CBC, BLOWFISH_IV).decrypt(
+                chunk[0:2048]
+            )
+            chunk = decrypted + chunk[2048:]
+        if isStart and chunk[0] == 0 and chunk[4:8].decode("utf-8") != "ftyp":
+            for i, byte in enumerate(chunk):
+                if byte != 0:
+                    break
+            chunk = chunk[i:]
+        isStart = False
+        outputStream.write(chunk)
+        if downloadObject:
+            downloadObject.progressNext += (
+                (len(chunk) / len(data)) / downloadObject.size * 100
+            )
+            downloadObject.updateProgress()
+
+
+def getCollection(size=10):
+    """A download object of size tracks, for the progress of the stream"""
+    return Collection(
+        {
+            "type": "album",
+            "id": "1",
+            "bitrate": 3,
+            "title": "Benchmark",
+            "artist": "Artist",
+            "cover": "",
+            "size": size,
+            "collection": {},
+        }
+    )
+
+
+def measure(function, *args, **kwargs):
+    """Returns the seconds function took"""
+    start = perf_counter()
+    function(*args, **kwargs)
+    return perf_counter() - start
@@ -0,0 +1,349 @@
+"""Fake Deezer clients and a local gw-light server counting their calls"""
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
+from time import sleep, time
+from urllib.parse import parse_qs, urlparse
+import json
+
+import requests
+
+ALBUM_ID = "302127"
+FIRST_TRACK_ID = 3135550
+PICTURE = "https://e-cdns-images.dzcdn.net/images/artist/f2bc007e9133c946ac3c3907ddc5d2ea/56x56-000000-80-0-0.jpg"
+ARTIST_GW = {
+    "ART_ID": "27",
+    "ART_NAME": "Daft Punk",
+    "ART_PICTURE": "f2bc007e9133c946ac3c3907ddc5d2ea",
+    "ROLE_ID": "0",
+    "ARTISTS_SONGS_ORDER": "0",
+}
+
+
+def gwTrack(i, lyricsId="1234"):
+    return {
+        "SNG_ID": str(FIRST_TRACK_ID + i),
+        "SNG_TITLE": f"Song {i}",
+        "ISRC": f"GBDUW0000{i:03d}",
+        "DURATION": "200",
+        "ALB_PICTURE": "2e018122cb56986277102d2041a592c8",
+        "ART_ID": "27",
+        "ART_NAME": "Daft Punk",
+        "ALB_ID": ALBUM_ID,
+        "ALB_TITLE": "Discovery",
+        "MD5_ORIGIN": "51afcde9f56a132096c0496cc95eb24b",
+        "FILESIZE": "8000000",
+        "FILESIZE_MP3_128": "3000000",
+        "FILESIZE_MP3_320": "8000000",
+        "FILESIZE_FLAC": "25000000",
+        "MEDIA_VERSION": "8",
+        "TRACK_TOKEN": f"token{i}",
+        "TRACK_TOKEN_EXPIRE": int(time()) + 3 * 3600,
+        "TRACK_NUMBER": str(i),
+        "DISK_NUMBER": "1",
+        "RANK_SNG": "700000",
+        "PHYSICAL_RELEASE_DATE": "2001-03-07",
+        "EXPLICIT_LYRICS": "0",
+        "MEDIA": [{"HREF": "https://cdns-preview/preview.mp3"}],
+        "GAIN": "-9.2",
+        "ARTISTS": [ARTIST_GW],
+        "SNG_CONTRIBUTORS": {"composer": ["Thomas Bangalter"]},
+        "LYRICS_ID": lyricsId,
+        "VERSION": "",
+        "COPYRIGHT": "(c) Daft Life",
+        "FALLBACK": {"SNG_ID": "1"},
+        "EXPLICIT_TRACK_CONTENT": {
+            "EXPLICIT_LYRICS_STATUS": 0,
+            "EXPLICIT_COVER_STATUS": 0,
+        },
+    }
+
+
+def apiTrack(i):
+    return {
+        "id": FIRST_TRACK_ID + i,
+        "title": f"Song {i}",
+        "bpm": 123.4,
+        "release_date": "2001-03-07",
+        "contributors": [{"id": 27, "name": "Daft Punk", "role": "Main"}],
+        "gain": -9.2,
+    }
+
+
+def apiArtist():
+    return {"id": 27, "name": "Daft Punk", "picture_small": PICTURE}
+
+
+def apiAlbum():
+    return {
+        "id": int(ALBUM_ID),
+        "title": "Discovery",
+        "upc": "724384960650",
+        "md5_image": "2e018122cb56986277102d2041a592c8",
+        "genres": {"data": [{"id": 113, "name": "Dance"}]},
+        "label": "Parlophone",
+        "nb_tracks": 14,
+        "duration": 3660,
+        "release_date": "2001-03-07",
+        "record_type": "album",
+        "explicit_lyrics": False,
+        "contributors": [{**apiArtist(), "role": "Main"}],
+        "artist": apiArtist(),
+        "tracks": {"data": []},
+    }
+
+
+def gwAlbum():
+    return {
+        "ALB_ID": ALBUM_ID,
+        "ALB_TITLE": "Discovery",
+        "ALB_PICTURE": "2e018122cb56986277102d2041a592c8",
+        "ART_ID": "27",
+        "ART_NAME": "Daft Punk",
+        "NUMBER_TRACK": "14",
+        "NUMBER_DISK": "1",
+        "COPYRIGHT": "(c) Daft Life",
+        "PHYSICAL_RELEASE_DATE": "2001-03-07",
+        "ORIGINAL_RELEASE_DATE": "2001-03-07",
+        "UPC": "724384960650",
+        "LABEL_NAME": "Parlophone",
+        "TYPE": "1",
+        "ARTISTS": [ARTIST_GW],
+        "EXPLICIT_ALBUM_CONTENT": {"EXPLICIT_LYRICS_STATUS": 0},
+    }
+
+
+def getTrackIndex(trackId):
+    return int(trackId) - FIRST_TRACK_ID
+
+
+class GWServer:
+    """Local gw-light server answering the methods the downloads use
+
+    Every call waits latency seconds. Songs in unavailable are left out of
+    song.getListData, like the songs gw can't stream.
+    """
+
+    def __init__(self, latency=0.02, unavailable=(), lyricsId="1234"):
+        self.latency = latency
+        self.unavailable = set(unavailable)
+        self.lyricsId = lyricsId
+        self.calls = Counter()
+        self.lock = Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.getHandler())
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/ajax/gw-light.php"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def answer(self, method, args):
+        if method == "deezer.getUserData":
+            return {"checkForm": "token"}
+        if method == "deezer.pageTrack":
+            return {
+                "DATA": gwTrack(getTrackIndex(args["SNG_ID"]), self.lyricsId),
+                "LYRICS": {"LYRICS_TEXT": "la"},
+                "ISRC": {
+                    "data": [{"ALB_ID": "9", "RIGHTS": {"STREAM_ADS_AVAILABLE": True}}]
+                },
+            }
+        if method == "song.getListData":
+            return {
+                "data": [
+                    gwTrack(getTrackIndex(trackId), self.lyricsId)
+                    for trackId in args["SNG_IDS"]
+                    if getTrackIndex(trackId) not in self.unavailable
+                ],
+                "count": 0,
+            }
+        if method == "song.getLyrics":
+            return {"LYRICS_ID": self.lyricsId, "LYRICS_TEXT": "la"}
+        if method == "album.getData":
+            return gwAlbum()
+        raise ValueError(f"Unknown gw method {method}")
+
+    def getHandler(self):
+        gw = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                method = parse_qs(urlparse(self.path).query)["method"][0]
+                length = int(self.headers["Content-Length"])
+                args = json.loads(self.rfile.read(length) or b"{}")
+                with gw.lock:
+                    gw.calls[method] += 1
+                sleep(gw.latency)
+                body = json.dumps(
+                    {"error": [], "results": gw.answer(method, args)}
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def getSession(self):
+        """A requests session sending every gw call to this server"""
+        url = self.url
+
+        class Session(requests.Session):
+            def post(self, _, **kwargs):  # pylint: disable=W0221
+                return super().post(url, **kwargs)
+
+        return Session()
+
+
+class APIServer:
+    """Local api.deezer.com answering the calls of the Spotify conversion
+
+    Every call waits latency seconds. One ISRC in 10 isn't found, so its
+    track goes through the metadata search. calls counts the requests and
+    maxInFlight the most that were served at once.
+    """
+
+    def __init__(self, latency=0.04):
+        self.latency = latency
+        self.calls = 0
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.lock = Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.getHandler())
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.calls = 0
+            self.maxInFlight = 0
+
+    @classmethod
+    def answer(cls, path):
+        if path.startswith("/track/isrc:"):
+            i = int(path[len("/track/isrc:ISRC") :])
+            if i % 10 == 0:
+                return {
+                    "error": {
+                        "type": "DataException",
+                        "message": "no data",
+                        "code": 800,
+                    }
+                }
+            return {"id": i, "title": f"Song {i}"}
+        if path.startswith("/search/track"):
+            return {"data": [{"id": 777}]}
+        if path.startswith("/track/"):
+            return {"id": int(path[len("/track/") :]), "title": "Searched"}
+        return {"data": []}
+
+    def getHandler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with api.lock:
+                    api.calls += 1
+                    api.inFlight += 1
+                    api.maxInFlight = max(api.maxInFlight, api.inFlight)
+                sleep(api.latency)
+                body = json.dumps(api.answer(urlparse(self.path).path)).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with api.lock:
+                    api.inFlight -= 1
+
+        return Handler
+
+    def redirect(self, dz):
+        """Sends the api calls of the Deezer client dz to this server"""
+        get = dz.session.get
+        dz.session.get = lambda url, *args, **kwargs: get(
+            url.replace("https://api.deezer.com/", self.url), *args, **kwargs
+        )
+        return dz
+
+
+class CountedClient:
+    def __init__(self, owner, prefix):
+        self.owner = owner
+        self.prefix = prefix
+
+    def hit(self, name):
+        with self.owner.lock:
+            self.owner.calls[self.prefix + name] += 1
+        if self.owner.latency:
+            sleep(self.owner.latency)
+
+
+class FakeGW(CountedClient):
+    def get_track_with_fallback(self, trackId):
+        self.hit("get_track_with_fallback")
+        return gwTrack(getTrackIndex(trackId))
+
+    def get_track(self, trackId):
+        self.hit("get_track")
+        return gwTrack(getTrackIndex(trackId))
+
+    def get_track_lyrics(self, _):
+        self.hit("get_track_lyrics")
+        return {"LYRICS_ID": "1234", "LYRICS_TEXT": "la la\nlo lo"}
+
+    def get_album(self, _):
+        self.hit("get_album")
+        return gwAlbum()
+
+    def api_call(self, method, args):
+        self.hit(method)
+        if method == "song.getListData":
+            return {"data": [gwTrack(getTrackIndex(i)) for i in args["SNG_IDS"]]}
+        raise ValueError(f"Unknown gw method {method}")
+
+
+class FakeAPI(CountedClient):
+    def get_track(self, trackId):
+        self.hit("get_track")
+        return apiTrack(getTrackIndex(trackId))
+
+    def get_album(self, _):
+        self.hit("get_album")
+        return apiAlbum()
+
+    def get_artist(self, _):
+        self.hit("get_artist")
+        return apiArtist()
+
+
+class FakeDeezer:
+    """Deezer client answering from the data above, calls are counted"""
+
+    def __init__(self, latency=0):
+        self.calls = Counter()
+        self.lock = Lock()
+        self.latency = latency
+        self.gw = FakeGW(self, "gw.")
+        self.api = FakeAPI(self, "api.")
+        self.current_user = {
+            "id": 1,
+            "country": "FR",
+            "can_stream_lossless": True,
+            "can_stream_hq": True,
+            "license_token": "token",
+        }
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import logging
 import click
 from pathlib import Path
 
@@ -7,9 +8,16 @@ from deezer import TrackFormats
 
 from deemix import generateDownloadObject
 from deemix.settings import load as loadSettings
-from deemix.utils import getBitrateNumberFromText, formatListener
+from deemix.utils import (
+    getBitrateNumberFromText,
+    getBandwidthFromText,
+    formatListener,
+)
 import deemix.utils.localpaths as localpaths
+from deemix.utils.cache import setupMetadataCache
 from deemix.downloader import Downloader
+from deemix.scheduler import Scheduler
+from deemix.utils.pipeline import mapAhead
 from deemix.itemgen import GenerationError
 
 try:
@@ -17,6 +25,13 @@ try:
 except ImportError:
     Spotify = None
 
+try:
+    from deemix.asyncdownloader import AsyncDownloader
+except ImportError:
+    AsyncDownloader = None
+
+logger = logging.getLogger("deemix")
+
 
 class LogListener:
     @classmethod
@@ -36,13 +51,34 @@ class LogListener:
     "-b", "--bitrate", default=None, help="Overwrites the default bitrate selected"
 )
 @click.option("-p", "--path", type=str, help="Downloads in the given folder")
+@click.option(
+    "--engine",
+    type=click.Choice(["thread", "async"]),
+    default="thread",
+    help="Downloads tracks in a thread pool or on an asyncio event loop (needs aiohttp)",
+)
+@click.option(
+    "--limit-rate",
+    "limitRate",
+    default=None,
+    help="Caps the download bandwidth, in bytes per second (e.g. 800K, 10M, 0 for no limit)",
+)
 @click.argument("url", nargs=-1, required=True)
-def download(url, bitrate, portable, path):
+def download(url, bitrate, portable, path, engine, limitRate):
+    if engine == "async" and not AsyncDownloader:
+        raise click.UsageError("The async engine needs aiohttp to be installed")
+    if limitRate is not None:
+        limitRate = getBandwidthFromText(limitRate)
+        if limitRate is None:
+            raise click.BadParameter("Invalid rate", param_hint="--limit-rate")
+    downloaderClass = AsyncDownloader if engine == "async" else Downloader
+
     # Check for local configFolder
     localpath = Path(".")
     configFolder = localpath / "config" if portable else localpaths.getConfigFolder()
 
     settings = loadSettings(configFolder)
+    setupMetadataCache(configFolder / "metadata.db")
     dz = Deezer()
     listener = LogListener()
 
@@ -79,31 +115,53 @@ def download(url, bitrate, portable, path):
             else:
                 links.append(link)
 
-        downloadObjects = []
-
-        for link in links:
-            try:
-                downloadObject = generateDownloadObject(
-                    dz, link, bitrate, plugins, listener
-                )
-            except GenerationError as e:
-                print(f"{e.link}: {e.message}")
-                continue
-            if isinstance(downloadObject, list):
-                downloadObjects += downloadObject
-            else:
-                downloadObjects.append(downloadObject)
-
-        for obj in downloadObjects:
-            if obj.__type__ == "Convertable":
-                obj = plugins[obj.plugin].convert(dz, obj, settings, listener)
-            Downloader(dz, obj, settings, listener).start()
+        def generate(link):
+            return generateDownloadObject(dz, link, bitrate, plugins, listener)
+
+        def generateDownloaders():
+            """Resolves the links ahead in a pool, yields their downloaders in order"""
+            workers = settings["metadataConcurrency"] or settings["queueConcurrency"]
+            for link, future in zip(links, mapAhead(generate, links, workers)):
+                try:
+                    downloadObject = future.result()
+                except GenerationError as e:
+                    print(f"{e.link}: {e.message}")
+                    continue
+                except Exception as e:
+                    # The next links are still downloaded
+                    logger.exception("Couldn't resolve %s: %s", link.strip(), e)
+                    continue
+                if not isinstance(downloadObject, list):
+                    downloadObject = [downloadObject]
+                for obj in downloadObject:
+                    tracks = None
+                    if obj.__type__ == "Convertable":
+                        # Tracks are downloaded as soon as they are converted
+                        try:
+                            obj, tracks = plugins[obj.plugin].convertStream(
+                                dz, obj, settings, listener
+                            )
+                        except Exception as e:
+                            logger.exception("Couldn't convert %s: %s", link.strip(), e)
+                            continue
+                    yield downloaderClass(dz, obj, settings, listener, tracks)
+
+        if downloaderClass is Downloader:
+            # The tracks of all the links share the same workers
+            scheduler = Scheduler(settings)
+            scheduler.add(generateDownloaders())
+            scheduler.start()
+        else:
+            for downloader in generateDownloaders():
+                downloader.start()
 
     if path is not None:
         if path == "":
             path = "."
         path = Path(path)
         settings["downloadLocation"] = str(path)
+    if limitRate is not None:
+        settings["maxBandwidth"] = limitRate
     url = list(url)
     if bitrate:
         bitrate = getBitrateNumberFromText(bitrate)
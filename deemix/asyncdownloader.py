@@ -0,0 +1,248 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+
+import aiohttp
+
+from deemix.types.DownloadObjects import Single, Collection
+from deemix.utils.bandwidth import bandwidthLimiter
+from deemix.utils.retry import Retrying
+from deemix.decryption import STREAM_BUFFER_SIZE, StreamWriter, getStreamHeaders
+from deemix.downloader import Downloader, getItemData
+from deemix.errors import DownloadCanceled, DownloadFailed
+
+logger = logging.getLogger("deemix")
+
+RETRYABLE_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+# Decryption and tagging are CPU bound, more threads would only contend the GIL
+CPU_WORKERS = 2
+
+
+async def aiterBuffers(response, bufferSize=STREAM_BUFFER_SIZE):
+    """Yields the response body as views of a reusable buffer, like iterBuffers"""
+    buffer = bytearray(bufferSize)
+    view = memoryview(buffer)
+    filled = 0
+    async for chunk in response.content.iter_chunked(bufferSize):
+        chunk = memoryview(chunk)
+        while chunk:
+            size = min(len(chunk), bufferSize - filled)
+            view[filled : filled + size] = chunk[:size]
+            filled += size
+            chunk = chunk[size:]
+            if filled == bufferSize:
+                yield view
+                filled = 0
+    if filled:
+        yield view[:filled]
+
+
+async def streamTrackAsync(
+    session,
+    outputStream,
+    track,
+    start=0,
+    downloadObject=None,
+    listener=None,
+    partial=None,
+    executor=None,
+    decrypt=True,
+):
+    """Downloads and decrypts the track in outputStream, like streamTrack
+
+    The download runs on the event loop, every buffer is then decrypted and
+    written in executor.
+    """
+    loop = asyncio.get_running_loop()
+    writer = StreamWriter(
+        outputStream, track, start, downloadObject, listener, partial, decrypt
+    )
+    received = start
+    bandwidthKey = downloadObject.uuid if downloadObject else None
+
+    retrying = Retrying(track.downloadURL)
+    while True:
+        if downloadObject and downloadObject.isCanceled:
+            raise DownloadCanceled
+        delay = retrying.getPause()
+        if delay:
+            await asyncio.sleep(delay)
+        # Every attempt resumes from the last buffer received
+        start = received
+        try:
+            async with session.get(
+                track.downloadURL, headers=getStreamHeaders(start)
+            ) as response:
+                response.raise_for_status()
+                writer.begin(start, response.status, response.headers)
+                async for data in aiterBuffers(response):
+                    if downloadObject and downloadObject.isCanceled:
+                        raise DownloadCanceled
+                    delay = bandwidthLimiter.reserve(bandwidthKey, len(data), listener)
+                    if delay:
+                        await asyncio.sleep(delay)
+                    received += len(data)
+                    # The buffer is reused only once it has been written
+                    await loop.run_in_executor(executor, writer.write, data, received)
+            retrying.success()
+            return
+        except RETRYABLE_ERRORS as e:
+            if received > start:
+                retrying.reset()
+            delay = retrying.nextDelay(e)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+
+
+class AsyncDownloader(Downloader):
+    """Downloader running all the tracks of an item on a single event loop
+
+    Streams are limited by settings["asyncConcurrency"], metadata requests
+    still go through the blocking Deezer client in queueConcurrency threads.
+    """
+
+    HTTP_ERROR = aiohttp.ClientResponseError
+    RETRYABLE_ERRORS = RETRYABLE_ERRORS
+
+    def __init__(self, dz, downloadObject, settings, listener=None, tracks=None):
+        super().__init__(dz, downloadObject, settings, listener, tracks)
+        self.session = None
+        self.semaphore = None
+        self.ioExecutor = None
+        self.cpuExecutor = None
+
+    def start(self):
+        if not self.downloadObject.isCanceled:
+            if isinstance(self.downloadObject, Single):
+                tasks = asyncio.run(
+                    self.downloadAll(
+                        [
+                            {
+                                "trackAPI": self.downloadObject.single.get("trackAPI"),
+                                "albumAPI": self.downloadObject.single.get("albumAPI"),
+                            }
+                        ]
+                    )
+                )
+                track = tasks[0].result()
+                if track:
+                    self.afterDownloadSingle(track)
+            elif isinstance(self.downloadObject, Collection):
+                tasks = asyncio.run(self.downloadAll(self.iterCollectionExtraData()))
+                self.afterDownloadCollection(tasks)
+
+        self.sendFinished()
+
+    async def downloadAll(self, extraDataList):
+        """Downloads all the tracks, returns their finished tasks in order
+
+        extraDataList can be an iterator that blocks, like the tracks of a
+        conversion, it's read in a thread and every track starts downloading
+        as soon as it's read.
+        """
+        loop = asyncio.get_running_loop()
+        concurrency = self.settings["asyncConcurrency"]
+        self.semaphore = asyncio.Semaphore(concurrency)
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=self.settings["connectTimeout"],
+            sock_read=self.settings["readTimeout"],
+        )
+        self.ioExecutor = ThreadPoolExecutor(self.settings["queueConcurrency"])
+        self.cpuExecutor = ThreadPoolExecutor(CPU_WORKERS)
+        # A thread of its own, reading the tracks doesn't hold an io worker
+        readExecutor = ThreadPoolExecutor(1)
+        tasks = []
+        try:
+            async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout
+            ) as self.session:
+                extraDataList = iter(extraDataList)
+                while True:
+                    extraData = await loop.run_in_executor(
+                        readExecutor, next, extraDataList, None
+                    )
+                    if extraData is None:
+                        break
+                    tasks.append(
+                        asyncio.create_task(self.downloadWrapperAsync(extraData))
+                    )
+                if tasks:
+                    await asyncio.wait(tasks)
+        finally:
+            readExecutor.shutdown()
+            self.ioExecutor.shutdown()
+            self.cpuExecutor.shutdown()
+        return tasks
+
+    async def downloadWrapperAsync(self, extraData, track=None):
+        loop = asyncio.get_running_loop()
+        itemData = getItemData(extraData)
+
+        try:
+            result = await self.downloadAsync(extraData, track)
+        except DownloadFailed as error:
+            track = await loop.run_in_executor(
+                self.ioExecutor, self.getFallbackTrack, error, itemData
+            )
+            if track:
+                return await self.downloadWrapperAsync(extraData, track)
+            result = self.getErrorResult(error, itemData)
+        except Exception as e:
+            result = self.getErrorResult(e, itemData)
+
+        self.reportResult(result)
+        return result
+
+    async def downloadAsync(self, extraData, track=None):
+        loop = asyncio.get_running_loop()
+        job = await loop.run_in_executor(
+            self.ioExecutor, self.prepareDownload, extraData, track
+        )
+        if job["downloaded"]:
+            async with self.semaphore:
+                downloaded = await self.streamDownloadAsync(job)
+            if not downloaded:
+                return await self.downloadAsync(extraData, track=job["track"])
+        result = await loop.run_in_executor(self.cpuExecutor, self.finishDownload, job)
+        if result is None:
+            return await self.downloadAsync(extraData, track=job["track"])
+        return result
+
+    async def streamDownloadAsync(self, job, restarted=False):
+        """Downloads the track in its .part file, like streamDownload
+
+        Returns False if the track must be downloaded again with another format
+        """
+        track = job["track"]
+        partial = job["partial"]
+        start = self.loadPartial(job)
+        try:
+            if not partial.isComplete():
+                with open(partial.path, "r+b" if start else "wb") as stream:
+                    stream.seek(partial.written)
+                    output = self.openTagStream(job, stream, start)
+                    await streamTrackAsync(
+                        self.session,
+                        output,
+                        track,
+                        start,
+                        downloadObject=self.downloadObject,
+                        listener=self.listener,
+                        partial=partial,
+                        executor=self.cpuExecutor,
+                        decrypt=not partial.crypted,
+                    )
+                    if output is not stream:
+                        partial.written += output.finish()
+            else:
+                self.downloadObject.completeTrackProgress(self.listener)
+            partial.save()
+        except BaseException as e:  # pylint: disable=W0703
+            if not self.recoverPartial(job, e, restarted):
+                return False
+            return await self.streamDownloadAsync(job, restarted=True)
+        self.log(job["itemData"], "downloaded")
+        return True
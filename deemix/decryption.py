@@ -1,29 +1,32 @@
-from ssl import SSLError
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
 import logging
-
-from requests import get
-from requests.exceptions import (
-    ConnectionError as RequestsConnectionError,
-    ReadTimeout,
-    ChunkedEncodingError,
-)
-from urllib3.exceptions import SSLError as u3SSLError
+import os
+import re
 
 from deemix.utils.crypto import (
     _md5,
     _ecbCrypt,
     _ecbDecrypt,
-    generateBlowfishKey,
-    decryptChunk,
+    getBlowfishContext,
 )
 
 from deemix.utils import USER_AGENT_HEADER
+from deemix.utils.bandwidth import bandwidthLimiter
+from deemix.utils.retry import Retrying, RETRYABLE_ERRORS
+from deemix.utils.session import getSession, getTimeout
 from deemix.types.DownloadObjects import Single
-from deemix.errors import DownloadCanceled, DownloadEmpty
+from deemix.errors import DownloadCanceled, DownloadEmpty, RangeNotSupported
 
 logger = logging.getLogger("deemix")
 
+# Tracks are encrypted in blocks of 6144 bytes where only the first 2048 bytes
+# are crypted, the buffer size must be a multiple of it
+STRIPE_GRID_SIZE = 2048 * 3
+STREAM_BUFFER_SIZE = STRIPE_GRID_SIZE * 32
+
+NOT_NULL = re.compile(rb"[^\x00]")
+
 
 def generateStreamPath(sng_id, md5, media_version, media_format):
     urlPart = b"\xa4".join(
@@ -67,83 +70,331 @@ def reverseStreamURL(url):
     return reverseStreamPath(urlPart)
 
 
-def streamTrack(outputStream, track, start=0, downloadObject=None, listener=None):
+def iterBuffers(request, bufferSize=STREAM_BUFFER_SIZE):
+    """Yields the response body as views of a reusable buffer
+
+    Every view but the last one is bufferSize long, so views stay aligned to
+    the stripe grid and can be decrypted in place and written out in bulk.
+    """
+    buffer = bytearray(bufferSize)
+    view = memoryview(buffer)
+    filled = 0
+    for chunk in request.iter_content(bufferSize):
+        chunk = memoryview(chunk)
+        while chunk:
+            size = min(len(chunk), bufferSize - filled)
+            view[filled : filled + size] = chunk[:size]
+            filled += size
+            chunk = chunk[size:]
+            if filled == bufferSize:
+                yield view
+                filled = 0
+    if filled:
+        yield view[:filled]
+
+
+def stripLeadingNulls(data):
+    # Some tracks start with null bytes that must be removed, mp4 files don't
+    if data[0] == 0 and data[4:8] != b"ftyp":
+        # Scans the buffer without copying it, keeps the last byte if all nulls
+        firstByte = NOT_NULL.search(data)
+        data = data[firstByte.start() if firstByte else len(data) - 1 :]
+    return data
+
+
+def isCryptedURL(url):
+    return "/mobile/" in url or "/media/" in url
+
+
+def getStreamHeaders(start):
+    """Headers of a request for the track, a range one when resuming from start"""
+    headers = {"User-Agent": USER_AGENT_HEADER}
+    if start != 0:
+        headers["Range"] = f"bytes={start}-"
+    return headers
+
+
+class StreamWriter:
+    """Decrypts and writes the buffers of the track, for streamTrack and
+    streamTrackAsync
+
+    begin checks the response of every attempt, then every buffer received is
+    passed to write. partial, if given, is notified of every buffer written.
+    """
+
+    def __init__(
+        self,
+        outputStream,
+        track,
+        start=0,
+        downloadObject=None,
+        listener=None,
+        partial=None,
+        decrypt=True,
+    ):
+        self.outputStream = outputStream
+        self.downloadObject = downloadObject
+        self.listener = listener
+        self.partial = partial
+        self.decrypt = decrypt
+        self.blowfish = None
+        if decrypt and isCryptedURL(track.downloadURL):
+            self.blowfish = getBlowfishContext(track.id)
+        self.itemData = {
+            "id": track.id,
+            "title": track.title,
+            "artist": track.mainArtist.name,
+        }
+        self.chunkLength = start
+        self.progressScale = 0
+        self.isSingle = False
+        self.isStart = False
+
+    def begin(self, start, status, headers):
+        """Checks the response of an attempt resuming from start"""
+        if start != 0 and status != 206:
+            raise RangeNotSupported
+
+        complete = int(headers["Content-Length"])
+        if complete == 0:
+            raise DownloadEmpty
+        if self.partial:
+            self.partial.size = complete + start
+        if self.listener:
+            self.listener.send(
+                "downloadInfo",
+                {
+                    "uuid": self.downloadObject.uuid,
+                    "data": self.itemData,
+                    "state": "downloading",
+                    "alreadyStarted": start != 0,
+                    "value": headers["Content-Range"] if start != 0 else complete,
+                },
+            )
+
+        # Progress of the download object for every byte written
+        if self.downloadObject:
+            self.isSingle = isinstance(self.downloadObject, Single)
+            self.progressScale = 100 / (complete + start)
+            if not self.isSingle:
+                self.progressScale /= self.downloadObject.size
+
+        # Leading nulls are only known once the start is decrypted
+        self.isStart = self.decrypt and start == 0
+
+    def write(self, data, received):
+        """Writes a buffer, received is the offset in the remote file after it"""
+        if self.blowfish:
+            self.blowfish.decryptStripes(data)
+        if self.isStart:
+            data = stripLeadingNulls(data)
+            self.isStart = False
+
+        written = self.outputStream.write(data)
+        self.chunkLength += len(data)
+        if self.partial:
+            self.partial.update(self.outputStream, received, written)
+
+        if self.progressScale:
+            if self.isSingle:
+                self.downloadObject.progressNext = self.chunkLength * self.progressScale
+            else:
+                self.downloadObject.progressNext += len(data) * self.progressScale
+            self.downloadObject.updateProgress(self.listener)
+
+
+def streamTrack(
+    outputStream,
+    track,
+    start=0,
+    downloadObject=None,
+    listener=None,
+    partial=None,
+    decrypt=True,
+):
+    """Downloads and decrypts the track in outputStream
+
+    start is the offset in the remote file to resume from, it must be aligned
+    to the stripe grid. partial, if given, is notified of every buffer written.
+    With decrypt unset the track is written as received, to be decrypted later.
+    """
+    writer = StreamWriter(
+        outputStream, track, start, downloadObject, listener, partial, decrypt
+    )
+    received = start
+    bandwidthKey = downloadObject.uuid if downloadObject else None
+
+    retrying = Retrying(track.downloadURL)
+    while True:
+        if downloadObject and downloadObject.isCanceled:
+            raise DownloadCanceled
+        retrying.check()
+        # Every attempt resumes from the last buffer received
+        start = received
+        try:
+            with getSession().get(
+                track.downloadURL,
+                headers=getStreamHeaders(start),
+                stream=True,
+                timeout=getTimeout(),
+            ) as request:
+                request.raise_for_status()
+                writer.begin(start, request.status_code, request.headers)
+                for data in iterBuffers(request):
+                    bandwidthLimiter.consume(bandwidthKey, len(data), listener)
+                    received += len(data)
+                    writer.write(data, received)
+            retrying.success()
+            return
+        except RETRYABLE_ERRORS as e:
+            if received > start:
+                retrying.reset()
+            if not retrying.backoff(e):
+                raise
+
+
+def writeAt(outputStream, data, position, lock):
+    if hasattr(os, "pwrite"):
+        fd = outputStream.fileno()
+        while data:
+            written = os.pwrite(fd, data, position)
+            data = data[written:]
+            position += written
+    else:
+        with lock:
+            outputStream.seek(position)
+            outputStream.write(data)
+
+
+def streamTrackSegmented(
+    outputStream,
+    track,
+    segments,
+    minSegmentSize,
+    downloadObject=None,
+    listener=None,
+    decrypt=True,
+):
+    """Downloads the track over multiple concurrent range requests
+
+    Segments are aligned to the stripe grid, so every segment can be decrypted
+    on its own, and are written in place in outputStream.
+    Falls back to streamTrack when the track is too small or the server
+    doesn't accept ranges. decrypt works as in streamTrack.
+    """
     if downloadObject and downloadObject.isCanceled:
         raise DownloadCanceled
     headers = {"User-Agent": USER_AGENT_HEADER}
-    chunkLength = start
-    isCryptedStream = "/mobile/" in track.downloadURL or "/media/" in track.downloadURL
+    isCryptedStream = decrypt and isCryptedURL(track.downloadURL)
 
     itemData = {"id": track.id, "title": track.title, "artist": track.mainArtist.name}
+    bandwidthKey = downloadObject.uuid if downloadObject else None
 
-    try:
-        with get(
-            track.downloadURL, headers=headers, stream=True, timeout=10
-        ) as request:
-            request.raise_for_status()
-            if isCryptedStream:
-                blowfish_key = generateBlowfishKey(str(track.id))
-
-            complete = int(request.headers["Content-Length"])
-            if complete == 0:
-                raise DownloadEmpty
-            if start != 0:
-                responseRange = request.headers["Content-Range"]
-                if listener:
-                    listener.send(
-                        "downloadInfo",
-                        {
-                            "uuid": downloadObject.uuid,
-                            "data": itemData,
-                            "state": "downloading",
-                            "alreadyStarted": True,
-                            "value": responseRange,
-                        },
-                    )
-            else:
-                if listener:
-                    listener.send(
-                        "downloadInfo",
-                        {
-                            "uuid": downloadObject.uuid,
-                            "data": itemData,
-                            "state": "downloading",
-                            "alreadyStarted": False,
-                            "value": complete,
-                        },
-                    )
-
-            isStart = True
-            for chunk in request.iter_content(2048 * 3):
-                if isCryptedStream:
-                    if len(chunk) >= 2048:
-                        chunk = decryptChunk(blowfish_key, chunk[0:2048]) + chunk[2048:]
-
-                if isStart and chunk[0] == 0 and chunk[4:8].decode("utf-8") != "ftyp":
-                    for i, byte in enumerate(chunk):
-                        if byte != 0:
-                            break
-                    chunk = chunk[i:]
-                isStart = False
-
-                outputStream.write(chunk)
-                chunkLength += len(chunk)
-
-                if downloadObject:
-                    if isinstance(downloadObject, Single):
-                        chunkProgres = (chunkLength / (complete + start)) * 100
-                        downloadObject.progressNext = chunkProgres
-                    else:
-                        chunkProgres = (
-                            (len(chunk) / (complete + start))
-                            / downloadObject.size
-                            * 100
-                        )
-                        downloadObject.progressNext += chunkProgres
-                    downloadObject.updateProgress(listener)
-
-    except (SSLError, u3SSLError):
-        streamTrack(outputStream, track, chunkLength, downloadObject, listener)
-    except (RequestsConnectionError, ReadTimeout, ChunkedEncodingError):
-        sleep(2)
-        streamTrack(outputStream, track, start, downloadObject, listener)
+    request = getSession().head(
+        track.downloadURL, headers=headers, timeout=getTimeout()
+    )
+    request.raise_for_status()
+    complete = int(request.headers.get("Content-Length", 0))
+    segments = min(segments, complete // max(minSegmentSize, 1))
+    if segments < 2 or request.headers.get("Accept-Ranges") != "bytes":
+        streamTrack(outputStream, track, 0, downloadObject, listener, decrypt=decrypt)
+        return
+
+    if isCryptedStream:
+        blowfish = getBlowfishContext(track.id)
+    segmentSize = -(-complete // segments)
+    segmentSize += -segmentSize % STRIPE_GRID_SIZE
+
+    if listener:
+        listener.send(
+            "downloadInfo",
+            {
+                "uuid": downloadObject.uuid,
+                "data": itemData,
+                "state": "downloading",
+                "alreadyStarted": False,
+                "value": complete,
+            },
+        )
+
+    # Progress of the download object for every byte written
+    progressScale = 0
+    if downloadObject:
+        progressScale = 100 / complete
+        if not isinstance(downloadObject, Single):
+            progressScale /= downloadObject.size
+
+    lock = Lock()
+    # Leading null bytes of the first segment shift all the other segments
+    leadingNulls = 0
+    startKnown = Event()
+    if not decrypt:
+        # Written as received, the nulls are stripped along with the decryption
+        startKnown.set()
+    aborted = Event()
+
+    def streamSegment(position, end):
+        nonlocal leadingNulls
+        retrying = Retrying(track.downloadURL)
+        while position < end:
+            start = position
+            if aborted.is_set() or downloadObject and downloadObject.isCanceled:
+                raise DownloadCanceled
+            retrying.check()
+            try:
+                with getSession().get(
+                    track.downloadURL,
+                    headers={**headers, "Range": f"bytes={position}-{end - 1}"},
+                    stream=True,
+                    timeout=getTimeout(),
+                ) as request:
+                    request.raise_for_status()
+                    for data in iterBuffers(request):
+                        bandwidthLimiter.consume(bandwidthKey, len(data), listener)
+                        if isCryptedStream:
+                            blowfish.decryptStripes(data)
+
+                        if position == 0 and decrypt:
+                            stripped = stripLeadingNulls(data)
+                            leadingNulls = len(data) - len(stripped)
+                            startKnown.set()
+                            writeAt(outputStream, stripped, 0, lock)
+                        else:
+                            startKnown.wait()
+                            if aborted.is_set():
+                                raise DownloadCanceled
+                            writeAt(outputStream, data, position - leadingNulls, lock)
+                        position += len(data)
+
+                        if progressScale:
+                            with lock:
+                                downloadObject.progressNext += len(data) * progressScale
+                                downloadObject.updateProgress(listener)
+                retrying.success()
+            except RETRYABLE_ERRORS as e:
+                # Buffers are aligned to the stripe grid, restart from the last one
+                if position > start:
+                    retrying.reset()
+                if not retrying.backoff(e):
+                    raise
+
+    def streamSegmentWrapper(position, end):
+        try:
+            streamSegment(position, end)
+        except Exception:
+            aborted.set()
+            startKnown.set()
+            raise
+
+    with ThreadPoolExecutor(segments) as executor:
+        futures = [
+            executor.submit(
+                streamSegmentWrapper, start, min(start + segmentSize, complete)
+            )
+            for start in range(0, complete, segmentSize)
+        ]
+    errors = [future.exception() for future in futures if future.exception()]
+    # Report the root cause rather than the cancellation of the other segments
+    errors.sort(key=lambda e: isinstance(e, DownloadCanceled))
+    if errors:
+        raise errors[0]
@@ -1,20 +1,17 @@
 from concurrent.futures import ThreadPoolExecutor
-from time import sleep
 import traceback
 
 from os.path import sep as pathSep
-from os import makedirs, system as execute
+from os import makedirs, replace, SEEK_END, system as execute
 from pathlib import Path
 from shlex import quote
 import errno
+import json
 
 import logging
 from tempfile import gettempdir
 
 import requests
-from requests import get
-
-from urllib3.exceptions import SSLError as u3SSLError
 
 from mutagen.flac import FLACNoHeaderError, error as FLACError
 
@@ -22,17 +19,29 @@ from deezer import TrackFormats
 from deezer.errors import WrongLicense, WrongGeolocation
 from deezer.utils import map_track
 from deemix.types.DownloadObjects import Single, Collection
-from deemix.types.Track import Track
+from deemix.types.Track import Track, getAlbumAPI, getArtistAPI, getTracksGW
 from deemix.types.Picture import StaticPicture
 from deemix.utils import USER_AGENT_HEADER
+from deemix.utils.bandwidth import bandwidthLimiter
+from deemix.utils.pipeline import Pipeline
+from deemix.utils.retry import Retrying, RETRYABLE_ERRORS
+from deemix.utils.session import configureSession, getSession, getTimeout
 from deemix.utils.pathtemplates import (
     generatePath,
     generateAlbumName,
     generateArtistName,
     generateDownloadObjectName,
+    getMetadataDemand,
+)
+from deemix.tagger import tagID3, tagFLAC, finishTags, TagStream
+from deemix.processpool import processPool
+from deemix.decryption import (
+    STRIPE_GRID_SIZE,
+    generateCryptedStreamURL,
+    isCryptedURL,
+    streamTrack,
+    streamTrackSegmented,
 )
-from deemix.tagger import tagID3, tagFLAC
-from deemix.decryption import generateCryptedStreamURL, streamTrack
 from deemix.settings import OverwriteOption
 from deemix.errors import (
     DownloadFailed,
@@ -44,6 +53,7 @@ from deemix.errors import (
     DownloadError,
     ErrorMessages,
     TrackSearchInfiniteLoop,
+    RangeNotSupported,
 )
 
 logger = logging.getLogger("deemix")
@@ -70,11 +80,117 @@ formatsName = {
     TrackFormats.MP4_RA1: "MP4_RA1",
 }
 
+# Items every stage of the pipeline queues, per worker
+STAGE_QUEUE_FACTOR = 2
+# Track tokens sent at once to the media api
+MEDIA_BATCH_SIZE = 100
+
 TEMPDIR = Path(gettempdir()) / "deemix-imgs"
 if not TEMPDIR.is_dir():
     makedirs(TEMPDIR)
 
 
+class PartialDownload:
+    """A track being downloaded in a .part file
+
+    A sidecar json file keeps the bytes received from the server and the bytes
+    written in the .part file, so an interrupted download can be resumed with a
+    range request. The received offset is always a multiple of the stripe grid
+    (or the whole size), so decryption restarts on a stripe boundary.
+    tagged is set when the .part file starts with the tags written by TagStream,
+    crypted when the track is downloaded as received, to be decrypted later.
+    """
+
+    # Bytes received between two saves of the sidecar
+    SAVE_INTERVAL = 4 * 1024 * 1024
+
+    def __init__(self, writepath, track):
+        self.writepath = writepath
+        self.path = writepath.with_name(writepath.name + ".part")
+        self.sidecarPath = writepath.with_name(writepath.name + ".part.json")
+        self.id = str(track.id)
+        self.bitrate = track.bitrate
+        self.size = 0
+        self.received = 0
+        self.written = 0
+        self.tagged = False
+        self.crypted = False
+        self.lastSave = 0
+
+    def load(self):
+        """Returns the offset to resume the download from, 0 to start over"""
+        if not self.path.is_file() or not self.sidecarPath.is_file():
+            return 0
+        try:
+            with open(self.sidecarPath, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["id"] != self.id or data["bitrate"] != self.bitrate:
+                return 0
+            if data["stripeOffset"] != 0 and data["received"] != data["size"]:
+                return 0
+            # Decrypted and crypted buffers can't be mixed in the same file
+            complete = data["received"] == data["size"]
+            if data.get("crypted", False) != self.crypted and not complete:
+                return 0
+            # Nothing written yet, the TagStream header may still be pending
+            if not data["written"] or self.path.stat().st_size < data["written"]:
+                return 0
+            with open(self.path, "r+b") as f:
+                f.truncate(data["written"])
+        except (OSError, ValueError, KeyError):
+            return 0
+        self.size = data["size"]
+        self.received = self.lastSave = data["received"]
+        self.written = data["written"]
+        self.tagged = data.get("tagged", False)
+        self.crypted = data.get("crypted", False)
+        return self.received
+
+    def isComplete(self):
+        return self.size != 0 and self.received >= self.size
+
+    def setComplete(self, size):
+        self.size = self.received = self.written = size
+
+    def update(self, outputStream, received, written):
+        self.received = received
+        self.written += written
+        if self.received - self.lastSave >= self.SAVE_INTERVAL:
+            outputStream.flush()
+            self.save()
+
+    def save(self):
+        tempPath = self.sidecarPath.with_name(self.sidecarPath.name + ".tmp")
+        with open(tempPath, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "id": self.id,
+                    "bitrate": self.bitrate,
+                    "size": self.size,
+                    "received": self.received,
+                    "written": self.written,
+                    "stripeOffset": self.received % STRIPE_GRID_SIZE,
+                    "tagged": self.tagged,
+                    "crypted": self.crypted,
+                },
+                f,
+            )
+        replace(tempPath, self.sidecarPath)
+        self.lastSave = self.received
+
+    def finish(self):
+        replace(self.path, self.writepath)
+        if self.sidecarPath.is_file():
+            self.sidecarPath.unlink()
+
+    def discard(self):
+        for path in [self.path, self.sidecarPath]:
+            if path.is_file():
+                path.unlink()
+        self.size = self.received = self.written = self.lastSave = 0
+        self.tagged = False
+
+
 def downloadImage(url, path, overwrite=OverwriteOption.DONT_OVERWRITE):
     if path.is_file() and overwrite not in [
         OverwriteOption.OVERWRITE,
@@ -83,9 +199,21 @@ def downloadImage(url, path, overwrite=OverwriteOption.DONT_OVERWRITE):
     ]:
         return path
 
+    retrying = Retrying(url)
     try:
-        image = get(url, headers={"User-Agent": USER_AGENT_HEADER}, timeout=30)
-        image.raise_for_status()
+        while True:
+            retrying.check()
+            try:
+                image = getSession().get(
+                    url, headers={"User-Agent": USER_AGENT_HEADER}, timeout=getTimeout()
+                )
+                image.raise_for_status()
+                bandwidthLimiter.consume(None, len(image.content))
+                retrying.success()
+                break
+            except RETRYABLE_ERRORS as e:
+                if not retrying.backoff(e):
+                    raise
         with open(path, "wb") as f:
             f.write(image.content)
         return path
@@ -103,15 +231,10 @@ def downloadImage(url, path, overwrite=OverwriteOption.DONT_OVERWRITE):
                     path,
                     overwrite,
                 )
-    except (
-        requests.exceptions.ConnectionError,
-        requests.exceptions.ChunkedEncodingError,
-        u3SSLError,
-    ):
+    except RETRYABLE_ERRORS as e:
         if path.is_file():
             path.unlink()
-        sleep(5)
-        return downloadImage(url, path, overwrite)
+        logger.warning("Couldn't download image %s: %s", url, e)
     except OSError as e:
         if path.is_file():
             path.unlink()
@@ -124,6 +247,94 @@ def downloadImage(url, path, overwrite=OverwriteOption.DONT_OVERWRITE):
     return None
 
 
+formats_non_360 = {
+    TrackFormats.FLAC: "FLAC",
+    TrackFormats.MP3_320: "MP3_320",
+    TrackFormats.MP3_128: "MP3_128",
+}
+formats_360 = {
+    TrackFormats.MP4_RA3: "MP4_RA3",
+    TrackFormats.MP4_RA2: "MP4_RA2",
+    TrackFormats.MP4_RA1: "MP4_RA1",
+}
+
+
+def getFormats(preferredBitrate, shouldFallback):
+    """Returns the formats getPreferredBitrate tries, in order"""
+    if not shouldFallback:
+        formats = dict(formats_360)
+        formats.update(formats_non_360)
+    elif preferredBitrate in formats_360.keys():
+        formats = dict(formats_360)
+    else:
+        formats = dict(formats_non_360)
+    return formats
+
+
+def getTracksURLs(dz, trackTokens, formatNames, batchSize=MEDIA_BATCH_SIZE):
+    """Resolves the urls of many tracks in all the given formats at once
+
+    Returns {token: {formatName: url}}, the media api answers with the first
+    available format, the ones before it are set to None. Tracks the media api
+    refused are left out, getPreferredBitrate will ask for them again.
+    """
+    if not dz.current_user.get("license_token"):
+        return {}
+    # Same license check as dz.get_track_url
+    formatNames = [
+        formatName
+        for formatName in formatNames
+        if not (
+            (formatName == "FLAC" or formatName.startswith("MP4_RA"))
+            and not dz.current_user.get("can_stream_lossless")
+            or formatName == "MP3_320"
+            and not dz.current_user.get("can_stream_hq")
+        )
+    ]
+    if not formatNames:
+        return {}
+
+    result = {}
+    for i in range(0, len(trackTokens), batchSize):
+        batch = trackTokens[i : i + batchSize]
+        try:
+            request = dz.session.post(
+                "https://media.deezer.com/v1/get_url",
+                json={
+                    "license_token": dz.current_user["license_token"],
+                    "media": [
+                        {
+                            "type": "FULL",
+                            "formats": [
+                                {"cipher": "BF_CBC_STRIPE", "format": formatName}
+                                for formatName in formatNames
+                            ],
+                        }
+                    ],
+                    "track_tokens": batch,
+                },
+                headers=dz.http_headers,
+                timeout=getTimeout(),
+            )
+            request.raise_for_status()
+            response = request.json()
+        except requests.exceptions.HTTPError:
+            continue
+
+        for trackToken, data in zip(batch, response.get("data", [])):
+            if "errors" in data:
+                continue
+            urls = {formatName: None for formatName in formatNames}
+            expiration = None
+            for media in data.get("media", []):
+                if media.get("format") in urls and media.get("sources"):
+                    urls[media["format"]] = media["sources"][0]["url"]
+                    if media.get("exp"):
+                        expiration = min(expiration or media["exp"], media["exp"])
+            result[trackToken] = {"urls": urls, "expiration": expiration}
+    return result
+
+
 def getPreferredBitrate(
     dz, track, preferredBitrate, shouldFallback, feelingLucky, uuid=None, listener=None
 ):
@@ -137,8 +348,8 @@ def getPreferredBitrate(
     def testURL(track, url, formatName):
         if not url:
             return False
-        request = requests.head(
-            url, headers={"User-Agent": USER_AGENT_HEADER}, timeout=30
+        request = getSession().head(
+            url, headers={"User-Agent": USER_AGENT_HEADER}, timeout=getTimeout()
         )
         try:
             request.raise_for_status()
@@ -160,7 +371,10 @@ def getPreferredBitrate(
             or formatName == "MP3_320"
             and not dz.current_user.get("can_stream_hq")
         )
-        if (
+        if formatName in track.urls:
+            # Already resolved with the rest of the collection
+            url = track.urls[formatName]
+        elif (
             track.filesizes.get(formatName.lower())
             and track.filesizes[formatName.lower()] != "0"
         ):
@@ -184,25 +398,8 @@ def getPreferredBitrate(
         track.urls["MP3_MISC"] = url
         return TrackFormats.LOCAL
 
-    formats_non_360 = {
-        TrackFormats.FLAC: "FLAC",
-        TrackFormats.MP3_320: "MP3_320",
-        TrackFormats.MP3_128: "MP3_128",
-    }
-    formats_360 = {
-        TrackFormats.MP4_RA3: "MP4_RA3",
-        TrackFormats.MP4_RA2: "MP4_RA2",
-        TrackFormats.MP4_RA1: "MP4_RA1",
-    }
-
     is360format = preferredBitrate in formats_360.keys()
-    if not shouldFallback:
-        formats = formats_360
-        formats.update(formats_non_360)
-    elif is360format:
-        formats = formats_360
-    else:
-        formats = formats_non_360
+    formats = getFormats(preferredBitrate, shouldFallback)
 
     # check and renew trackToken before starting the check
     track.checkAndRenewTrackToken(dz)
@@ -271,13 +468,77 @@ def getPreferredBitrate(
     return TrackFormats.DEFAULT
 
 
+def getItemData(extraData):
+    """Temp metadata to generate logs"""
+    trackAPI = extraData["trackAPI"]
+    return {
+        "id": trackAPI["id"],
+        "title": trackAPI["title"],
+        "artist": trackAPI["artist"]["name"],
+    }
+
+
+def getStageFunction(method):
+    def runStage(item):
+        return getattr(item["downloader"], method)(item)
+
+    return runStage
+
+
+def stageError(item, error):
+    return item["downloader"].stageError(item, error)
+
+
+def createPipeline(settings):
+    """Returns a Pipeline downloading the items of any Downloader
+
+    Every stage has its own workers and bounded queue, so a slow api call
+    doesn't hold a download slot and a slow stream doesn't hold the
+    metadata of the next tracks. A stage concurrency of 0 in the settings
+    means queueConcurrency. item["downloader"] runs the stages of the item.
+    """
+    concurrency = settings["queueConcurrency"]
+    metadataConcurrency = settings["metadataConcurrency"] or concurrency
+    taggingConcurrency = settings["taggingConcurrency"] or concurrency
+    stages = [
+        ("metadata", "metadataStage", metadataConcurrency),
+        ("url", "urlStage", metadataConcurrency),
+        ("download", "downloadStage", concurrency),
+        ("tag", "tagStage", taggingConcurrency),
+        ("finalize", "finalizeStage", 1),
+    ]
+    return Pipeline(
+        [
+            (name, getStageFunction(method), workers, workers * STAGE_QUEUE_FACTOR)
+            for name, method, workers in stages
+        ],
+        stageError,
+    )
+
+
 class Downloader:
-    def __init__(self, dz, downloadObject, settings, listener=None):
+    """Downloads the tracks of a download object
+
+    tracks, if given, is an iterable the tracks of a collection are read from
+    as they come, like a conversion still running, in place of
+    collection["tracks"].
+    """
+
+    # Errors of the HTTP client streaming the tracks, see recoverPartial
+    HTTP_ERROR = requests.exceptions.HTTPError
+    RETRYABLE_ERRORS = RETRYABLE_ERRORS
+
+    def __init__(self, dz, downloadObject, settings, listener=None, tracks=None):
         self.dz = dz
         self.downloadObject = downloadObject
+        self.tracks = tracks
         self.settings = settings
         self.bitrate = downloadObject.bitrate
         self.listener = listener
+        self.metadataDemand = getMetadataDemand(settings)
+        configureSession(settings)
+        bandwidthLimiter.configure(settings["maxBandwidth"])
+        processPool.configure(settings["cpuProcesses"])
 
         self.playlistCoverName = None
         self.playlistURLs = []
@@ -294,25 +555,40 @@ class Downloader:
                 if track:
                     self.afterDownloadSingle(track)
             elif isinstance(self.downloadObject, Collection):
-                tracks = [None] * len(self.downloadObject.collection["tracks"])
-                with ThreadPoolExecutor(self.settings["queueConcurrency"]) as executor:
-                    for pos, track in enumerate(
-                        self.downloadObject.collection["tracks"], start=0
-                    ):
-                        tracks[pos] = executor.submit(
-                            self.downloadWrapper,
-                            {
-                                "trackAPI": track,
-                                "albumAPI": self.downloadObject.collection.get(
-                                    "albumAPI"
-                                ),
-                                "playlistAPI": self.downloadObject.collection.get(
-                                    "playlistAPI"
-                                ),
-                            },
-                        )
+                tracks = self.downloadCollection(self.iterCollectionExtraData())
                 self.afterDownloadCollection(tracks)
+        self.sendFinished()
+
+    def submit(self, pipeline, priority=0):
+        """Sends the tracks to a shared pipeline, returns their futures in order
+
+        finish must be called with them once they are done, in place of start.
+        """
+        if self.downloadObject.isCanceled:
+            return []
+        if isinstance(self.downloadObject, Single):
+            extraDataList = [
+                {
+                    "trackAPI": self.downloadObject.single.get("trackAPI"),
+                    "albumAPI": self.downloadObject.single.get("albumAPI"),
+                }
+            ]
+        else:
+            extraDataList = self.iterCollectionExtraData()
+        return self.downloadCollection(extraDataList, pipeline, priority)
+
+    def finish(self, futures):
+        """Runs what start does once the tracks submitted are done"""
+        if futures and not self.downloadObject.isCanceled:
+            if isinstance(self.downloadObject, Single):
+                track = futures[0].result()
+                if track:
+                    self.afterDownloadSingle(track)
+            else:
+                self.afterDownloadCollection(futures)
+        self.sendFinished()
 
+    def sendFinished(self):
         if self.listener:
             if self.downloadObject.isCanceled:
                 self.listener.send("currentItemCancelled", self.downloadObject.uuid)
@@ -320,6 +596,165 @@ class Downloader:
             else:
                 self.listener.send("finishDownload", self.downloadObject.uuid)
 
+    def iterCollectionExtraData(self):
+        """Yields the data of the tracks as they are read from self.tracks
+
+        They are prefetched in batches that double up to MEDIA_BATCH_SIZE, so
+        the first track starts right away and the next ones still share their
+        api calls.
+        """
+        if self.tracks is None:
+            yield from self.getTracksExtraData(self.downloadObject.collection["tracks"])
+            return
+        batch = []
+        batchSize = 1
+        for track in self.tracks:
+            batch.append(track)
+            if len(batch) >= batchSize:
+                yield from self.getTracksExtraData(batch)
+                batch = []
+                batchSize = min(batchSize * 2, MEDIA_BATCH_SIZE)
+        if batch:
+            yield from self.getTracksExtraData(batch)
+
+    def getTracksExtraData(self, tracks):
+        """Returns the data the tracks of the collection are downloaded with
+
+        Playlists don't come with the album of their tracks, the distinct albums
+        are fetched once here instead of once for every track.
+        """
+        collection = self.downloadObject.collection
+        tracks = self.prefetchTracks(tracks)
+        tracks = self.prefetchURLs(tracks)
+        albums = {}
+        if not collection.get("albumAPI"):
+            albums = self.prefetchAlbums(tracks)
+        return [
+            {
+                "trackAPI": track,
+                "albumAPI": collection.get("albumAPI")
+                or albums.get(str(track.get("album", {}).get("id"))),
+                "playlistAPI": collection.get("playlistAPI"),
+            }
+            for track in tracks
+        ]
+
+    def prefetchTracks(self, tracks):
+        """Completes the tracks with their tokens, a few songs lists at a time
+
+        The tracks of a collection come without a token, every track would
+        otherwise get its own page in parseData.
+        """
+        if self.downloadObject.isCanceled:
+            return tracks
+        try:
+            tracksGW = getTracksGW(
+                self.dz,
+                [track["id"] for track in tracks if not track.get("track_token")],
+            )
+        except Exception as e:
+            # Every track will get its own data and report the error
+            logger.debug("Couldn't prefetch the tracks: %s", e)
+            return tracks
+        result = []
+        for track in tracks:
+            trackAPI_gw = tracksGW.get(str(track["id"]))
+            if trackAPI_gw and not track.get("track_token"):
+                # Same merge as parseData, the collection data has priority
+                # except for the token
+                trackAPI = map_track(trackAPI_gw)
+                trackAPI.update(track)
+                trackAPI["track_token"] = trackAPI_gw["TRACK_TOKEN"]
+                trackAPI["track_token_expire"] = trackAPI_gw["TRACK_TOKEN_EXPIRE"]
+                track = trackAPI
+            result.append(track)
+        return result
+
+    def prefetchURLs(self, tracks):
+        """Resolves the download urls of the tracks, a batch of tokens at a time
+
+        getPreferredBitrate then only looks them up instead of asking the
+        media api for every format of every track.
+        """
+        if self.downloadObject.isCanceled:
+            return tracks
+        formatNames = [
+            formatName
+            for formatNumber, formatName in getFormats(
+                int(self.bitrate), self.settings["fallbackBitrate"]
+            ).items()
+            if formatNumber <= int(self.bitrate)
+        ]
+        trackTokens = [
+            track["track_token"]
+            for track in tracks
+            if track.get("track_token") and int(track["id"]) > 0
+        ]
+        try:
+            resolved = getTracksURLs(self.dz, trackTokens, formatNames)
+        except Exception as e:
+            # Every track will get its own urls
+            logger.debug("Couldn't prefetch the track urls: %s", e)
+            return tracks
+        result = []
+        for track in tracks:
+            media = resolved.get(track.get("track_token"))
+            if media:
+                track = dict(
+                    track,
+                    urls=media["urls"],
+                    urls_expire=media["expiration"] or track["track_token_expire"],
+                )
+            result.append(track)
+        return result
+
+    def prefetchAlbums(self, tracks):
+        """Fetches the albums of the tracks and the pictures of their artists"""
+        albumIds = {
+            str(track["album"]["id"])
+            for track in tracks
+            if int(track["id"]) > 0 and track.get("album", {}).get("id")
+        }
+        with ThreadPoolExecutor(self.settings["queueConcurrency"]) as executor:
+            albums = dict(zip(albumIds, executor.map(self.prefetchAlbum, albumIds)))
+
+            # albumAPI_gw doesn't contain the artist cover
+            artistIds = {
+                str(albumAPI["artist"]["id"])
+                for albumAPI in albums.values()
+                if self.metadataDemand["artistPicture"]
+                and albumAPI
+                and albumAPI.get("artist")
+                and not albumAPI["artist"].get("picture_small")
+            }
+            artists = dict(zip(artistIds, executor.map(self.prefetchArtist, artistIds)))
+        for albumAPI in albums.values():
+            if not albumAPI or not albumAPI.get("artist"):
+                continue
+            artistAPI = artists.get(str(albumAPI["artist"]["id"]))
+            if artistAPI and artistAPI.get("picture_small"):
+                albumAPI["artist"]["picture_small"] = artistAPI["picture_small"]
+        return albums
+
+    def prefetchAlbum(self, albumId):
+        if self.downloadObject.isCanceled:
+            return None
+        try:
+            return getAlbumAPI(self.dz, albumId, withGW=self.metadataDemand["albumGW"])
+        except Exception as e:
+            # The track will try again on its own and report the error
+            logger.debug("Couldn't prefetch album %s: %s", albumId, e)
+            return None
+
+    def prefetchArtist(self, artistId):
+        if self.downloadObject.isCanceled:
+            return None
+        try:
+            return getArtistAPI(self.dz, artistId)
+        except Exception as e:
+            logger.debug("Couldn't prefetch artist %s: %s", artistId, e)
+            return None
+
     def log(self, data, state):
         if self.listener:
             self.listener.send(
@@ -340,15 +775,24 @@ class Downloader:
             )
 
     def download(self, extraData, track=None):
-        returnData = {}
+        job = self.prepareDownload(extraData, track)
+        if job["downloaded"] and not self.streamDownload(job):
+            return self.download(extraData, track=job["track"])
+        result = self.finishDownload(job)
+        if result is None:
+            return self.download(extraData, track=job["track"])
+        return result
+
+    def getTrack(self, extraData, track=None):
+        """Returns the Track to download, parsed from extraData if not given"""
         trackAPI = extraData.get("trackAPI")
-        albumAPI = extraData.get("albumAPI")
-        playlistAPI = extraData.get("playlistAPI")
         trackAPI["size"] = self.downloadObject.size
         if self.downloadObject.isCanceled:
             raise DownloadCanceled
         if int(trackAPI["id"]) == 0:
             raise DownloadFailed("notOnDeezer")
+        if track:
+            return track
 
         itemData = {
             "id": trackAPI["id"],
@@ -357,21 +801,27 @@ class Downloader:
         }
 
         # Create Track object
-        if not track:
-            self.log(itemData, "getTags")
-            try:
-                track = Track().parseData(
-                    dz=self.dz,
-                    track_id=trackAPI["id"],
-                    trackAPI=trackAPI,
-                    albumAPI=albumAPI,
-                    playlistAPI=playlistAPI,
-                )
-            except AlbumDoesntExists as e:
-                raise DownloadError("albumDoesntExists") from e
-            except MD5NotFound as e:
-                raise DownloadError("notLoggedIn") from e
-            self.log(itemData, "gotTags")
+        self.log(itemData, "getTags")
+        try:
+            track = Track().parseData(
+                dz=self.dz,
+                track_id=trackAPI["id"],
+                trackAPI=trackAPI,
+                albumAPI=extraData.get("albumAPI"),
+                playlistAPI=extraData.get("playlistAPI"),
+                demand=self.metadataDemand,
+            )
+        except AlbumDoesntExists as e:
+            raise DownloadError("albumDoesntExists") from e
+        except MD5NotFound as e:
+            raise DownloadError("notLoggedIn") from e
+        self.log(itemData, "gotTags")
+        return track
+
+    def prepareDownload(self, extraData, track=None):
+        """Gathers the track metadata and decides where and if to download it"""
+        returnData = {}
+        track = self.getTrack(extraData, track)
 
         itemData = {
             "id": track.id,
@@ -411,6 +861,7 @@ class Downloader:
 
         # Apply settings
         track.applySettings(self.settings)
+        track.loadLyrics(self.dz, self.settings)
 
         # Generate filename and filepath from metadata
         (filename, filepath, artistPath, coverPath, extrasPath) = generatePath(
@@ -565,59 +1016,222 @@ class Downloader:
             trackAlreadyDownloaded = False
             writepath = Path(currentFilename)
 
-        if (
+        downloaded = (
             not trackAlreadyDownloaded
             or self.settings["overwriteFile"] == OverwriteOption.OVERWRITE
-        ):
+        )
+        job = {
+            "track": track,
+            "itemData": itemData,
+            "returnData": returnData,
+            "extension": extension,
+            "writepath": writepath,
+            "extrasPath": extrasPath,
+            "trackAlreadyDownloaded": trackAlreadyDownloaded,
+            "downloaded": downloaded,
+            "partial": None,
+        }
+        if downloaded:
             track.downloadURL = track.urls[formatsName[track.bitrate]]
             if not track.downloadURL:
                 raise DownloadFailed("notAvailable", track)
-            try:
-                with open(writepath, "wb") as stream:
-                    streamTrack(
-                        stream,
-                        track,
-                        downloadObject=self.downloadObject,
-                        listener=self.listener,
-                    )
-            except requests.exceptions.HTTPError as e:
-                if writepath.is_file():
-                    writepath.unlink()
-                raise DownloadFailed("notAvailable", track) from e
-            except OSError as e:
-                if writepath.is_file():
-                    writepath.unlink()
-                if e.errno == errno.ENOSPC:
-                    raise DownloadFailed("noSpaceLeft") from e
-                raise e
-            self.log(itemData, "downloaded")
+            job["partial"] = PartialDownload(writepath, track)
         else:
             self.log(itemData, "alreadyDownloaded")
             self.downloadObject.completeTrackProgress(self.listener)
+        return job
+
+    def openTagStream(self, job, stream, start):
+        """Wraps stream to write the tags ahead of the audio, when possible"""
+        track = job["track"]
+        partial = job["partial"]
+        if start:
+            # The .part file already starts with the tags if it was tagged
+            return stream
+        # With the process pool the tags are written there, once downloaded
+        partial.tagged = (
+            job["extension"] in [".mp3", ".flac"]
+            and not track.local
+            and not processPool.isEnabled()
+        )
+        if not partial.tagged:
+            return stream
+        audioSize = track.filesizes.get(formatsName[track.bitrate].lower())
+        return TagStream(
+            stream,
+            track,
+            self.settings["tags"],
+            job["extension"],
+            int(audioSize or 0),
+        )
+
+    def removeFLAC(self, job):
+        """Discards the FLAC file of the track so another format is picked"""
+        track = job["track"]
+        itemData = job["itemData"]
+        if job["partial"]:
+            job["partial"].discard()
+        else:
+            job["writepath"].unlink()
+        logger.warning(
+            "%s Track not available in FLAC, falling back if necessary",
+            f"{itemData['artist']} - {itemData['title']}",
+        )
+        self.downloadObject.removeTrackProgress(self.listener)
+        track.filesizes["FILESIZE_FLAC"] = "0"
+        track.filesizes["FILESIZE_FLAC_TESTED"] = True
+
+    def loadPartial(self, job):
+        """Returns the offset to resume the .part file of the track from"""
+        partial = job["partial"]
+        # The process pool decrypts the track, the download only receives it
+        partial.crypted = processPool.isEnabled() and isCryptedURL(
+            job["track"].downloadURL
+        )
+        return partial.load()
+
+    def recoverPartial(self, job, error, restarted):
+        """Handles an error raised while downloading the .part file
+
+        Returns False if the track must be downloaded again with another
+        format, True if it must be downloaded again from the start, raises
+        otherwise.
+        """
+        partial = job["partial"]
+        if isinstance(error, (FLACNoHeaderError, FLACError)):
+            self.removeFLAC(job)
+            return False
+        if isinstance(error, self.HTTP_ERROR):
+            partial.discard()
+            raise DownloadFailed("notAvailable", job["track"]) from error
+        if isinstance(error, self.RETRYABLE_ERRORS):
+            # Retries exhausted, keep what has been received for the next run
+            if partial.received:
+                partial.save()
+            raise DownloadFailed("connectionFailed") from error
+        if isinstance(error, OSError):
+            partial.discard()
+            if error.errno == errno.ENOSPC:
+                raise DownloadFailed("noSpaceLeft") from error
+            raise error
+        if isinstance(error, RangeNotSupported):
+            # The server ignored the range and sent the whole track, start over
+            partial.discard()
+            if restarted:
+                raise DownloadFailed("connectionFailed") from error
+            return True
+        # Keep what has been received so far to resume it later
+        if partial.received:
+            partial.save()
+        raise error
+
+    def streamDownload(self, job, restarted=False):
+        """Downloads the track in its .part file
+
+        Returns False if the track must be downloaded again with another format
+        """
+        track = job["track"]
+        partial = job["partial"]
+        start = self.loadPartial(job)
+        try:
+            if not partial.isComplete():
+                with open(partial.path, "r+b" if start else "wb") as stream:
+                    stream.seek(partial.written)
+                    if self.settings["downloadSegments"] > 1 and not start:
+                        # Segments are written in place, tags are added later
+                        partial.tagged = False
+                        streamTrackSegmented(
+                            stream,
+                            track,
+                            self.settings["downloadSegments"],
+                            self.settings["downloadSegmentMinSize"],
+                            downloadObject=self.downloadObject,
+                            listener=self.listener,
+                            decrypt=not partial.crypted,
+                        )
+                        partial.setComplete(stream.seek(0, SEEK_END))
+                    else:
+                        output = self.openTagStream(job, stream, start)
+                        streamTrack(
+                            output,
+                            track,
+                            start,
+                            downloadObject=self.downloadObject,
+                            listener=self.listener,
+                            partial=partial,
+                            decrypt=not partial.crypted,
+                        )
+                        if output is not stream:
+                            partial.written += output.finish()
+            else:
+                self.downloadObject.completeTrackProgress(self.listener)
+            partial.save()
+        except BaseException as e:  # pylint: disable=W0703
+            if not self.recoverPartial(job, e, restarted):
+                return False
+            return self.streamDownload(job, restarted=True)
+        self.log(job["itemData"], "downloaded")
+        return True
+
+    def finishDownload(self, job):
+        """Tags the track and moves it to its final name
+
+        Returns None if the track must be downloaded again with another format
+        """
+        if not self.tagDownload(job):
+            return None
+        return self.completeDownload(job)
+
+    def tagDownload(self, job):
+        """Tags the track, returns False if it must be downloaded again"""
+        track = job["track"]
+        itemData = job["itemData"]
+        extension = job["extension"]
+        partial = job["partial"]
+        tagpath = partial.path if job["downloaded"] else job["writepath"]
+
+        if partial and partial.crypted:
+            partial.setComplete(processPool.decrypt(partial.path, track.id))
+            partial.crypted = False
+            partial.save()
 
         # Adding tags
         if (
-            not trackAlreadyDownloaded
+            not job["trackAlreadyDownloaded"]
             or self.settings["overwriteFile"]
             in [OverwriteOption.ONLY_TAGS, OverwriteOption.OVERWRITE]
         ) and not track.local:
             self.log(itemData, "tagging")
-            if extension == ".mp3":
-                tagID3(writepath, track, self.settings["tags"])
+            if partial and partial.tagged:
+                finishTags(tagpath, track, self.settings["tags"], extension)
+            elif processPool.isEnabled():
+                try:
+                    processPool.tag(tagpath, extension, track, self.settings["tags"])
+                except (FLACNoHeaderError, FLACError):
+                    self.removeFLAC(job)
+                    return False
+            elif extension == ".mp3":
+                tagID3(tagpath, track, self.settings["tags"])
             elif extension == ".flac":
                 try:
-                    tagFLAC(writepath, track, self.settings["tags"])
+                    tagFLAC(tagpath, track, self.settings["tags"])
                 except (FLACNoHeaderError, FLACError):
-                    writepath.unlink()
-                    logger.warning(
-                        "%s Track not available in FLAC, falling back if necessary",
-                        f"{itemData['artist']} - {itemData['title']}",
-                    )
-                    self.downloadObject.removeTrackProgress(self.listener)
-                    track.filesizes["FILESIZE_FLAC"] = "0"
-                    track.filesizes["FILESIZE_FLAC_TESTED"] = True
-                    return self.download(extraData, track=track)
+                    self.removeFLAC(job)
+                    return False
             self.log(itemData, "tagged")
+        return True
+
+    def completeDownload(self, job):
+        """Moves the track to its final name and returns its result"""
+        track = job["track"]
+        itemData = job["itemData"]
+        returnData = job["returnData"]
+        writepath = job["writepath"]
+        partial = job["partial"]
+
+        # Move the track to its final name only once it's complete and tagged
+        if partial:
+            partial.finish()
 
         if track.searched:
             returnData["searched"] = True
@@ -632,61 +1246,132 @@ class Downloader:
                     "extrasPath": str(self.downloadObject.extrasPath),
                 },
             )
-        returnData["filename"] = str(writepath)[len(str(extrasPath)) + len(pathSep) :]
+        returnData["filename"] = str(writepath)[
+            len(str(job["extrasPath"])) + len(pathSep) :
+        ]
         returnData["data"] = itemData
         returnData["path"] = str(writepath)
         self.downloadObject.files.append(returnData)
         return returnData
 
+    def downloadCollection(self, extraDataList, pipeline=None, priority=0):
+        """Downloads the tracks in a pipeline, returns their futures in order
+
+        Without a shared pipeline, one is created and waited for.
+        """
+        if pipeline:
+            return [
+                pipeline.submit(
+                    {
+                        "downloader": self,
+                        "extraData": extraData,
+                        "itemData": getItemData(extraData),
+                        "priority": priority,
+                    }
+                )
+                for extraData in extraDataList
+            ]
+        with createPipeline(self.settings) as pipeline:
+            return self.downloadCollection(extraDataList, pipeline, priority)
+
+    def metadataStage(self, item):
+        item["track"] = self.getTrack(item["extraData"], item.get("track"))
+        return "url"
+
+    def urlStage(self, item):
+        item["job"] = self.prepareDownload(item["extraData"], item["track"])
+        return "download" if item["job"]["downloaded"] else "tag"
+
+    def downloadStage(self, item):
+        if not self.streamDownload(item["job"]):
+            item["track"] = item["job"]["track"]
+            return "url"
+        return "tag"
+
+    def tagStage(self, item):
+        if not self.tagDownload(item["job"]):
+            item["track"] = item["job"]["track"]
+            return "url"
+        return "finalize"
+
+    def finalizeStage(self, item):
+        item["result"] = self.completeDownload(item["job"])
+        self.reportResult(item["result"])
+
+    def stageError(self, item, error):
+        """Sends the track back with an alternative or ends it, like downloadWrapper"""
+        if isinstance(error, DownloadFailed):
+            track = self.getFallbackTrack(error, item["itemData"])
+            if track:
+                item["track"] = track
+                return "url"
+        item["result"] = self.getErrorResult(error, item["itemData"])
+        self.reportResult(item["result"])
+        return None
+
     def downloadWrapper(self, extraData, track=None):
-        trackAPI = extraData["trackAPI"]
-        # Temp metadata to generate logs
-        itemData = {
-            "id": trackAPI["id"],
-            "title": trackAPI["title"],
-            "artist": trackAPI["artist"]["name"],
-        }
+        itemData = getItemData(extraData)
 
         try:
             result = self.download(extraData, track)
         except DownloadFailed as error:
-            if error.track:
-                track = error.track
-                if track.fallbackID != "0":
-                    self.warn(itemData, error.errid, "fallback")
-                    newTrack = self.dz.gw.get_track_with_fallback(track.fallbackID)
-                    newTrack = map_track(newTrack)
-                    track.parseEssentialData(newTrack)
-                    return self.downloadWrapper(extraData, track)
-                if len(track.albumsFallback) != 0 and self.settings["fallbackISRC"]:
-                    newAlbumID = track.albumsFallback.pop()
-                    newAlbum = self.dz.gw.get_album_page(newAlbumID)
-                    fallbackID = 0
-                    for newTrack in newAlbum["SONGS"]["data"]:
-                        if newTrack["ISRC"] == track.ISRC:
-                            fallbackID = newTrack["SNG_ID"]
-                            break
-                    if fallbackID != 0:
-                        self.warn(itemData, error.errid, "fallback")
-                        newTrack = self.dz.gw.get_track_with_fallback(fallbackID)
-                        newTrack = map_track(newTrack)
-                        track.parseEssentialData(newTrack)
-                        return self.downloadWrapper(extraData, track)
-                if not track.searched and self.settings["fallbackSearch"]:
-                    self.warn(itemData, error.errid, "search")
-                    searchedId = self.dz.api.get_track_id_from_metadata(
-                        track.mainArtist.name, track.title, track.album.title
-                    )
-                    if searchedId != "0":
-                        newTrack = self.dz.gw.get_track_with_fallback(searchedId)
-                        newTrack = map_track(newTrack)
-                        track.parseEssentialData(newTrack)
-                        track.searched = True
-                        self.log(itemData, "searchFallback")
-                        return self.downloadWrapper(extraData, track)
-                error.errid += "NoAlternative"
-                error.message = ErrorMessages[error.errid]
-            result = {
+            track = self.getFallbackTrack(error, itemData)
+            if track:
+                return self.downloadWrapper(extraData, track)
+            result = self.getErrorResult(error, itemData)
+        except Exception as e:
+            result = self.getErrorResult(e, itemData)
+
+        self.reportResult(result)
+        return result
+
+    def getFallbackTrack(self, error, itemData):
+        """Returns the track updated with an alternative to download, if any"""
+        if not error.track:
+            return None
+        track = error.track
+        if self.settings["fallbackISRC"]:
+            track.loadAlbumsFallback(self.dz)
+        if track.fallbackID != "0":
+            self.warn(itemData, error.errid, "fallback")
+            newTrack = self.dz.gw.get_track_with_fallback(track.fallbackID)
+            newTrack = map_track(newTrack)
+            track.parseEssentialData(newTrack)
+            return track
+        if len(track.albumsFallback) != 0 and self.settings["fallbackISRC"]:
+            newAlbumID = track.albumsFallback.pop()
+            newAlbum = self.dz.gw.get_album_page(newAlbumID)
+            fallbackID = 0
+            for newTrack in newAlbum["SONGS"]["data"]:
+                if newTrack["ISRC"] == track.ISRC:
+                    fallbackID = newTrack["SNG_ID"]
+                    break
+            if fallbackID != 0:
+                self.warn(itemData, error.errid, "fallback")
+                newTrack = self.dz.gw.get_track_with_fallback(fallbackID)
+                newTrack = map_track(newTrack)
+                track.parseEssentialData(newTrack)
+                return track
+        if not track.searched and self.settings["fallbackSearch"]:
+            self.warn(itemData, error.errid, "search")
+            searchedId = self.dz.api.get_track_id_from_metadata(
+                track.mainArtist.name, track.title, track.album.title
+            )
+            if searchedId != "0":
+                newTrack = self.dz.gw.get_track_with_fallback(searchedId)
+                newTrack = map_track(newTrack)
+                track.parseEssentialData(newTrack)
+                track.searched = True
+                self.log(itemData, "searchFallback")
+                return track
+        error.errid += "NoAlternative"
+        error.message = ErrorMessages[error.errid]
+        return None
+
+    @classmethod
+    def getErrorResult(cls, error, itemData):
+        if isinstance(error, DownloadFailed):
+            return {
                 "error": {
                     "message": error.message,
                     "errid": error.errid,
@@ -694,17 +1379,17 @@ class Downloader:
                     "type": "track",
                 }
             }
-        except Exception as e:
-            logger.exception("%s %s", f"{itemData['artist']} - {itemData['title']}", e)
-            result = {
-                "error": {
-                    "message": str(e),
-                    "data": itemData,
-                    "stack": traceback.format_exc(),
-                    "type": "track",
-                }
+        logger.exception("%s %s", f"{itemData['artist']} - {itemData['title']}", error)
+        return {
+            "error": {
+                "message": str(error),
+                "data": itemData,
+                "stack": traceback.format_exc(),
+                "type": "track",
             }
+        }
 
+    def reportResult(self, result):
         if "error" in result:
             self.downloadObject.completeTrackProgress(self.listener)
             self.downloadObject.failed += 1
@@ -723,7 +1408,6 @@ class Downloader:
                         "type": error["type"],
                     },
                 )
-        return result
 
     def afterDownloadErrorReport(self, position, error, itemData=None):
         if not itemData:
@@ -76,6 +76,7 @@ ErrorMessages = {
     "wrongGeolocation": "Your account can't stream the track from your current country.",
     "wrongGeolocationNoAlternative": "Your account can't stream the track from your current country and no alternative found.",
     "infiniteLoopBackoff": "Track available on Deezer but unable generate a valid download link",
+    "connectionFailed": "Connection to deezer's servers failed too many times, try again later.",
 }
 
 
@@ -107,6 +108,10 @@ class DownloadEmpty(DownloadError):
     pass
 
 
+class RangeNotSupported(DownloadError):
+    """The server answered a range request with the whole track"""
+
+
 class TrackError(DeemixError):
     """Track generation related errors"""
 
@@ -1,8 +1,12 @@
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 import json
+import logging
 from copy import deepcopy
 from pathlib import Path
 import re
+import sqlite3
+from time import time
+from threading import BoundedSemaphore, Lock
 from urllib.request import urlopen
 from deezer.errors import DataException
 from deemix.plugins import Plugin
@@ -10,28 +14,223 @@ from deemix.utils.localpaths import getConfigFolder
 from deemix.itemgen import generateTrackItem, generateAlbumItem
 from deemix.errors import GenerationError, TrackNotOnDeezer, AlbumNotOnDeezer
 from deemix.types.DownloadObjects import Convertable, Collection
+from deemix.utils.pipeline import mapAhead
 
 import spotipy
 
 SpotifyClientCredentials = spotipy.oauth2.SpotifyClientCredentials
 CacheFileHandler = spotipy.cache_handler.CacheFileHandler
 
+logger = logging.getLogger("deemix")
+
+# Entries written to the cache in a single transaction
+CACHE_WRITE_BATCH = 200
+# Ids the tracks and albums endpoints take at once
+TRACKS_BATCH_SIZE = 50
+ALBUMS_BATCH_SIZE = 20
+# Batched requests in flight at once, lookups made meanwhile join the next one
+BATCH_CONCURRENCY = 4
+# Playlist pages fetched at once
+PLAYLIST_PAGE_WORKERS = 4
+
+DEFAULT_SETTINGS = {
+    "fallbackSearch": False,
+    # Tracks not found on Deezer are looked up again after this many hours,
+    # doubled after every failed check up to unmatchedMaxRecheckDays.
+    # 0 looks them up on every conversion
+    "unmatchedRecheckHours": 24,
+    "unmatchedMaxRecheckDays": 30,
+}
+
+
+class BatchLoader:
+    """Coalesces the concurrent lookups of single ids into batched calls
+
+    Up to BATCH_CONCURRENCY requests are in flight, the lookups made while
+    they are all busy are fetched together with fetchMany in the next one,
+    which returns the results in the order of the ids. Ids the batch failed
+    for or didn't return are fetched again with fetchOne, so every lookup
+    gets the result or the error it would have had alone.
+    """
+
+    def __init__(self, fetchMany, fetchOne, batchSize):
+        self.fetchMany = fetchMany
+        self.fetchOne = fetchOne
+        self.batchSize = batchSize
+        self.lock = Lock()
+        self.slots = BoundedSemaphore(BATCH_CONCURRENCY)
+        self.pending = {}
+        self.leading = False
+
+    def get(self, key):
+        with self.lock:
+            future = self.pending.get(key)
+            if not future:
+                future = self.pending[key] = Future()
+            # The first lookup of a batch sends it once a request is free
+            leader = not self.leading
+            self.leading = True
+        if leader:
+            with self.slots:
+                with self.lock:
+                    batch = list(self.pending.items())
+                    self.pending = {}
+                    self.leading = False
+                for i in range(0, len(batch), self.batchSize):
+                    self.load(batch[i : i + self.batchSize])
+        return future.result()
+
+    def load(self, batch):
+        keys = [key for key, _ in batch]
+        try:
+            results = dict(zip(keys, self.fetchMany(keys)))
+        except Exception:
+            results = {}
+        for key, future in batch:
+            try:
+                future.set_result(results.get(key) or self.fetchOne(key))
+            except Exception as e:
+                future.set_exception(e)
+
+
+class SpotifyCache:
+    """Spotify tracks and albums mapped to their ISRC or UPC, in SQLite
+
+    kind is "tracks" or "albums", like the keys of the old cache.json.
+    Writes are buffered and committed in batches of CACHE_WRITE_BATCH, flush
+    commits the rest. Every access goes through the same lock, so the
+    conversion workers can share it. Without a path it's kept in memory.
+    """
+
+    def __init__(self, path=None):
+        self.lock = Lock()
+        self.pending = {}
+        self.db = None
+        self.open(path)
+
+    def open(self, path=None):
+        try:
+            db = sqlite3.connect(str(path or ":memory:"), check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS spotify "
+                "(kind TEXT, id TEXT, value TEXT, PRIMARY KEY (kind, id))"
+            )
+            db.commit()
+        except sqlite3.Error as e:
+            logger.warning("Couldn't open the spotify cache %s: %s", path, e)
+            if path:
+                self.open()
+            return
+        with self.lock:
+            if self.db:
+                self._flush()
+                self.db.close()
+            self.db = db
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.db.close()
+
+    def get(self, kind, key):
+        """Returns the cached value or None"""
+        key = str(key)
+        with self.lock:
+            if (kind, key) in self.pending:
+                return json.loads(self.pending[(kind, key)])
+            row = self.db.execute(
+                "SELECT value FROM spotify WHERE kind = ? AND id = ?", (kind, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, kind, key, value):
+        with self.lock:
+            self.pending[(kind, str(key))] = json.dumps(value)
+            if len(self.pending) >= CACHE_WRITE_BATCH:
+                self._flush()
+
+    def setMany(self, kind, values):
+        """Caches a dict of values by key, in a single transaction"""
+        with self.lock:
+            for key, value in values.items():
+                self.pending[(kind, str(key))] = json.dumps(value)
+            self._flush()
+
+    def delete(self, kind, key):
+        key = str(key)
+        with self.lock:
+            self.pending.pop((kind, key), None)
+            with self.db:
+                self.db.execute(
+                    "DELETE FROM spotify WHERE kind = ? AND id = ?", (kind, key)
+                )
+
+    def items(self, kind):
+        """Returns every (key, value) cached for kind"""
+        with self.lock:
+            self._flush()
+            rows = self.db.execute(
+                "SELECT id, value FROM spotify WHERE kind = ?", (kind,)
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO spotify VALUES (?, ?, ?)",
+                [(kind, key, value) for (kind, key), value in self.pending.items()],
+            )
+        self.pending = {}
+
+    def importJSON(self, path):
+        """Imports a cache.json file, renamed afterwards so it's imported once"""
+        path = Path(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            for kind in ["tracks", "albums"]:
+                self.setMany(kind, cache.get(kind, {}))
+        except (OSError, ValueError, AttributeError, sqlite3.Error) as e:
+            logger.warning("Couldn't import the spotify cache %s: %s", path, e)
+            return
+        path.replace(path.with_name(path.name + ".imported"))
+
 
 class Spotify(Plugin):
     def __init__(self, configFolder=None):
         super().__init__()
         self.credentials = {"clientId": "", "clientSecret": ""}
-        self.settings = {"fallbackSearch": False}
+        self.settings = deepcopy(DEFAULT_SETTINGS)
         self.enabled = False
         self.sp = None
         self.configFolder = Path(configFolder or getConfigFolder())
         self.configFolder /= "spotify"
+        self.cache = SpotifyCache()
+        self.trackLoader = BatchLoader(
+            self.fetchTracks,
+            lambda track_id: self.sp.track(track_id),
+            TRACKS_BATCH_SIZE,
+        )
+        self.albumLoader = BatchLoader(
+            self.fetchAlbums,
+            lambda album_id: self.sp.album(album_id),
+            ALBUMS_BATCH_SIZE,
+        )
 
     def setup(self):
         if not self.configFolder.is_dir():
             self.configFolder.mkdir()
 
         self.loadSettings()
+        self.loadCache()
         return self
 
     @classmethod
@@ -79,14 +278,11 @@ class Spotify(Plugin):
         return None
 
     def generateTrackItem(self, dz, link_id, bitrate):
-        cache = self.loadCache()
-
-        if link_id in cache["tracks"]:
-            cachedTrack = cache["tracks"][link_id]
-        else:
+        cachedTrack = self.cache.get("tracks", link_id)
+        if not cachedTrack:
             cachedTrack = self.getTrack(link_id)
-            cache["tracks"][link_id] = cachedTrack
-            self.saveCache(cache)
+            self.cache.set("tracks", link_id, cachedTrack)
+            self.cache.flush()
 
         if "isrc" in cachedTrack:
             try:
@@ -102,8 +298,8 @@ class Spotify(Plugin):
                 )
                 if trackID != "0":
                     cachedTrack["id"] = trackID
-                    cache["tracks"][link_id] = cachedTrack
-                    self.saveCache(cache)
+                    self.cache.set("tracks", link_id, cachedTrack)
+                    self.cache.flush()
 
             if cachedTrack.get("id", "0") != "0":
                 return generateTrackItem(dz, cachedTrack["id"], bitrate)
@@ -111,14 +307,11 @@ class Spotify(Plugin):
         raise TrackNotOnDeezer(f"https://open.spotify.com/track/{link_id}")
 
     def generateAlbumItem(self, dz, link_id, bitrate):
-        cache = self.loadCache()
-
-        if link_id in cache["albums"]:
-            cachedAlbum = cache["albums"][link_id]
-        else:
+        cachedAlbum = self.cache.get("albums", link_id)
+        if not cachedAlbum:
             cachedAlbum = self.getAlbum(link_id)
-            cache["albums"][link_id] = cachedAlbum
-            self.saveCache(cache)
+            self.cache.set("albums", link_id, cachedAlbum)
+            self.cache.flush()
 
         try:
             return generateAlbumItem(dz, f"upc:{cachedAlbum['upc']}", bitrate)
@@ -135,10 +328,26 @@ class Spotify(Plugin):
             5080
         )  # Useful for save as compilation
 
-        tracklistTemp = spotifyPlaylist["tracks"]["items"]
-        while spotifyPlaylist["tracks"]["next"]:
-            spotifyPlaylist["tracks"] = self.sp.next(spotifyPlaylist["tracks"])
-            tracklistTemp += spotifyPlaylist["tracks"]["items"]
+        # The first page gives the total, the other ones are fetched at once
+        firstPage = spotifyPlaylist["tracks"]
+        tracklistTemp = firstPage["items"]
+        if firstPage["next"]:
+            with ThreadPoolExecutor(PLAYLIST_PAGE_WORKERS) as executor:
+                pages = executor.map(
+                    lambda offset: self.sp.playlist_items(
+                        link_id,
+                        limit=firstPage["limit"],
+                        offset=offset,
+                        additional_types=("track",),
+                    ),
+                    range(
+                        firstPage["offset"] + firstPage["limit"],
+                        firstPage["total"],
+                        firstPage["limit"],
+                    ),
+                )
+                for page in pages:
+                    tracklistTemp += page["items"]
 
         tracklist = []
         for item in tracklistTemp:
@@ -148,6 +357,7 @@ class Spotify(Plugin):
                 tracklist.append(item["track"])
         if "explicit" not in playlistAPI:
             playlistAPI["explicit"] = False
+        self.cacheTracks(tracklist)
 
         return Convertable(
             {
@@ -171,7 +381,7 @@ class Spotify(Plugin):
         cachedTrack = {"isrc": None, "data": None}
 
         if not spotifyTrack:
-            spotifyTrack = self.sp.track(track_id)
+            spotifyTrack = self.trackLoader.get(track_id)
         if "isrc" in spotifyTrack.get("external_ids", {}):
             cachedTrack["isrc"] = spotifyTrack["external_ids"]["isrc"]
         cachedTrack["data"] = {
@@ -187,7 +397,7 @@ class Spotify(Plugin):
         cachedAlbum = {"upc": None, "data": None}
 
         if not spotifyAlbum:
-            spotifyAlbum = self.sp.album(album_id)
+            spotifyAlbum = self.albumLoader.get(album_id)
         if "upc" in spotifyAlbum.get("external_ids", {}):
             cachedAlbum["upc"] = spotifyAlbum["external_ids"]["upc"]
         cachedAlbum["data"] = {
@@ -196,19 +406,69 @@ class Spotify(Plugin):
         }
         return cachedAlbum
 
-    def convertTrack(self, dz, downloadObject, track, pos, conversion, cache, listener):
+    def fetchTracks(self, trackIds):
+        tracks = self.sp.tracks(trackIds)["tracks"]
+        self.cacheTracks([track for track in tracks if track])
+        return tracks
+
+    def fetchAlbums(self, albumIds):
+        albums = self.sp.albums(albumIds)["albums"]
+        self.cache.setMany(
+            "albums",
+            {
+                album["id"]: self.getAlbum(album["id"], album)
+                for album in albums
+                if album
+            },
+        )
+        return albums
+
+    def cacheTracks(self, tracks):
+        """Caches the ISRC of the tracks not cached yet, in one transaction"""
+        self.cache.setMany(
+            "tracks",
+            {
+                track["id"]: self.getTrack(track["id"], track)
+                for track in tracks
+                if track.get("id") and not self.cache.get("tracks", track["id"])
+            },
+        )
+
+    def convertTrack(self, dz, downloadObject, track, pos):
         if downloadObject.isCanceled:
             return
         trackAPI = None
-        cachedTrack = None
 
-        if track["id"] in cache["tracks"]:
-            cachedTrack = cache["tracks"][track["id"]]
-        else:
+        cachedTrack = self.cache.get("tracks", track["id"])
+        if not cachedTrack:
             cachedTrack = self.getTrack(track["id"], track)
-            cache["tracks"][track["id"]] = cachedTrack
-            self.saveCache(cache)
+            self.cache.set("tracks", track["id"], cachedTrack)
+
+        unmatched = self.cache.get("unmatched", track["id"])
+        if self.isRecheckDue(unmatched):
+            trackAPI = self.matchTrack(dz, track["id"], cachedTrack)
+            if trackAPI and unmatched:
+                self.cache.delete("unmatched", track["id"])
+            elif not trackAPI:
+                self.setUnmatched(track["id"], cachedTrack, unmatched)
+
+        if not trackAPI:
+            trackAPI = {
+                "id": "0",
+                "title": track["name"],
+                "duration": 0,
+                "md5_origin": 0,
+                "media_version": 0,
+                "filesizes": {},
+                "album": {"title": track["album"]["name"], "md5_image": ""},
+                "artist": {"id": 0, "name": track["artists"][0]["name"]},
+            }
+        trackAPI["position"] = pos + 1
+        return trackAPI
 
+    def matchTrack(self, dz, track_id, cachedTrack):
+        """Returns the Deezer track of cachedTrack, or None if there isn't one"""
+        trackAPI = None
         if "isrc" in cachedTrack:
             try:
                 trackAPI = dz.api.get_track_by_ISRC(cachedTrack["isrc"])
@@ -225,69 +485,142 @@ class Spotify(Plugin):
                 )
                 if trackID != "0":
                     cachedTrack["id"] = trackID
-                    cache["tracks"][track["id"]] = cachedTrack
-                    self.saveCache(cache)
+                    self.cache.set("tracks", track_id, cachedTrack)
 
             if cachedTrack.get("id", "0") != "0":
                 trackAPI = dz.api.get_track(cachedTrack["id"])
-
-        if not trackAPI:
-            trackAPI = {
-                "id": "0",
-                "title": track["name"],
-                "duration": 0,
-                "md5_origin": 0,
-                "media_version": 0,
-                "filesizes": {},
-                "album": {"title": track["album"]["name"], "md5_image": ""},
-                "artist": {"id": 0, "name": track["artists"][0]["name"]},
-            }
-        trackAPI["position"] = pos + 1
-
-        conversion["next"] += (1 / downloadObject.size) * 100
-        if (
-            round(conversion["next"]) != conversion["now"]
-            and round(conversion["next"]) % 2 == 0
-        ):
-            conversion["now"] = round(conversion["next"])
-            if listener:
-                listener.send(
-                    "updateQueue",
-                    {"uuid": downloadObject.uuid, "conversion": conversion["now"]},
-                )
-
         return trackAPI
 
-    def convert(self, dz, downloadObject, settings, listener=None):
-        cache = self.loadCache()
+    def isRecheckDue(self, unmatched):
+        """Tells if a track not found on Deezer last time should be looked up"""
+        if not unmatched:
+            return True
+        # Enabling the fallback search gives every track a chance of a match
+        if self.settings["fallbackSearch"] and not unmatched["searched"]:
+            return True
+        return time() >= unmatched["nextCheck"]
+
+    def setUnmatched(self, track_id, cachedTrack, unmatched=None):
+        """Records a failed match, the next check is delayed twice as long"""
+        now = time()
+        attempts = unmatched["attempts"] + 1 if unmatched else 1
+        delay = min(
+            self.settings["unmatchedRecheckHours"] * 3600 * 2 ** min(attempts - 1, 16),
+            self.settings["unmatchedMaxRecheckDays"] * 86400,
+        )
+        self.cache.set(
+            "unmatched",
+            track_id,
+            {
+                **(cachedTrack["data"] or {}),
+                "isrc": cachedTrack.get("isrc"),
+                "firstSeen": unmatched["firstSeen"] if unmatched else now,
+                "lastChecked": now,
+                "nextCheck": now + delay,
+                "attempts": attempts,
+                "searched": bool(self.settings["fallbackSearch"]),
+            },
+        )
 
+    def getUnmatched(self, days=0):
+        """Returns the tracks not found on Deezer for at least days, oldest first"""
+        since = time() - days * 86400
+        report = [
+            {
+                "id": track_id,
+                "link": f"https://open.spotify.com/track/{track_id}",
+                **entry,
+            }
+            for track_id, entry in self.cache.items("unmatched")
+            if entry["firstSeen"] <= since
+        ]
+        report.sort(key=lambda entry: entry["firstSeen"])
+        return report
+
+    def convertTracks(self, dz, downloadObject, settings, listener=None, result=None):
+        """Yields the converted tracks in order, converted a bounded window ahead
+
+        Results are read in order in the calling thread, which alone updates
+        the progress. Once downloadObject, or result, is canceled no more
+        tracks are started.
+        """
         conversion = {"now": 0, "next": 0}
+        unmatched = 0
 
-        collection = [None] * len(downloadObject.conversion_data)
         if listener:
             listener.send("startConversion", downloadObject.uuid)
-        with ThreadPoolExecutor(settings["queueConcurrency"]) as executor:
-            for pos, track in enumerate(downloadObject.conversion_data, start=0):
-                collection[pos] = executor.submit(
-                    self.convertTrack,
-                    dz,
-                    downloadObject,
-                    track,
-                    pos,
-                    conversion,
-                    cache,
-                    listener,
-                ).result()
+        workers = settings["metadataConcurrency"] or settings["queueConcurrency"]
+        futures = mapAhead(
+            lambda item: self.convertTrack(dz, downloadObject, item[1], item[0]),
+            enumerate(downloadObject.conversion_data),
+            workers,
+        )
+        for future in futures:
+            if downloadObject.isCanceled or result and result.isCanceled:
+                futures.close()
+                break
+            trackAPI = future.result()
+            if not trackAPI:
+                break
+
+            conversion["next"] += (1 / downloadObject.size) * 100
+            if (
+                round(conversion["next"]) != conversion["now"]
+                and round(conversion["next"]) % 2 == 0
+            ):
+                conversion["now"] = round(conversion["next"])
+                if listener:
+                    listener.send(
+                        "updateQueue",
+                        {"uuid": downloadObject.uuid, "conversion": conversion["now"]},
+                    )
+            if trackAPI["id"] == "0":
+                unmatched += 1
+            yield trackAPI
+        self.cache.flush()
+        if unmatched:
+            logger.info(
+                "%s: %d tracks not found on Deezer",
+                downloadObject.title,
+                unmatched,
+            )
+
+    def convert(self, dz, downloadObject, settings, listener=None):
+        collection = [None] * len(downloadObject.conversion_data)
+        for pos, trackAPI in enumerate(
+            self.convertTracks(dz, downloadObject, settings, listener)
+        ):
+            collection[pos] = trackAPI
 
         downloadObject.collection["tracks"] = collection
         downloadObject.size = len(collection)
         downloadObject = Collection(downloadObject.toDict())
         if listener:
             listener.send("finishConversion", downloadObject.getSlimmedDict())
-
-        self.saveCache(cache)
         return downloadObject
 
+    def convertStream(self, dz, downloadObject, settings, listener=None):
+        """Returns the Collection right away, and a generator of its tracks
+
+        The tracks are yielded as they are converted, so their download can
+        start while the next ones are still matched. They are added in order
+        to collection["tracks"], finishConversion is sent once all are.
+        """
+        downloadObject.collection["tracks"] = []
+        downloadObject.size = len(downloadObject.conversion_data)
+        result = Collection(downloadObject.toDict())
+
+        def iterTracks():
+            for trackAPI in self.convertTracks(
+                dz, downloadObject, settings, listener, result
+            ):
+                result.collection["tracks"].append(trackAPI)
+                yield trackAPI
+            if listener:
+                listener.send("finishConversion", result.getSlimmedDict())
+
+        return result, iterTracks()
+
     @classmethod
     def _convertPlaylistStructure(cls, spotifyPlaylist):
         cover = None
@@ -372,28 +705,13 @@ class Spotify(Plugin):
         settings = {**newSettings}
         del settings["clientId"]
         del settings["clientSecret"]
-        self.settings = settings
+        self.settings = {**DEFAULT_SETTINGS, **settings}
 
     def loadCache(self):
-        cache = None
+        """Opens cache.db, importing the cache.json of older versions"""
+        self.cache.open(self.configFolder / "cache.db")
         if (self.configFolder / "cache.json").is_file():
-            with open(self.configFolder / "cache.json", "r", encoding="utf-8") as f:
-                try:
-                    cache = json.load(f)
-                except json.decoder.JSONDecodeError:
-                    self.saveCache({"tracks": {}, "albums": {}})
-                    cache = None
-                except Exception:
-                    cache = None
-        if not cache:
-            cache = {"tracks": {}, "albums": {}}
-        return cache
-
-    def saveCache(self, newCache):
-        with open(
-            self.configFolder / "cache.json", "w", encoding="utf-8"
-        ) as spotifyCache:
-            json.dump(newCache, spotifyCache)
+            self.cache.importJSON(self.configFolder / "cache.json")
 
     def checkCredentials(self):
         if self.credentials["clientId"] == "" or self.credentials["clientSecret"] == "":
@@ -0,0 +1,170 @@
+from concurrent.futures import ProcessPoolExecutor
+from os import SEEK_END
+from threading import Lock
+from types import SimpleNamespace
+import multiprocessing
+
+from deemix.decryption import STREAM_BUFFER_SIZE, stripLeadingNulls
+from deemix.tagger import tagID3, tagFLAC
+from deemix.utils.crypto import getBlowfishContext
+
+
+def decryptFile(path, trackId):
+    """Decrypts in place a track downloaded still crypted, returns its size
+
+    The file is decrypted with the same buffers as streamTrack, then the
+    leading null bytes are removed.
+    """
+    blowfish = getBlowfishContext(trackId)
+    buffer = bytearray(STREAM_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, "r+b") as f:
+        position = 0
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            blowfish.decryptStripes(view[:size])
+            f.seek(position)
+            f.write(view[:size])
+            position += size
+
+        f.seek(0)
+        size = f.readinto(buffer)
+        nulls = size - len(stripLeadingNulls(view[:size])) if size else 0
+        if nulls:
+            # Moves the whole file back over the null bytes
+            position = nulls
+            while True:
+                f.seek(position)
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                f.seek(position - nulls)
+                f.write(view[:size])
+                position += size
+            f.truncate(position - nulls)
+        return f.seek(0, SEEK_END)
+
+
+def getTagData(track):
+    """Returns the fields of track the tagger reads, as plain data"""
+    return {
+        "id": track.id,
+        "title": track.title,
+        "artists": track.artists,
+        "artistsString": track.artistsString,
+        "mainArtist": {"name": track.mainArtist.name},
+        "album": {
+            "title": track.album.title,
+            "artists": track.album.artists,
+            "mainArtist": {
+                "name": track.album.mainArtist.name,
+                "save": track.album.mainArtist.save,
+            },
+            "trackTotal": track.album.trackTotal,
+            "discTotal": track.album.discTotal,
+            "genre": track.album.genre,
+            "label": track.album.label,
+            "barcode": track.album.barcode,
+            "recordType": track.album.recordType,
+            "embeddedCoverPath": str(track.album.embeddedCoverPath or ""),
+        },
+        "trackNumber": track.trackNumber,
+        "discNumber": track.discNumber,
+        "date": {
+            "day": track.date.day,
+            "month": track.date.month,
+            "year": track.date.year,
+        },
+        "dateString": track.dateString,
+        "duration": track.duration,
+        "bpm": track.bpm,
+        "ISRC": track.ISRC,
+        "explicit": track.explicit,
+        "replayGain": track.replayGain,
+        "copyright": track.copyright,
+        "contributors": track.contributors,
+        "rank": track.rank,
+        "lyrics": {"unsync": track.lyrics.unsync, "syncID3": track.lyrics.syncID3},
+        "playlist": bool(track.playlist),
+    }
+
+
+def getTaggedTrack(tagData):
+    """Rebuilds from getTagData an object the tagger can read like a Track"""
+    track = SimpleNamespace(**tagData)
+    track.mainArtist = SimpleNamespace(**tagData["mainArtist"])
+    track.album = SimpleNamespace(**tagData["album"])
+    track.album.mainArtist = SimpleNamespace(**tagData["album"]["mainArtist"])
+    track.date = SimpleNamespace(**tagData["date"])
+    track.lyrics = SimpleNamespace(**tagData["lyrics"])
+    return track
+
+
+def tagFile(path, extension, tagData, save):
+    track = getTaggedTrack(tagData)
+    if extension == ".mp3":
+        tagID3(path, track, save)
+    elif extension == ".flac":
+        tagFLAC(path, track, save)
+
+
+class ProcessPool:
+    """Runs the decryption and the tagging of the tracks in worker processes
+
+    Mutagen and the decryption loop hold the GIL, with threads they share a
+    single core. Only paths and the plain data of getTagData are sent to the
+    workers, they read and write the files in place. 0 workers disables it.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.executor = None
+        self.workers = 0
+        self.stats = {"decrypted": 0, "tagged": 0}
+
+    def configure(self, workers):
+        with self.lock:
+            if workers == self.workers:
+                return
+            if self.executor:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+            self.workers = workers
+            if workers:
+                # Forking a process full of threads and sockets isn't safe
+                self.executor = ProcessPoolExecutor(
+                    workers, mp_context=multiprocessing.get_context("spawn")
+                )
+
+    def isEnabled(self):
+        return self.executor is not None
+
+    def _run(self, kind, function, *args):
+        with self.lock:
+            executor = self.executor
+        if executor:
+            result = executor.submit(function, *args).result()
+        else:
+            result = function(*args)
+        with self.lock:
+            self.stats[kind] += 1
+        return result
+
+    def decrypt(self, path, trackId):
+        return self._run("decrypted", decryptFile, str(path), str(trackId))
+
+    def tag(self, path, extension, track, save):
+        self._run("tagged", tagFile, str(path), extension, getTagData(track), save)
+
+    def getStats(self):
+        with self.lock:
+            return {"workers": self.workers, **self.stats}
+
+
+processPool = ProcessPool()
+
+
+def getProcessPoolStats():
+    return processPool.getStats()
@@ -0,0 +1,68 @@
+from queue import Queue
+from threading import Thread
+import logging
+
+from deemix.downloader import Downloader, createPipeline
+
+logger = logging.getLogger("deemix")
+
+
+class Scheduler:
+    """Downloads the tracks of many download objects in one shared pipeline
+
+    Starting the downloaders one after the other leaves the workers idle at
+    the tail of every object, here the tracks of the next objects are queued
+    as soon as the pipeline has room for them. Objects with a higher priority
+    are submitted first and their tracks are taken first by every stage.
+    The completion hooks of every object run once all its tracks are done,
+    in the order the objects were submitted.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.downloads = []
+
+    def add(self, downloaders, priority=0):
+        """Queues a Downloader, or an iterable of them read when its turn comes
+
+        An iterable, like a generator resolving links, is read as the
+        pipeline has room, so its first objects download while it yields
+        the next ones.
+        """
+        self.downloads.append((downloaders, priority))
+
+    def start(self):
+        # sorted is stable, objects of the same priority keep their order
+        downloads = sorted(self.downloads, key=lambda download: -download[1])
+        self.downloads = []
+        submitted = Queue()
+
+        with createPipeline(self.settings) as pipeline:
+
+            def submit(downloader, priority):
+                try:
+                    submitted.put((downloader, downloader.submit(pipeline, priority)))
+                except Exception as e:
+                    logger.exception("Couldn't start the download: %s", e)
+
+            def submitAll():
+                for downloaders, priority in downloads:
+                    if isinstance(downloaders, Downloader):
+                        submit(downloaders, priority)
+                        continue
+                    try:
+                        for downloader in downloaders:
+                            submit(downloader, priority)
+                    except Exception as e:
+                        logger.exception("Couldn't queue the downloads: %s", e)
+                submitted.put(None)
+
+            thread = Thread(target=submitAll, name="deemix-scheduler", daemon=True)
+            thread.start()
+            while True:
+                download = submitted.get()
+                if download is None:
+                    break
+                downloader, futures = download
+                downloader.finish(futures)
+            thread.join()
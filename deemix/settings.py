@@ -43,6 +43,16 @@ DEFAULTS = {
     "paddingSize": "0",
     "illegalCharacterReplacer": "_",
     "queueConcurrency": 3,
+    "downloadSegments": 1,
+    "downloadSegmentMinSize": 4 * 1024 * 1024,
+    "asyncConcurrency": 64,
+    "connectTimeout": 10,
+    "readTimeout": 10,
+    "httpTransport": "http1",
+    "maxBandwidth": 0,
+    "metadataConcurrency": 0,
+    "taggingConcurrency": 2,
+    "cpuProcesses": 0,
     "maxBitrate": str(TrackFormats.MP3_320),
     "feelingLucky": False,
     "fallbackBitrate": False,
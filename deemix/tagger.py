@@ -1,4 +1,7 @@
-from mutagen.flac import FLAC, Picture
+from io import BytesIO
+
+from mutagen._tags import PaddingInfo
+from mutagen.flac import FLAC, Picture, FLACNoHeaderError
 from mutagen.id3 import (
     ID3,
     ID3NoHeaderError,
@@ -37,6 +40,11 @@ def tagID3(path, track, save):
     except ID3NoHeaderError:
         tag = ID3()
 
+    fillID3(tag, track, save)
+    saveID3(tag, path, save)
+
+
+def fillID3(tag, track, save):
     if save["title"]:
         tag.add(TIT2(text=track.title))
 
@@ -158,11 +166,14 @@ def tagID3(path, track, save):
                 )
             )
 
+
+def saveID3(tag, path, save, padding=None):
     tag.save(
         path,
         v1=2 if save["saveID3v1"] else 0,
         v2_version=3,
         v23_sep=None if save["useNullSeparator"] else "/",
+        padding=padding,
     )
 
 
@@ -173,6 +184,11 @@ def tagFLAC(path, track, save):
     tag.delete()
     tag.clear_pictures()
 
+    fillFLAC(tag, track, save)
+    tag.save(deleteid3=True)
+
+
+def fillFLAC(tag, track, save):
     if save["title"]:
         tag["TITLE"] = track.title
 
@@ -273,4 +289,136 @@ def tagFLAC(path, track, save):
             image.data = f.read()
         tag.add_picture(image)
 
-    tag.save(deleteid3=True)
+
+def getID3Size(head):
+    """Returns the size of the ID3v2 tag at the start of head, None if incomplete"""
+    if len(head) < 3:
+        return None
+    if head[:3] != b"ID3":
+        return 0
+    if len(head) < 10:
+        return None
+    size = 0
+    for byte in head[6:10]:
+        size = size << 7 | byte & 0x7F
+    # Header, and footer if flagged
+    return size + (20 if head[5] & 0x10 else 10)
+
+
+def getFLACHeaderSize(head):
+    """Returns the size of the metadata blocks at the start of head, None if incomplete"""
+    offset = getID3Size(head)
+    if offset is None or len(head) < offset + 4:
+        return None
+    if head[offset : offset + 4] != b"fLaC":
+        raise FLACNoHeaderError("Not a valid FLAC stream")
+    offset += 4
+    while len(head) >= offset + 4:
+        isLast = head[offset] & 0x80
+        offset += 4 + int.from_bytes(head[offset + 1 : offset + 4], "big")
+        if isLast:
+            return offset
+    return None
+
+
+class TagStream:
+    """Writes the tags ahead of the audio while the track is being downloaded
+
+    MP3 tags are written before the first audio byte, the metadata blocks at
+    the start of FLAC streams are replaced with the tagged ones. The padding
+    left is the one mutagen picks when tagging a file of audioSize bytes, so
+    finishTags can complete the tags in place without rewriting the audio.
+    """
+
+    def __init__(self, outputStream, track, save, extension, audioSize=0):
+        self.outputStream = outputStream
+        self.track = track
+        self.save = save
+        self.extension = extension
+        self.audioSize = audioSize
+        self.head = bytearray()
+        self.done = False
+
+    def getPadding(self, headerSize):
+        audioSize = max(self.audioSize - headerSize, 0)
+        return lambda info: PaddingInfo(info.padding, audioSize).get_default_padding()
+
+    def renderID3(self, headerSize):
+        tag = ID3()
+        fillID3(tag, self.track, self.save)
+        fileobj = BytesIO()
+        # ID3v1 is appended by finishTags once the audio is complete
+        tag.save(
+            fileobj,
+            v1=0,
+            v2_version=3,
+            v23_sep=None if self.save["useNullSeparator"] else "/",
+            padding=self.getPadding(headerSize),
+        )
+        return fileobj.getvalue()
+
+    def renderFLAC(self, headerSize):
+        fileobj = BytesIO(self.head[:headerSize])
+        tag = FLAC(fileobj)
+        # mutagen doesn't rewind file objects it's given
+        fileobj.seek(0)
+        tag.delete(fileobj)
+        tag.clear_pictures()
+        fillFLAC(tag, self.track, self.save)
+        fileobj.seek(0)
+        tag.save(fileobj, deleteid3=True, padding=self.getPadding(headerSize))
+        return fileobj.getvalue()
+
+    def writeHead(self, headerSize):
+        if self.extension == ".flac":
+            header = self.renderFLAC(headerSize)
+        else:
+            header = self.renderID3(headerSize)
+        written = self.outputStream.write(header)
+        written += self.outputStream.write(self.head[headerSize:])
+        self.head = None
+        self.done = True
+        return written
+
+    def write(self, data):
+        """Writes data, returns the bytes actually written in outputStream"""
+        if self.done:
+            return self.outputStream.write(data)
+        self.head += data
+        if self.extension == ".flac":
+            headerSize = getFLACHeaderSize(self.head)
+        else:
+            headerSize = getID3Size(self.head)
+        if headerSize is None or len(self.head) < headerSize:
+            return 0
+        return self.writeHead(headerSize)
+
+    def finish(self):
+        """Writes what is left of a stream shorter than its header"""
+        if self.done:
+            return 0
+        if self.extension == ".flac":
+            raise FLACNoHeaderError("Not a valid FLAC stream")
+        # Truncated ID3v2 tag, drop it
+        self.head = bytearray() if self.head[:3] == b"ID3" else self.head
+        return self.writeHead(0)
+
+    def flush(self):
+        self.outputStream.flush()
+
+
+def finishTags(path, track, save, extension):
+    """Completes the tags written by TagStream once the audio is complete"""
+    if extension == ".mp3":
+        # The ID3v2 tag keeps its size so it's overwritten in place
+        tag = ID3()
+        fillID3(tag, track, save)
+        saveID3(tag, path, save)
+    else:
+        # Same as deleteid3 in tagFLAC, ID3v1 can only be at the end
+        with open(path, "r+b") as f:
+            if f.seek(0, 2) >= 128:
+                f.seek(-128, 2)
+                if f.read(3) == b"TAG":
+                    f.seek(-128, 2)
+                    f.truncate()
@@ -1,24 +1,38 @@
 class Lyrics:
-    def __init__(self, lyr_id="0"):
+    def __init__(self, lyr_id="0", lyricsAPI=None):
         self.id = lyr_id
+        self.lyricsAPI = lyricsAPI
         self.sync = ""
         self.unsync = ""
         self.syncID3 = []
 
-    def parseLyrics(self, lyricsAPI):
+    def parseLyrics(self, lyricsAPI, sync=True, syncID3=True):
+        """Parses the lyrics, sync is the lrc text and syncID3 the SYLT frames"""
         self.unsync = lyricsAPI.get("LYRICS_TEXT")
-        if "LYRICS_SYNC_JSON" in lyricsAPI:
-            syncLyricsJson = lyricsAPI["LYRICS_SYNC_JSON"]
-            timestamp = ""
-            milliseconds = 0
-            for line, _ in enumerate(syncLyricsJson):
-                if syncLyricsJson[line]["line"] != "":
-                    timestamp = syncLyricsJson[line]["lrc_timestamp"]
-                    milliseconds = int(syncLyricsJson[line]["milliseconds"])
-                    self.syncID3.append((syncLyricsJson[line]["line"], milliseconds))
-                else:
-                    notEmptyLine = line + 1
-                    while syncLyricsJson[notEmptyLine]["line"] == "":
-                        notEmptyLine += 1
-                    timestamp = syncLyricsJson[notEmptyLine]["lrc_timestamp"]
-                self.sync += timestamp + syncLyricsJson[line]["line"] + "\r\n"
+        self.sync = ""
+        self.syncID3 = []
+        syncLyricsJson = lyricsAPI.get("LYRICS_SYNC_JSON")
+        if not syncLyricsJson or not (sync or syncID3):
+            return
+
+        # Empty lines take the timestamp of the next line with text, or of the
+        # previous one at the end
+        timestamps = [""] * len(syncLyricsJson)
+        timestamp = ""
+        for line in reversed(range(len(syncLyricsJson))):
+            if syncLyricsJson[line]["line"] != "":
+                timestamp = syncLyricsJson[line]["lrc_timestamp"]
+            timestamps[line] = timestamp
+        lastTimestamp = ""
+
+        syncLines = []
+        for line, lyric in enumerate(syncLyricsJson):
+            if lyric["line"] != "":
+                lastTimestamp = timestamps[line]
+                if syncID3:
+                    self.syncID3.append((lyric["line"], int(lyric["milliseconds"])))
+            if sync:
+                syncLines.append(
+                    (timestamps[line] or lastTimestamp) + lyric["line"] + "\r\n"
+                )
+        self.sync = "".join(syncLines)
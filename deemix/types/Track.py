@@ -1,10 +1,11 @@
 import re
-from datetime import datetime
+from time import time
 
 from deezer.utils import map_track, map_album
 from deezer.errors import APIError, GWAPIError
 from deemix.errors import NoDataToParse, AlbumDoesntExists
 
+from deemix.utils.cache import metadataCache, getAccountKey
 from deemix.utils import (
     removeFeatures,
     andCommaConcat,
@@ -24,6 +25,89 @@ from deemix.types import VARIOUS_ARTISTS
 from deemix.settings import FeaturesOption
 
 
+# Songs requested at once from song.getListData
+TRACKS_BATCH_SIZE = 200
+# Urls resolved in advance are used only if they're valid for this long
+URLS_MARGIN = 5 * 60
+# Track tokens are renewed a bit before they expire, so they are still valid
+# by the time the track is downloaded
+TOKEN_MARGIN = 60 * 60
+
+
+def isTokenExpiring(expiration):
+    return int(expiration or 0) < time() + TOKEN_MARGIN
+
+
+def getTracksGW(dz, trackIds, batchSize=TRACKS_BATCH_SIZE):
+    """Returns the gw data of many tracks by id, with their tokens and fallbacks
+
+    Tracks are requested batchSize at a time instead of one page at a time,
+    tracks gw doesn't return are left out. Cached tracks whose token is about
+    to expire are requested again to renew it.
+    """
+    tracks = {}
+    missing = []
+    for trackId in dict.fromkeys(str(trackId) for trackId in trackIds):
+        if int(trackId) <= 0:
+            continue
+        cached = metadataCache.get("track_gw", getAccountKey(dz, trackId))
+        if cached and not isTokenExpiring(cached.get("TRACK_TOKEN_EXPIRE")):
+            tracks[trackId] = cached
+        else:
+            missing.append(trackId)
+
+    for i in range(0, len(missing), batchSize):
+        batch = missing[i : i + batchSize]
+        try:
+            body = dz.gw.api_call("song.getListData", {"SNG_IDS": batch})
+        except GWAPIError:
+            continue
+        # Unavailable songs are skipped in the answer, match them by id
+        for trackAPI_gw in body.get("data", []):
+            trackId = str(trackAPI_gw["SNG_ID"])
+            metadataCache.set("track_gw", getAccountKey(dz, trackId), trackAPI_gw)
+            tracks[trackId] = trackAPI_gw
+    return tracks
+
+
+def getAlbumAPI(dz, alb_id, albumAPI=None, withGW=True):
+    """Completes albumAPI with the public and the gw api, None if the album doesn't exist
+
+    The gw api is skipped if withGW is False and the public api has the album.
+    """
+    # Get album Data
+    if not albumAPI:
+        try:
+            albumAPI = metadataCache.fetch(
+                "album", alb_id, lambda: dz.api.get_album(alb_id)
+            )
+        except APIError:
+            albumAPI = None
+
+    # Get album_gw Data
+    # Only gw has disk number
+    if not albumAPI or withGW and not albumAPI.get("nb_disk"):
+        try:
+            albumAPI_gw = metadataCache.fetch(
+                "album_gw",
+                getAccountKey(dz, alb_id),
+                lambda: dz.gw.get_album(alb_id),
+            )
+            albumAPI_gw = map_album(albumAPI_gw)
+        except GWAPIError:
+            albumAPI_gw = {}
+        if not albumAPI:
+            albumAPI = {}
+        albumAPI_gw.update(albumAPI)
+        albumAPI = albumAPI_gw
+
+    return albumAPI or None
+
+
+def getArtistAPI(dz, art_id):
+    return metadataCache.fetch("artist", art_id, lambda: dz.api.get_artist(art_id))
+
+
 class Track:
     def __init__(self, sng_id="0", name=""):
         self.id = sng_id
@@ -35,6 +119,7 @@ class Track:
         self.duration = 0
         self.fallbackID = "0"
         self.albumsFallback = []
+        self.albumsFallbackLoaded = False
         self.filesizes = {}
         self.local = False
         self.mainArtist = None
@@ -76,12 +161,30 @@ class Track:
             self.fallbackID = trackAPI["fallback_id"]
         self.local = int(self.id) < 0
         self.urls = {}
+        if (
+            trackAPI.get("urls")
+            and trackAPI.get("urls_expire", 0) > time() + URLS_MARGIN
+        ):
+            self.urls = dict(trackAPI["urls"])
 
     def parseData(
-        self, dz, track_id=None, trackAPI=None, albumAPI=None, playlistAPI=None
+        self,
+        dz,
+        track_id=None,
+        trackAPI=None,
+        albumAPI=None,
+        playlistAPI=None,
+        demand=None,
     ):
+        # Optional metadata to get, see getMetadataDemand
+        if demand is None:
+            demand = {"bpm": True, "artistPicture": True, "albumGW": True}
         if track_id and (not trackAPI or trackAPI and not trackAPI.get("track_token")):
-            trackAPI_new = dz.gw.get_track_with_fallback(track_id)
+            trackAPI_new = metadataCache.fetch(
+                "track_gw",
+                getAccountKey(dz, track_id),
+                lambda: dz.gw.get_track_with_fallback(track_id),
+            )
             trackAPI_new = map_track(trackAPI_new)
             if not trackAPI:
                 trackAPI = {}
@@ -93,9 +196,11 @@ class Track:
         self.parseEssentialData(trackAPI)
 
         # only public api has bpm
-        if not trackAPI.get("bpm") and not self.local:
+        if demand["bpm"] and not trackAPI.get("bpm") and not self.local:
             try:
-                trackAPI_new = dz.api.get_track(trackAPI["id"])
+                trackAPI_new = metadataCache.fetch(
+                    "track", trackAPI["id"], lambda: dz.api.get_track(trackAPI["id"])
+                )
                 trackAPI_new["release_date"] = trackAPI["release_date"]
                 trackAPI.update(trackAPI_new)
             except APIError:
@@ -106,15 +211,6 @@ class Track:
         else:
             self.parseTrack(trackAPI)
 
-            # Get Lyrics data
-            if not trackAPI.get("lyrics") and self.lyrics.id != "0":
-                try:
-                    trackAPI["lyrics"] = dz.gw.get_track_lyrics(self.id)
-                except GWAPIError:
-                    self.lyrics.id = "0"
-            if self.lyrics.id != "0":
-                self.lyrics.parseLyrics(trackAPI["lyrics"])
-
             # Parse Album Data
             self.album = Album(
                 alb_id=trackAPI["album"]["id"],
@@ -122,26 +218,7 @@ class Track:
                 pic_md5=trackAPI["album"].get("md5_origin"),
             )
 
-            # Get album Data
-            if not albumAPI:
-                try:
-                    albumAPI = dz.api.get_album(self.album.id)
-                except APIError:
-                    albumAPI = None
-
-            # Get album_gw Data
-            # Only gw has disk number
-            if not albumAPI or albumAPI and not albumAPI.get("nb_disk"):
-                try:
-                    albumAPI_gw = dz.gw.get_album(self.album.id)
-                    albumAPI_gw = map_album(albumAPI_gw)
-                except GWAPIError:
-                    albumAPI_gw = {}
-                if not albumAPI:
-                    albumAPI = {}
-                albumAPI_gw.update(albumAPI)
-                albumAPI = albumAPI_gw
-
+            albumAPI = getAlbumAPI(dz, self.album.id, albumAPI, demand["albumGW"])
             if not albumAPI:
                 raise AlbumDoesntExists
 
@@ -149,8 +226,8 @@ class Track:
             # albumAPI_gw doesn't contain the artist cover
             # Getting artist image ID
             # ex: https://e-cdns-images.dzcdn.net/images/artist/f2bc007e9133c946ac3c3907ddc5d2ea/56x56-000000-80-0-0.jpg
-            if not self.album.mainArtist.pic.md5 or self.album.mainArtist.pic.md5 == "":
-                artistAPI = dz.api.get_artist(self.album.mainArtist.id)
+            if demand["artistPicture"] and not self.album.mainArtist.pic.md5:
+                artistAPI = getArtistAPI(dz, self.album.mainArtist.id)
                 self.album.mainArtist.pic.md5 = artistAPI["picture_small"][
                     artistAPI["picture_small"].find("artist/") + 7 : -24
                 ]
@@ -208,7 +285,8 @@ class Track:
         self.rank = trackAPI["rank"]
         self.bpm = trackAPI["bpm"]
 
-        self.lyrics = Lyrics(trackAPI.get("lyrics_id", "0"))
+        # Lyrics are fetched and parsed by loadLyrics, only if they're saved
+        self.lyrics = Lyrics(trackAPI.get("lyrics_id", "0"), trackAPI.get("lyrics"))
 
         self.mainArtist = Artist(
             art_id=trackAPI["artist"]["id"],
@@ -242,6 +320,11 @@ class Track:
                     self.artist[artist["role"]] = []
                 self.artist[artist["role"]].append(artist["name"])
 
+        self.parseAlbumsFallback(trackAPI)
+
+    def parseAlbumsFallback(self, trackAPI):
+        # Only the track page has the alternative albums, batched data doesn't
+        self.albumsFallbackLoaded = "alternative_albums" in trackAPI
         if trackAPI.get("alternative_albums"):
             for album in trackAPI["alternative_albums"]["data"]:
                 if (
@@ -251,6 +334,21 @@ class Track:
                 ):
                     self.albumsFallback.append(album["ALB_ID"])
 
+    def loadAlbumsFallback(self, dz):
+        """Gets the alternative albums from the track page if they're missing"""
+        if self.albumsFallbackLoaded or self.local:
+            return
+        try:
+            trackAPI = metadataCache.fetch(
+                "track_gw",
+                getAccountKey(dz, self.id),
+                lambda: dz.gw.get_track_with_fallback(self.id),
+            )
+        except GWAPIError:
+            return
+        self.parseAlbumsFallback(map_track(trackAPI))
+        self.albumsFallbackLoaded = True
+
     def removeDuplicateArtists(self):
         (self.artist, self.artists) = removeDuplicateArtists(self.artist, self.artists)
 
@@ -270,13 +368,32 @@ class Track:
             self.featArtistsString = "feat. " + andCommaConcat(self.artist["Featured"])
 
     def checkAndRenewTrackToken(self, dz):
-        now = datetime.now()
-        expiration = datetime.fromtimestamp(self.trackTokenExpiration)
-        if now > expiration:
+        if isTokenExpiring(self.trackTokenExpiration):
             newTrack = dz.gw.get_track_with_fallback(self.id)
+            metadataCache.set("track_gw", getAccountKey(dz, self.id), newTrack)
             self.trackToken = newTrack["TRACK_TOKEN"]
             self.trackTokenExpiration = newTrack["TRACK_TOKEN_EXPIRE"]
 
+    def loadLyrics(self, dz, settings):
+        """Gets and parses the lyrics the settings save, if any"""
+        saveSync = settings["syncedLyrics"]
+        saveSyncID3 = settings["tags"]["syncedLyrics"]
+        if not (settings["tags"]["lyrics"] or saveSync or saveSyncID3):
+            return
+        if self.local or self.lyrics.id == "0":
+            return
+        if not self.lyrics.lyricsAPI:
+            try:
+                self.lyrics.lyricsAPI = metadataCache.fetch(
+                    "lyrics", self.id, lambda: dz.gw.get_track_lyrics(self.id)
+                )
+            except GWAPIError:
+                self.lyrics.id = "0"
+                return
+        self.lyrics.parseLyrics(
+            self.lyrics.lyricsAPI, sync=saveSync, syncID3=saveSyncID3
+        )
+
     def applySettings(self, settings):
 
         # Check if should save the playlist as a compilation
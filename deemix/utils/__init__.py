@@ -35,6 +35,17 @@ def getBitrateNumberFromText(txt):
     return None
 
 
+def getBandwidthFromText(txt):
+    """Converts rates like 800K, 10M or 1.5G to bytes per second"""
+    match = re.fullmatch(
+        r"(\d+(?:\.\d+)?)\s*([kmg]?)i?b?(?:/s)?", str(txt).strip().lower()
+    )
+    if not match:
+        return None
+    multiplier = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}[match.group(2)]
+    return int(float(match.group(1)) * multiplier)
+
+
 def changeCase(txt, case_type):
     if case_type == "lower":
         return txt.lower()
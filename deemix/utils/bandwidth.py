@@ -0,0 +1,158 @@
+from threading import Lock
+from time import monotonic, sleep
+
+# Seconds of traffic that can be sent at once after being idle
+BURST_SECONDS = 0.25
+# Downloads that didn't receive anything for this long don't get a share
+ACTIVE_WINDOW = 2
+# Seconds between two throughput reports of the same download
+REPORT_INTERVAL = 1
+
+
+class TokenBucket:
+    """Token bucket that can go in debt, the debt is the time to wait"""
+
+    def __init__(self, rate, now):
+        self.rate = rate
+        self.tokens = self.burst = rate * BURST_SECONDS
+        self.last = now
+
+    def setRate(self, rate):
+        self.rate = rate
+        self.burst = rate * BURST_SECONDS
+        self.tokens = min(self.tokens, self.burst)
+
+    def reserve(self, size, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= size
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class BandwidthLimiter:
+    """Caps the bandwidth of all the downloads and shares it fairly between them
+
+    Every download object (key) gets an equal share of the global rate while
+    it's active, a share left unused by a slower download isn't redistributed
+    until it goes idle. A rate of 0 means no limit, the throughput is still
+    measured and reported.
+    """
+
+    def __init__(self, rate=0):
+        self.lock = Lock()
+        self.rate = rate
+        self.bucket = None
+        self.downloads = {}
+        self.received = 0
+        self.windowStart = monotonic()
+        self.windowReceived = 0
+        self.throughput = 0
+
+    def configure(self, rate):
+        with self.lock:
+            if rate == self.rate:
+                return
+            self.rate = rate
+            self.bucket = None
+            for state in self.downloads.values():
+                state["bucket"] = None
+
+    def _getDownload(self, key, now):
+        state = self.downloads.get(key)
+        if not state:
+            # Forget downloads gone idle, so their share goes back to the others
+            for idleKey in [
+                idleKey
+                for idleKey, idle in self.downloads.items()
+                if now - idle["last"] > ACTIVE_WINDOW
+            ]:
+                del self.downloads[idleKey]
+            state = self.downloads[key] = {
+                "bucket": None,
+                "last": now,
+                "received": 0,
+                "windowStart": now,
+                "windowReceived": 0,
+                "throughput": 0,
+            }
+        return state
+
+    def reserve(self, key, size, listener=None):
+        """Accounts size bytes received by key, returns the seconds to wait
+
+        Traffic without a key, like the images, only counts against the
+        global rate and doesn't take a share from the downloads.
+        """
+        report = None
+        with self.lock:
+            now = monotonic()
+            self.received += size
+            self.windowReceived += size
+            if now - self.windowStart >= REPORT_INTERVAL:
+                self.throughput = self.windowReceived / (now - self.windowStart)
+                self.windowStart = now
+                self.windowReceived = 0
+
+            state = None
+            if key is not None:
+                state = self._getDownload(key, now)
+                state["last"] = now
+                state["received"] += size
+                state["windowReceived"] += size
+                if now - state["windowStart"] >= REPORT_INTERVAL:
+                    state["throughput"] = state["windowReceived"] / (
+                        now - state["windowStart"]
+                    )
+                    state["windowStart"] = now
+                    state["windowReceived"] = 0
+                    report = {
+                        "uuid": key,
+                        "throughput": round(state["throughput"]),
+                        "totalThroughput": round(self.throughput),
+                        "limit": self.rate,
+                    }
+
+            delay = 0
+            if self.rate:
+                if not self.bucket:
+                    self.bucket = TokenBucket(self.rate, now)
+                delay = self.bucket.reserve(size, now)
+            if self.rate and state:
+                share = self.rate / len(self.downloads)
+                if not state["bucket"]:
+                    state["bucket"] = TokenBucket(share, now)
+                elif state["bucket"].rate != share:
+                    state["bucket"].setRate(share)
+                delay = max(delay, state["bucket"].reserve(size, now))
+
+        if report and listener:
+            listener.send("downloadBandwidth", report)
+        return delay
+
+    def consume(self, key, size, listener=None):
+        """Waits until size bytes can be received by key"""
+        delay = self.reserve(key, size, listener)
+        if delay:
+            sleep(delay)
+
+    def getStats(self):
+        with self.lock:
+            return {
+                "limit": self.rate,
+                "received": self.received,
+                "throughput": round(self.throughput),
+                "downloads": {
+                    key: {
+                        "received": state["received"],
+                        "throughput": round(state["throughput"]),
+                    }
+                    for key, state in self.downloads.items()
+                },
+            }
+
+
+bandwidthLimiter = BandwidthLimiter()
+
+
+def getBandwidthStats():
+    return bandwidthLimiter.getStats()
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+import json
+import logging
+import sqlite3
+
+logger = logging.getLogger("deemix")
+
+DAY = 24 * 60 * 60
+# Seconds an entity is kept, by type. The track tokens in the gw tracks expire
+# sooner, they are renewed by themselves, see Track.checkAndRenewTrackToken
+CACHE_TTL = {
+    "track": 7 * DAY,
+    "track_gw": 7 * DAY,
+    "lyrics": 30 * DAY,
+    "album": 7 * DAY,
+    "album_gw": 7 * DAY,
+    "artist": 7 * DAY,
+}
+DEFAULT_TTL = DAY
+# Entities that depend on the account and its country, like the track tokens,
+# the available formats and the fallbacks, see getAccountKey
+ACCOUNT_KINDS = ["track_gw", "album_gw"]
+
+
+def getAccountKey(dz, key):
+    """Key of an entity of ACCOUNT_KINDS, separated by user and country"""
+    user = dz.current_user or {}
+    return f"{user.get('id', '')}:{user.get('country', '')}:{key}"
+
+
+class MetadataCache:
+    """Cache of the API responses, keyed by entity type and id
+
+    An in memory LRU sits in front of an optional SQLite database, so the
+    cache survives between runs. Values are stored as json, every get returns
+    a fresh copy the caller can modify.
+    """
+
+    def __init__(self, path=None, memorySize=2048):
+        self.lock = Lock()
+        self.memory = OrderedDict()
+        self.memorySize = memorySize
+        self.db = None
+        self.stats = {}
+        if path:
+            self.open(path)
+
+    def open(self, path):
+        try:
+            db = sqlite3.connect(str(path), check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS metadata "
+                "(kind TEXT, id TEXT, value TEXT, expiration REAL, "
+                "PRIMARY KEY (kind, id))"
+            )
+            db.execute("DELETE FROM metadata WHERE expiration < ?", (time(),))
+            db.commit()
+        except sqlite3.Error as e:
+            logger.warning("Couldn't open the metadata cache %s: %s", path, e)
+            return
+        with self.lock:
+            if self.db:
+                self.db.close()
+            self.db = db
+
+    def close(self):
+        with self.lock:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+    def _count(self, kind, result):
+        stats = self.stats.setdefault(kind, {"hits": 0, "misses": 0})
+        stats[result] += 1
+
+    def get(self, kind, key):
+        """Returns the cached value or None"""
+        key = str(key)
+        now = time()
+        with self.lock:
+            entry = self.memory.get((kind, key))
+            if entry and entry[1] > now:
+                self.memory.move_to_end((kind, key))
+                self._count(kind, "hits")
+                return json.loads(entry[0])
+            if entry:
+                del self.memory[(kind, key)]
+            if self.db:
+                row = self.db.execute(
+                    "SELECT value, expiration FROM metadata WHERE kind = ? AND id = ?",
+                    (kind, key),
+                ).fetchone()
+                if row and row[1] > now:
+                    self._remember(kind, key, row[0], row[1])
+                    self._count(kind, "hits")
+                    return json.loads(row[0])
+            self._count(kind, "misses")
+        return None
+
+    def _remember(self, kind, key, value, expiration):
+        self.memory[(kind, key)] = (value, expiration)
+        self.memory.move_to_end((kind, key))
+        if len(self.memory) > self.memorySize:
+            self.memory.popitem(last=False)
+
+    def set(self, kind, key, value):
+        key = str(key)
+        expiration = time() + CACHE_TTL.get(kind, DEFAULT_TTL)
+        data = json.dumps(value)
+        with self.lock:
+            self._remember(kind, key, data, expiration)
+            if self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)",
+                    (kind, key, data, expiration),
+                )
+                self.db.commit()
+
+    def invalidate(self, kind, key):
+        key = str(key)
+        with self.lock:
+            self.memory.pop((kind, key), None)
+            if self.db:
+                self.db.execute(
+                    "DELETE FROM metadata WHERE kind = ? AND id = ?", (kind, key)
+                )
+                self.db.commit()
+
+    def fetch(self, kind, key, fetcher):
+        """Returns the cached value, or calls fetcher and caches its result
+
+        Errors raised by fetcher aren't cached.
+        """
+        value = self.get(kind, key)
+        if value is None:
+            value = fetcher()
+            self.set(kind, key, value)
+        return value
+
+    def getStats(self):
+        with self.lock:
+            stats = {kind: dict(counts) for kind, counts in self.stats.items()}
+        stats["total"] = {
+            "hits": sum(counts["hits"] for counts in stats.values()),
+            "misses": sum(counts["misses"] for counts in stats.values()),
+        }
+        return stats
+
+
+metadataCache = MetadataCache()
+
+
+def setupMetadataCache(path):
+    """Makes the metadata cache persistent in the given SQLite file"""
+    metadataCache.open(path)
+
+
+def getCacheStats():
+    return metadataCache.getStats()
@@ -1,7 +1,11 @@
 import binascii
+from functools import lru_cache
 
 from Cryptodome.Cipher import Blowfish, AES
 from Cryptodome.Hash import MD5
+from Cryptodome.Util.strxor import strxor
+
+BLOWFISH_IV = b"\x00\x01\x02\x03\x04\x05\x06\x07"
 
 
 def _md5(data):
@@ -20,6 +24,7 @@ def _ecbDecrypt(key, data):
     )
 
 
+@lru_cache(maxsize=256)
 def generateBlowfishKey(trackId):
     SECRET = "g4el58wc0zvf9na1"
     idMd5 = _md5(trackId)
@@ -30,6 +35,45 @@ def generateBlowfishKey(trackId):
 
 
 def decryptChunk(key, data):
-    return Blowfish.new(
-        key, Blowfish.MODE_CBC, b"\x00\x01\x02\x03\x04\x05\x06\x07"
-    ).decrypt(data)
+    return Blowfish.new(key, Blowfish.MODE_CBC, BLOWFISH_IV).decrypt(data)
+
+
+class BlowfishContext:
+    """Keeps the Blowfish key schedule of a track and decrypts its stripes
+
+    Every stripe is crypted in CBC mode starting from the same IV, so the
+    stripes are decrypted with a single ECB cipher followed by the CBC xor.
+    """
+
+    def __init__(self, trackId):
+        self.trackId = str(trackId)
+        self.key = generateBlowfishKey(self.trackId)
+        self.cipher = Blowfish.new(self.key, Blowfish.MODE_ECB)
+
+    def decryptStripe(self, stripe):
+        """Decrypts in place a writable 2048 bytes stripe"""
+        # Previous ciphertext blocks, needed for the xor after the decryption
+        previous = bytearray(BLOWFISH_IV)
+        previous += stripe[:-8]
+        self.cipher.decrypt(stripe, output=stripe)
+        strxor(stripe, previous, output=stripe)
+
+    def decryptChunk(self, data):
+        chunk = bytearray(data)
+        self.decryptStripe(chunk)
+        return bytes(chunk)
+
+    def decryptStripes(self, buffer):
+        """Decrypts in place the first 2048 bytes of every 6144 bytes block"""
+        view = memoryview(buffer)
+        for offset in range(0, len(view) - 2047, 2048 * 3):
+            self.decryptStripe(view[offset : offset + 2048])
+
+
+@lru_cache(maxsize=64)
+def _getBlowfishContext(trackId):
+    return BlowfishContext(trackId)
+
+
+def getBlowfishContext(trackId):
+    return _getBlowfishContext(str(trackId))
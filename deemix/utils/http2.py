@@ -0,0 +1,98 @@
+import httpx
+import h2  # pylint: disable=W0611
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+def convertError(error, request):
+    """Returns the requests exception matching an httpx one"""
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.Timeout(error, request=request)
+    return requests.exceptions.ConnectionError(error, request=request)
+
+
+class HTTP2Body:
+    """Body of an httpx response read like the raw body of a requests one"""
+
+    def __init__(self, response, request):
+        self.response = response
+        self.request = request
+        self.chunks = response.iter_bytes()
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        try:
+            while size < 0 or len(self.buffer) < size:
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+                self.buffer += chunk
+        except httpx.TransportError as e:
+            raise convertError(e, self.request) from e
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        if not data:
+            self.close()
+        return data
+
+    def close(self):
+        self.response.close()
+
+
+class HTTP2Adapter(BaseAdapter):
+    """Transport adapter sending the requests through httpx, over HTTP/2
+
+    The requests to a host are multiplexed on one connection when it speaks
+    HTTP/2, the other hosts are served over HTTP/1.1. The responses are
+    converted to requests ones, so the callers don't change.
+    """
+
+    def __init__(self, poolSize, hosts):
+        super().__init__()
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=poolSize * hosts,
+                max_keepalive_connections=poolSize * hosts,
+            ),
+        )
+
+    def send(
+        self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None
+    ):  # pylint: disable=R0913
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        try:
+            response = self.client.send(
+                self.client.build_request(
+                    request.method,
+                    request.url,
+                    headers=dict(request.headers),
+                    content=request.body,
+                    timeout=timeout,
+                ),
+                stream=True,
+            )
+        except httpx.TransportError as e:
+            raise convertError(e, request) from e
+
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.reason = response.reason_phrase
+        result.headers = CaseInsensitiveDict(response.headers)
+        result.encoding = get_encoding_from_headers(result.headers)
+        result.raw = HTTP2Body(response, request)
+        result.url = request.url
+        result.request = request
+        result.connection = self
+        if not stream:
+            # Reads the whole body, like requests does
+            result.content  # pylint: disable=W0104
+        return result
+
+    def close(self):
+        self.client.close()
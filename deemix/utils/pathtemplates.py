@@ -15,6 +15,45 @@ bitrateLabels = {
     TrackFormats.LOCAL: "MP3",
 }
 
+# Settings that hold a template with placeholders
+TEMPLATES = [
+    "tracknameTemplate",
+    "albumTracknameTemplate",
+    "playlistTracknameTemplate",
+    "playlistNameTemplate",
+    "artistNameTemplate",
+    "albumNameTemplate",
+    "playlistFilenameTemplate",
+    "coverImageTemplate",
+    "artistImageTemplate",
+]
+
+
+def templatesUse(settings, placeholder, templates=None):
+    return any(placeholder in settings[template] for template in templates or TEMPLATES)
+
+
+def getMetadataDemand(settings):
+    """Returns which optional metadata is used by a tag or a template
+
+    bpm comes only from the public api, the artist picture is used only to
+    save the artist image and the gw album page adds the number of discs and
+    the physical release date of the album, which becomes the date of its
+    tracks.
+    """
+    return {
+        "bpm": settings["tags"]["bpm"] or templatesUse(settings, "%bpm%"),
+        "artistPicture": settings["saveArtworkArtist"],
+        "albumGW": settings["tags"]["discTotal"]
+        or templatesUse(settings, "%disctotal%")
+        or settings["createAlbumFolder"]
+        and settings["createCDFolder"]
+        or settings["tags"]["year"]
+        or settings["tags"]["date"]
+        or templatesUse(settings, "%year%")
+        or templatesUse(settings, "%date%"),
+    }
+
 
 def fixName(txt, char="_"):
     txt = str(txt)
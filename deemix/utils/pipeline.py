@@ -0,0 +1,157 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from heapq import heappop, heappush
+from itertools import count
+from threading import Condition, Thread
+
+
+class Stage:
+    """Bounded queue of items and the worker threads running one step on them
+
+    Items with a higher item["priority"] are taken first, in order otherwise.
+    """
+
+    def __init__(self, name, function, workers, queueSize):
+        self.name = name
+        self.function = function
+        self.workers = max(workers, 1)
+        self.queueSize = max(queueSize, 1)
+        self.items = []
+        self.order = count()
+        self.condition = Condition()
+        self.closed = False
+        self.threads = []
+        self.processed = 0
+
+    def put(self, item, force=False):
+        """Queues item, waits for a free slot unless force is set"""
+        with self.condition:
+            while not force and len(self.items) >= self.queueSize and not self.closed:
+                self.condition.wait()
+            heappush(self.items, (-item.get("priority", 0), next(self.order), item))
+            self.condition.notify_all()
+
+    def get(self):
+        """Returns the next item, None once the stage is closed and empty"""
+        with self.condition:
+            while not self.items and not self.closed:
+                self.condition.wait()
+            if not self.items:
+                return None
+            item = heappop(self.items)[2]
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class Pipeline:
+    """Runs every item through a list of stages, each with its own workers
+
+    stages is a list of (name, function, workers, queueSize). A stage function
+    takes the item and returns the name of the stage to send it to, or None
+    once the item is done. Items going back to an earlier stage, to be
+    downloaded again, skip the bound of its queue so the stages can't wait on
+    each other. onError(item, error) is called when a function raises and
+    returns the next stage as well. Items are dicts, item["result"] is the
+    result of their future.
+    """
+
+    def __init__(self, stages, onError):
+        self.stages = [Stage(*stage) for stage in stages]
+        self.stagesByName = {stage.name: stage for stage in self.stages}
+        self.onError = onError
+        self.futures = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        for stage in self.stages:
+            for i in range(stage.workers):
+                thread = Thread(
+                    target=self.work,
+                    args=(stage,),
+                    name=f"deemix-{stage.name}-{i}",
+                    daemon=True,
+                )
+                thread.start()
+                stage.threads.append(thread)
+
+    def submit(self, item, stageName=None):
+        """Sends item to the first stage, or to stageName, returns its future"""
+        item["future"] = Future()
+        self.futures.append(item["future"])
+        stage = self.stagesByName[stageName] if stageName else self.stages[0]
+        stage.put(item)
+        return item["future"]
+
+    def work(self, stage):
+        while True:
+            item = stage.get()
+            if item is None:
+                return
+            try:
+                try:
+                    nextStage = stage.function(item)
+                except Exception as e:
+                    nextStage = self.onError(item, e)
+            except BaseException as e:
+                item["future"].set_exception(e)
+                continue
+            with stage.condition:
+                stage.processed += 1
+            if nextStage:
+                nextStage = self.stagesByName[nextStage]
+                goingBack = self.stages.index(nextStage) <= self.stages.index(stage)
+                nextStage.put(item, force=goingBack)
+            else:
+                item["future"].set_result(item.get("result"))
+
+    def close(self):
+        """Stops the workers once every item submitted is done"""
+        wait(self.futures)
+        for stage in self.stages:
+            stage.close()
+        for stage in self.stages:
+            for thread in stage.threads:
+                thread.join()
+
+    def getStats(self):
+        return {
+            stage.name: {
+                "workers": stage.workers,
+                "queued": len(stage.items),
+                "processed": stage.processed,
+            }
+            for stage in self.stages
+        }
+
+
+def mapAhead(function, items, workers, window=None):
+    """Yields the futures of function(item) in order, run ahead in a pool
+
+    At most window items, twice the workers by default, are started ahead
+    of the one being waited for.
+    """
+    window = window or workers * 2
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(function, item))
+                if len(pending) >= window:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        finally:
+            # Closed early, the items not started yet are dropped
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,196 @@
+from random import uniform
+from ssl import SSLError
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import urlparse
+import logging
+
+from requests.exceptions import (
+    ConnectionError as RequestsConnectionError,
+    ReadTimeout,
+    ChunkedEncodingError,
+    HTTPError,
+)
+from urllib3.exceptions import SSLError as u3SSLError
+
+logger = logging.getLogger("deemix")
+
+RETRYABLE_ERRORS = (
+    SSLError,
+    u3SSLError,
+    RequestsConnectionError,
+    ReadTimeout,
+    ChunkedEncodingError,
+    HTTPError,
+)
+# HTTP errors that mean the server is throttling us or temporarily down
+RETRYABLE_STATUS = [429, 500, 502, 503, 504]
+
+
+class RetryPolicy:
+    """How many times and how fast failed requests are retried"""
+
+    def __init__(
+        self,
+        maxRetries=5,
+        baseDelay=1,
+        maxDelay=30,
+        breakerThreshold=10,
+        breakerCooldown=60,
+    ):
+        self.maxRetries = maxRetries
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        # Consecutive failures on a host before the circuit opens
+        self.breakerThreshold = breakerThreshold
+        # Seconds requests to a host wait once its circuit is open
+        self.breakerCooldown = breakerCooldown
+
+    def getDelay(self, attempt):
+        delay = min(self.maxDelay, self.baseDelay * 2**attempt)
+        return uniform(delay / 2, delay)
+
+
+class RetryManager:
+    """Keeps the circuit breaker and the retry counters of every host"""
+
+    def __init__(self, policy=None):
+        self.policy = policy or RetryPolicy()
+        self.hosts = {}
+        self.lock = Lock()
+
+    def _getHost(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {
+                "consecutiveFailures": 0,
+                "openUntil": 0,
+                "retries": 0,
+                "throttled": 0,
+                "exhausted": 0,
+                "circuitOpened": 0,
+            }
+        return self.hosts[host]
+
+    def check(self, host):
+        """Returns the seconds left before requests to host resume, or 0"""
+        with self.lock:
+            return max(0, self._getHost(host)["openUntil"] - monotonic())
+
+    def success(self, host):
+        with self.lock:
+            self._getHost(host)["consecutiveFailures"] = 0
+
+    def failure(self, host, attempt, throttled=False):
+        """Records a failure, returns the seconds to wait or None to give up"""
+        with self.lock:
+            state = self._getHost(host)
+            state["consecutiveFailures"] += 1
+            if throttled:
+                state["throttled"] += 1
+            if state["consecutiveFailures"] >= self.policy.breakerThreshold:
+                state["consecutiveFailures"] = 0
+                state["openUntil"] = monotonic() + self.policy.breakerCooldown
+                state["circuitOpened"] += 1
+                logger.warning(
+                    "Too many failures on %s, pausing requests for %ss",
+                    host,
+                    self.policy.breakerCooldown,
+                )
+            if attempt >= self.policy.maxRetries:
+                state["exhausted"] += 1
+                return None
+            state["retries"] += 1
+        return self.policy.getDelay(attempt)
+
+    def getStats(self):
+        with self.lock:
+            return {
+                host: {
+                    key: value
+                    for key, value in state.items()
+                    if key not in ["consecutiveFailures", "openUntil"]
+                }
+                for host, state in self.hosts.items()
+            }
+
+
+retryManager = RetryManager()
+
+
+def getRetryStats():
+    return retryManager.getStats()
+
+
+class Retrying:
+    """Retry state of a single operation
+
+    Usage:
+        retrying = Retrying(url)
+        while True:
+            retrying.check()
+            try:
+                ...
+                retrying.success()
+                break
+            except RETRYABLE_ERRORS as e:
+                if not retrying.backoff(e):
+                    raise
+    """
+
+    def __init__(self, url, manager=None):
+        self.host = urlparse(url).netloc
+        self.manager = manager or retryManager
+        self.attempt = 0
+
+    def getPause(self):
+        """Returns the seconds to wait before a request, while the circuit is open"""
+        return self.manager.check(self.host)
+
+    def check(self):
+        """Waits for the host to be available again"""
+        delay = self.getPause()
+        if delay:
+            logger.debug("Waiting %.1fs for %s to be available again", delay, self.host)
+            sleep(delay)
+
+    def success(self):
+        self.manager.success(self.host)
+
+    def reset(self):
+        """Gives back all the retries, when the failed attempt made progress"""
+        self.attempt = 0
+
+    def nextDelay(self, error):
+        """Returns the seconds to wait before the next attempt or None to give up"""
+        throttled = False
+        if isinstance(error, HTTPError):
+            if error.response is None:
+                return None
+            status = error.response.status_code
+        else:
+            # Status of HTTP errors raised by other clients, like aiohttp
+            status = getattr(error, "status", None)
+        if status is not None:
+            if status not in RETRYABLE_STATUS:
+                return None
+            throttled = status == 429
+        delay = self.manager.failure(self.host, self.attempt, throttled)
+        if delay is None:
+            return None
+        logger.debug(
+            "%s on %s, retry %s in %.1fs",
+            type(error).__name__,
+            self.host,
+            self.attempt + 1,
+            delay,
+        )
+        self.attempt += 1
+        return delay
+
+    def backoff(self, error):
+        """Waits before the next attempt, returns False if it shouldn't retry"""
+        delay = self.nextDelay(error)
+        if delay is None:
+            return False
+        sleep(delay)
+        return True
@@ -0,0 +1,159 @@
+from threading import Lock
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from deemix.utils import USER_AGENT_HEADER
+
+try:
+    from deemix.utils.http2 import HTTP2Adapter
+except ImportError:
+    HTTP2Adapter = None
+
+logger = logging.getLogger("deemix")
+
+DEFAULT_POOL_SIZE = 10
+# Tracks are spread over the e-cdns-proxy-[0-f] hosts, plus the images one
+HOST_POOLS = 20
+DEFAULT_TIMEOUT = (10, 10)
+
+
+class ConnectionStats:
+    """Counts the requests sent and the connections opened to serve them"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.requests = 0
+        self.opened = 0
+
+    def addRequest(self):
+        with self.lock:
+            self.requests += 1
+
+    def addConnection(self):
+        with self.lock:
+            self.opened += 1
+
+    def get(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "connectionsOpened": self.opened,
+                "connectionsReused": max(self.requests - self.opened, 0),
+            }
+
+
+connectionStats = ConnectionStats()
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        connectionStats.addConnection()
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        connectionStats.addConnection()
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    """Keep-alive adapter that counts new and reused connections"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):
+        connectionStats.addRequest()
+        return super().send(request, *args, **kwargs)
+
+
+class SessionManager:
+    """Shares a single pooled session between all the download threads
+
+    Connections are kept alive and reused per host, the pool of every host is
+    as big as the number of concurrent downloads.
+    transport is "http1", or "http2" to mount HTTP2Adapter in place of
+    PooledAdapter. HTTP/2 needs httpx and h2, without them the session falls
+    back to HTTP/1.1.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.session = None
+        self.poolSize = DEFAULT_POOL_SIZE
+        self.timeout = DEFAULT_TIMEOUT
+        self.transport = "http1"
+
+    def configure(self, poolSize=None, timeout=None, transport=None):
+        with self.lock:
+            poolSize = poolSize or self.poolSize
+            transport = transport or self.transport
+            if transport == "http2" and not HTTP2Adapter:
+                logger.warning("HTTP/2 needs httpx and h2 installed, using HTTP/1.1")
+                transport = "http1"
+            if timeout:
+                self.timeout = timeout
+            if (
+                self.session
+                and poolSize == self.poolSize
+                and transport == self.transport
+            ):
+                return
+            self.poolSize = poolSize
+            self.transport = transport
+            # Requests in flight keep using the old session until they end
+            self.session = None
+
+    def _createSession(self):
+        session = requests.Session()
+        session.headers.update({"User-Agent": USER_AGENT_HEADER})
+        if self.transport == "http2":
+            adapter = HTTP2Adapter(self.poolSize, HOST_POOLS)
+        else:
+            adapter = PooledAdapter(
+                pool_connections=HOST_POOLS, pool_maxsize=self.poolSize
+            )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get(self):
+        with self.lock:
+            if not self.session:
+                self.session = self._createSession()
+            return self.session
+
+
+sessionManager = SessionManager()
+
+
+def configureSession(settings):
+    """Sizes the shared session for the concurrency of the given settings and
+    mounts the transport httpTransport asks for
+    """
+    sessionManager.configure(
+        poolSize=max(settings["queueConcurrency"], 1)
+        * max(settings["downloadSegments"], 1),
+        timeout=(settings["connectTimeout"], settings["readTimeout"]),
+        transport=settings["httpTransport"],
+    )
+
+
+def getSession():
+    return sessionManager.get()
+
+
+def getTimeout():
+    return sessionManager.timeout
+
+
+def getConnectionStats():
+    return connectionStats.get()
@@ -0,0 +1,38 @@
+from random import Random
+
+import pytest
+
+from deemix.utils.retry import RetryPolicy, retryManager
+from stubs import CDN, TRACK_ID, encrypt
+
+# Deterministic track data, not starting with null bytes
+DATA = b"\x01" + Random(0).randbytes(3 * 1024 * 1024)
+
+
+@pytest.fixture
+def data():
+    return DATA
+
+
+@pytest.fixture
+def cdn():
+    server = CDN(encrypt(TRACK_ID, DATA))
+    yield server
+    server.close()
+
+
+@pytest.fixture(autouse=True)
+def fastRetries():
+    """Retries without waiting, the circuit opens after 3 failures for 0.5s"""
+    policy = retryManager.policy
+    retryManager.policy = RetryPolicy(
+        maxRetries=3,
+        baseDelay=0.01,
+        maxDelay=0.02,
+        breakerThreshold=3,
+        breakerCooldown=0.5,
+    )
+    retryManager.hosts = {}
+    yield retryManager
+    retryManager.policy = policy
+    retryManager.hosts = {}
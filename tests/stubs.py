@@ -0,0 +1,211 @@
+"""Local stand-ins for the Deezer CDN and track fixtures, shared by the tests
+and the benchmarks"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
+from types import SimpleNamespace
+import os
+import re
+import socket
+import struct
+from time import sleep
+
+from Cryptodome.Cipher import Blowfish
+
+from deemix.settings import DEFAULTS
+from deemix.utils.crypto import generateBlowfishKey
+
+TRACK_ID = "3135556"
+
+
+def encrypt(trackId, data):
+    """Crypts data like the CDN does, the first 2048 bytes of every 6144"""
+    key = generateBlowfishKey(str(trackId))
+    data = bytearray(data)
+    for position in range(0, len(data) - 2047, 6144):
+        cipher = Blowfish.new(
+            key, Blowfish.MODE_CBC, b"\x00\x01\x02\x03\x04\x05\x06\x07"
+        )
+        data[position : position + 2048] = cipher.encrypt(
+            bytes(data[position : position + 2048])
+        )
+    return bytes(data)
+
+
+def fakeTrack(url, trackId=TRACK_ID):
+    return SimpleNamespace(
+        id=trackId,
+        title="Track",
+        mainArtist=SimpleNamespace(name="Artist"),
+        downloadURL=url,
+    )
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many streams connect at once in the benchmarks
+    request_queue_size = 1024
+
+
+class CDN:
+    """HTTP server serving data at every path, with range requests
+
+    refuse connections are closed before any response, then drop responses
+    are cut after dropAfter bytes of the body. With ranges unset the Range
+    header is ignored and the whole body is sent with a 200.
+    delay adds the seconds every request waits before its response, pace
+    the seconds between two pieces of PACE_SIZE bytes of the body.
+    """
+
+    PACE_SIZE = 64 * 1024
+
+    def __init__(self, data, ranges=True, delay=0, pace=0):
+        self.data = data
+        self.ranges = ranges
+        self.delay = delay
+        self.pace = pace
+        self.refuse = 0
+        self.drop = 0
+        self.dropAfter = 0
+        self.requests = []
+        self.lock = Lock()
+        self.server = Server(("127.0.0.1", 0), self.getHandler())
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.host = f"127.0.0.1:{self.server.server_address[1]}"
+        self.url = f"http://{self.host}/mobile/1/track"
+        self.plainURL = f"http://{self.host}/api/1/track"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def take(self, counter):
+        """Decrements counter if set, tells if this request is affected"""
+        with self.lock:
+            if getattr(self, counter) > 0:
+                setattr(self, counter, getattr(self, counter) - 1)
+                return True
+        return False
+
+    def getHandler(self):
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def getRange(self):
+                match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if not cdn.ranges or not match:
+                    return 0, len(cdn.data), False
+                start = int(match.group(1))
+                end = int(match.group(2)) + 1 if match.group(2) else len(cdn.data)
+                return start, min(end, len(cdn.data)), True
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(cdn.data)))
+                if cdn.ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+
+            def do_GET(self):
+                with cdn.lock:
+                    cdn.requests.append(self.headers.get("Range"))
+                if cdn.take("refuse"):
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                if cdn.delay:
+                    sleep(cdn.delay)
+                start, end, partial = self.getRange()
+                self.send_response(206 if partial else 200)
+                self.send_header("Content-Length", str(end - start))
+                if partial:
+                    self.send_header(
+                        "Content-Range", f"bytes {start}-{end - 1}/{len(cdn.data)}"
+                    )
+                self.end_headers()
+                body = cdn.data[start:end]
+                if len(body) > cdn.dropAfter and cdn.take("drop"):
+                    self.wfile.write(body[: cdn.dropAfter])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                if not cdn.pace:
+                    self.wfile.write(body)
+                    return
+                for position in range(0, len(body), cdn.PACE_SIZE):
+                    self.wfile.write(body[position : position + cdn.PACE_SIZE])
+                    sleep(cdn.pace)
+
+        return Handler
+
+
+def makeFLAC(audioSize):
+    """A FLAC file with a streaminfo, a comment and a padding block"""
+    streaminfo = bytearray(34)
+    streaminfo[0:4] = struct.pack(">HH", 4096, 4096)
+    # 44100 Hz, 2 channels, 16 bits, 200 seconds
+    info = (44100 << 44) | (1 << 41) | (15 << 36) | (44100 * 200)
+    streaminfo[10:18] = info.to_bytes(8, "big")
+    vendor = b"reference libFLAC 1.3.2"
+    comment = struct.pack("<I", len(vendor)) + vendor + struct.pack("<II", 1, 9)
+    blocks = [(0, bytes(streaminfo)), (4, comment + b"TITLE=old"), (1, bytes(8192))]
+    data = bytearray(b"fLaC")
+    for i, (blockType, block) in enumerate(blocks):
+        last = 0x80 if i == len(blocks) - 1 else 0
+        data += bytes([last | blockType]) + len(block).to_bytes(3, "big") + block
+    return bytes(data) + b"\xff\xf8" + os.urandom(audioSize - 2)
+
+
+def getTaggedTrack(coverPath=None):
+    """A track with every field the tagger writes"""
+    mainArtist = SimpleNamespace(name="Artist", save=True)
+    album = SimpleNamespace(
+        title="Album",
+        artists=["Artist", "Other"],
+        mainArtist=mainArtist,
+        trackTotal=12,
+        discTotal=1,
+        genre=["Pop"],
+        label="Label",
+        barcode="724384960650",
+        recordType="album",
+        embeddedCoverPath=coverPath,
+    )
+    return SimpleNamespace(
+        id=TRACK_ID,
+        title="Title",
+        artists=["Artist", "Other"],
+        mainArtist=mainArtist,
+        artistsString="Artist, Other",
+        album=album,
+        trackNumber=3,
+        discNumber=1,
+        date=SimpleNamespace(year=2020, month=11, day=5),
+        dateString="2020-11-05",
+        duration=215,
+        bpm=120.0,
+        ISRC="GBDUW0000001",
+        explicit=False,
+        replayGain="-5 dB",
+        lyrics=SimpleNamespace(unsync="la la", syncID3=[("la", 1000)]),
+        contributors={"composer": ["Composer"], "producer": ["Producer"]},
+        copyright="(c) Label",
+        playlist=None,
+        rank=500000,
+    )
+
+
+# Every tag saved, the other options keep their defaults
+ALL_TAGS = {
+    **DEFAULTS["tags"],
+    **{key: True for key, value in DEFAULTS["tags"].items() if value is False},
+    "savePlaylistAsCompilation": False,
+    "useNullSeparator": False,
+    "singleAlbumArtist": False,
+    "coverDescriptionUTF8": False,
+}
@@ -0,0 +1,42 @@
+import asyncio
+from time import monotonic, sleep
+from types import SimpleNamespace
+
+import pytest
+
+from deemix.settings import DEFAULTS
+
+pytest.importorskip("aiohttp")
+from deemix.asyncdownloader import AsyncDownloader  # pylint: disable=C0413
+
+
+class RecordingDownloader(AsyncDownloader):
+    """Records when every track starts instead of downloading it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = []
+
+    def getTracksExtraData(self, tracks):
+        return [{"trackAPI": track} for track in tracks]
+
+    async def downloadWrapperAsync(self, extraData, track=None):
+        self.started.append((extraData["trackAPI"]["id"], monotonic()))
+        return extraData["trackAPI"]["id"]
+
+
+def test_streamed_tracks_start_while_they_are_read():
+    read = {}
+
+    def tracks():
+        for i in range(5):
+            sleep(0.1)
+            yield {"id": i}
+        read["end"] = monotonic()
+
+    downloadObject = SimpleNamespace(bitrate=3, uuid="test", isCanceled=False)
+    downloader = RecordingDownloader(None, downloadObject, DEFAULTS, tracks=tracks())
+    tasks = asyncio.run(downloader.downloadAll(downloader.iterCollectionExtraData()))
+    assert [task.result() for task in tasks] == [0, 1, 2, 3, 4]
+    assert [i for i, _ in downloader.started] == [0, 1, 2, 3, 4]
+    assert downloader.started[0][1] < read["end"] - 0.3
@@ -0,0 +1,30 @@
+from deemix.utils.bandwidth import BandwidthLimiter
+
+
+def getShare(limiter, key):
+    return limiter.downloads[key]["bucket"].rate
+
+
+def test_images_dont_take_a_share():
+    limiter = BandwidthLimiter(1000000)
+    limiter.reserve("A", 1000)
+    limiter.reserve(None, 50000)
+    limiter.reserve("A", 1000)
+    assert getShare(limiter, "A") == 1000000
+    assert None not in limiter.downloads
+    assert limiter.getStats()["received"] == 52000
+
+
+def test_images_count_against_the_global_rate():
+    limiter = BandwidthLimiter(1000000)
+    # The burst is a quarter of a second of traffic
+    assert limiter.reserve(None, 250000) == 0
+    assert limiter.reserve(None, 100000) > 0.09
+
+
+def test_downloads_share_the_rate():
+    limiter = BandwidthLimiter(1000000)
+    limiter.reserve("A", 1000)
+    limiter.reserve("B", 1000)
+    limiter.reserve("A", 1000)
+    assert getShare(limiter, "A") == getShare(limiter, "B") == 500000
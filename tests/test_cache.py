@@ -0,0 +1,81 @@
+from time import time
+from types import SimpleNamespace
+
+import deemix.types.Track
+from deemix.types.Track import Track, getTracksGW
+from deemix.utils.cache import MetadataCache, getAccountKey
+
+
+def getDeezer(userId, country):
+    return SimpleNamespace(current_user={"id": userId, "country": country})
+
+
+def test_account_entities_are_kept_per_user_and_country(tmp_path):
+    cache = MetadataCache(tmp_path / "metadata.db")
+    france = getDeezer(1, "FR")
+    cache.set("track_gw", getAccountKey(france, 3135556), {"TRACK_TOKEN": "fr"})
+    cache.close()
+
+    cache = MetadataCache(tmp_path / "metadata.db")
+    assert cache.get("track_gw", getAccountKey(france, 3135556)) == {
+        "TRACK_TOKEN": "fr"
+    }
+    for dz in [getDeezer(2, "FR"), getDeezer(1, "DE"), getDeezer(None, None)]:
+        assert cache.get("track_gw", getAccountKey(dz, 3135556)) is None
+
+
+def test_cached_tracks_of_another_account_arent_used(monkeypatch):
+    calls = []
+
+    def api_call(method, args):
+        calls.append(args["SNG_IDS"])
+        return {"data": [{"SNG_ID": "1", "TRACK_TOKEN": "de"}]}
+
+    cache = MetadataCache()
+    monkeypatch.setattr(deemix.types.Track, "metadataCache", cache)
+    cache.set("track_gw", getAccountKey(getDeezer(1, "FR"), 1), {"SNG_ID": "1"})
+    dz = getDeezer(1, "DE")
+    dz.gw = SimpleNamespace(api_call=api_call)
+    assert getTracksGW(dz, [1]) == {"1": {"SNG_ID": "1", "TRACK_TOKEN": "de"}}
+    assert calls == [["1"]]
+
+
+def test_gw_tracks_outlive_their_token():
+    cache = MetadataCache()
+    trackAPI_gw = {"SNG_ID": "1", "TRACK_TOKEN_EXPIRE": int(time()) + 600}
+    cache.set("track_gw", "1", trackAPI_gw)
+    assert cache.get("track_gw", "1") == trackAPI_gw
+
+
+def test_expiring_token_is_renewed(monkeypatch):
+    cache = MetadataCache()
+    monkeypatch.setattr(deemix.types.Track, "metadataCache", cache)
+    renewed = {"SNG_ID": "1", "TRACK_TOKEN": "new", "TRACK_TOKEN_EXPIRE": 2**31}
+    dz = getDeezer(1, "FR")
+    dz.gw = SimpleNamespace(get_track_with_fallback=lambda trackId: renewed)
+    track = Track("1")
+    track.trackToken = "old"
+    track.trackTokenExpiration = int(time()) + 600
+    track.checkAndRenewTrackToken(dz)
+    assert track.trackToken == "new"
+    assert cache.get("track_gw", getAccountKey(dz, "1")) == renewed
+
+
+def test_batched_gw_tracks_are_cached(monkeypatch):
+    calls = []
+
+    def api_call(method, args):
+        calls.append(args["SNG_IDS"])
+        return {
+            "data": [
+                {"SNG_ID": trackId, "TRACK_TOKEN_EXPIRE": 2**31}
+                for trackId in args["SNG_IDS"]
+            ]
+        }
+
+    monkeypatch.setattr(deemix.types.Track, "metadataCache", MetadataCache())
+    dz = getDeezer(1, "FR")
+    dz.gw = SimpleNamespace(api_call=api_call)
+    first = getTracksGW(dz, [1, 2, 3])
+    assert getTracksGW(dz, [1, 2, 3]) == first
+    assert calls == [["1", "2", "3"]]
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+from click.testing import CliRunner
+
+import deemix.__main__ as cli
+from deemix.downloader import Downloader
+from deemix.errors import GenerationError
+
+
+class RecordingDownloader(Downloader):
+    started = []
+
+    def __init__(self, dz, downloadObject, settings, listener=None, tracks=None):
+        # pylint: disable=W0231
+        self.downloadObject = downloadObject
+
+    def submit(self, pipeline, priority=0):
+        self.started.append(self.downloadObject.uuid)
+        return []
+
+    def finish(self, futures):
+        pass
+
+
+class FakeDeezer:
+    def login_via_arl(self, arl):
+        return True
+
+
+def generate(dz, link, bitrate, plugins, listener):
+    if link.endswith("/2"):
+        raise GenerationError(link, "Link ID not recognized")
+    if link.endswith("/3"):
+        raise ConnectionError("Connection reset by peer")
+    return SimpleNamespace(uuid=link, __type__="Collection")
+
+
+def test_a_failing_link_doesnt_stop_the_next_ones(tmp_path, monkeypatch, caplog):
+    (tmp_path / "config").mkdir()
+    (tmp_path / "config" / ".arl").write_text("arl")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cli, "Deezer", FakeDeezer)
+    monkeypatch.setattr(cli, "Spotify", None)
+    monkeypatch.setattr(cli, "setupMetadataCache", lambda path: None)
+    monkeypatch.setattr(cli, "Downloader", RecordingDownloader)
+    monkeypatch.setattr(cli, "generateDownloadObject", generate)
+    RecordingDownloader.started = []
+    links = [f"https://deezer.com/album/{i}" for i in range(1, 6)]
+
+    result = CliRunner().invoke(cli.download, ["--portable", ";".join(links)])
+
+    assert result.exit_code == 0, result.output
+    assert RecordingDownloader.started == [links[0], links[3], links[4]]
+    assert f"{links[1]}: Link ID not recognized" in result.output
+    assert f"Couldn't resolve {links[2]}: Connection reset by peer" in caplog.text
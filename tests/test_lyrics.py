@@ -0,0 +1,85 @@
+import pytest
+
+from deemix.types.Lyrics import Lyrics
+
+
+def parseLyricsBefore(lyricsAPI):
+    """The parser before the lyrics were parsed in one pass, as a reference"""
+    sync = ""
+    syncID3 = []
+    syncLyricsJson = lyricsAPI["LYRICS_SYNC_JSON"]
+    timestamp = ""
+    for line, _ in enumerate(syncLyricsJson):
+        if syncLyricsJson[line]["line"] != "":
+            timestamp = syncLyricsJson[line]["lrc_timestamp"]
+            milliseconds = int(syncLyricsJson[line]["milliseconds"])
+            syncID3.append((syncLyricsJson[line]["line"], milliseconds))
+        else:
+            notEmptyLine = line + 1
+            while syncLyricsJson[notEmptyLine]["line"] == "":
+                notEmptyLine += 1
+            timestamp = syncLyricsJson[notEmptyLine]["lrc_timestamp"]
+        sync += timestamp + syncLyricsJson[line]["line"] + "\r\n"
+    return sync, syncID3
+
+
+def syncLine(line, milliseconds):
+    minutes, seconds = divmod(milliseconds / 1000, 60)
+    return {
+        "line": line,
+        "milliseconds": str(milliseconds),
+        "lrc_timestamp": f"[{int(minutes):02d}:{seconds:05.2f}]",
+    }
+
+
+LINES = [
+    syncLine("", 0),
+    syncLine("First line", 1500),
+    syncLine("Second line", 4250),
+    syncLine("", 0),
+    syncLine("", 0),
+    syncLine("After the break", 61020),
+    syncLine("Last line", 65000),
+]
+TRAILING = [syncLine("", 0), syncLine("", 0)]
+
+
+def getLyricsAPI(lines):
+    return {"LYRICS_TEXT": "First line\nSecond line", "LYRICS_SYNC_JSON": lines}
+
+
+def test_blank_lines_match_the_previous_parser():
+    lyricsAPI = getLyricsAPI(LINES)
+    lyrics = Lyrics()
+    lyrics.parseLyrics(lyricsAPI)
+    assert (lyrics.sync, lyrics.syncID3) == parseLyricsBefore(lyricsAPI)
+    assert lyrics.unsync == lyricsAPI["LYRICS_TEXT"]
+
+
+@pytest.mark.parametrize("sync,syncID3", [(True, False), (False, True)])
+def test_one_format_matches_the_previous_parser(sync, syncID3):
+    lyricsAPI = getLyricsAPI(LINES)
+    expectedSync, expectedSyncID3 = parseLyricsBefore(lyricsAPI)
+    lyrics = Lyrics()
+    lyrics.parseLyrics(lyricsAPI, sync=sync, syncID3=syncID3)
+    assert lyrics.sync == (expectedSync if sync else "")
+    assert lyrics.syncID3 == (expectedSyncID3 if syncID3 else [])
+
+
+def test_trailing_blank_lines_keep_the_last_timestamp():
+    # The previous parser ran past the end of the lines here
+    with pytest.raises(IndexError):
+        parseLyricsBefore(getLyricsAPI(LINES + TRAILING))
+
+    lyrics = Lyrics()
+    lyrics.parseLyrics(getLyricsAPI(LINES + TRAILING))
+    expectedSync, expectedSyncID3 = parseLyricsBefore(getLyricsAPI(LINES))
+    lastTimestamp = LINES[-1]["lrc_timestamp"]
+    assert lyrics.sync == expectedSync + 2 * (lastTimestamp + "\r\n")
+    assert lyrics.syncID3 == expectedSyncID3
+
+
+def test_unsynced_lyrics():
+    lyrics = Lyrics()
+    lyrics.parseLyrics({"LYRICS_TEXT": "Only text"})
+    assert (lyrics.unsync, lyrics.sync, lyrics.syncID3) == ("Only text", "", [])
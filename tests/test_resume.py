@@ -0,0 +1,107 @@
+import asyncio
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+
+from deemix.decryption import STREAM_BUFFER_SIZE, streamTrack
+from deemix.downloader import Downloader, PartialDownload
+from deemix.errors import RangeNotSupported
+from deemix.processpool import processPool
+from deemix.settings import DEFAULTS
+from stubs import fakeTrack
+
+RESUME_AT = 4 * STREAM_BUFFER_SIZE
+
+
+def getJob(cdn, tmp_path):
+    track = fakeTrack(cdn.url)
+    track.bitrate = 3
+    track.local = True
+    writepath = tmp_path / "track.mp3"
+    return {
+        "track": track,
+        "partial": PartialDownload(writepath, track),
+        "extension": ".mp3",
+        "itemData": {},
+        "writepath": writepath,
+    }
+
+
+def interrupt(job, data):
+    """Leaves a .part file like a download stopped at RESUME_AT"""
+    partial = job["partial"]
+    partial.path.write_bytes(data[:RESUME_AT])
+    partial.size = len(data)
+    partial.received = partial.written = RESUME_AT
+    partial.save()
+
+
+@pytest.fixture
+def downloader():
+    downloadObject = SimpleNamespace(
+        bitrate=3,
+        uuid="test",
+        isCanceled=False,
+        size=1,
+        progressNext=0,
+        updateProgress=lambda listener: None,
+    )
+    return Downloader(None, downloadObject, DEFAULTS)
+
+
+@pytest.fixture(params=["threads", "async"])
+def stream(request, downloader):
+    """Downloads the .part file of a job with one of the engines"""
+    if request.param == "threads":
+        return downloader.streamDownload
+    aiohttp = pytest.importorskip("aiohttp")
+    from deemix.asyncdownloader import AsyncDownloader
+
+    asyncDownloader = AsyncDownloader(None, downloader.downloadObject, DEFAULTS)
+
+    async def streamAsync(job):
+        async with aiohttp.ClientSession() as asyncDownloader.session:
+            return await asyncDownloader.streamDownloadAsync(job)
+
+    return lambda job: asyncio.run(streamAsync(job))
+
+
+def test_resumes_with_a_range_request(cdn, data, stream, tmp_path):
+    job = getJob(cdn, tmp_path)
+    interrupt(job, data)
+    assert stream(job)
+    assert job["partial"].path.read_bytes() == data
+    assert cdn.requests == [f"bytes={RESUME_AT}-"]
+
+
+def test_restarts_when_the_range_is_ignored(cdn, data, stream, tmp_path):
+    cdn.ranges = False
+    job = getJob(cdn, tmp_path)
+    interrupt(job, data)
+    assert stream(job)
+    assert job["partial"].path.read_bytes() == data
+    assert cdn.requests == [f"bytes={RESUME_AT}-", None]
+
+    # The sidecar describes the whole track, the next run doesn't resume
+    partial = PartialDownload(job["writepath"], job["track"])
+    assert partial.load() == len(data)
+    assert partial.isComplete()
+
+
+def test_stream_rejects_a_whole_track_when_resuming(cdn):
+    cdn.ranges = False
+    with pytest.raises(RangeNotSupported):
+        streamTrack(BytesIO(), fakeTrack(cdn.url), RESUME_AT)
+
+
+def test_process_pool_tracks_are_kept_crypted(cdn, stream, tmp_path):
+    processPool.configure(1)
+    try:
+        job = getJob(cdn, tmp_path)
+        assert stream(job)
+    finally:
+        processPool.configure(0)
+    # The track is decrypted by the process pool when it's tagged
+    assert job["partial"].crypted
+    assert job["partial"].path.read_bytes() == cdn.data
@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from time import monotonic
+
+import pytest
+
+from deemix.decryption import streamTrack
+from deemix.downloader import downloadImage
+from deemix.utils.retry import RETRYABLE_ERRORS, getRetryStats
+from stubs import fakeTrack
+
+
+def openCircuit(retryManager, host):
+    for attempt in range(retryManager.policy.breakerThreshold):
+        retryManager.failure(host, attempt)
+
+
+def test_resumes_after_dropped_connections(cdn, data):
+    cdn.drop = 2
+    cdn.dropAfter = 1024 * 1024 + 17
+    output = BytesIO()
+    streamTrack(output, fakeTrack(cdn.url))
+    assert output.getvalue() == data
+    assert cdn.requests[0] is None
+    assert all(request.startswith("bytes=") for request in cdn.requests[1:])
+    assert getRetryStats()[cdn.host]["retries"] == 2
+
+
+def test_gives_up_after_max_retries(cdn):
+    cdn.drop = 100
+    cdn.dropAfter = 1000
+    with pytest.raises(RETRYABLE_ERRORS):
+        streamTrack(BytesIO(), fakeTrack(cdn.url))
+    assert getRetryStats()[cdn.host]["exhausted"] == 1
+    # Retries are bounded, one attempt and maxRetries retries
+    assert len(cdn.requests) == 4
+
+
+def test_open_circuit_waits_instead_of_failing(cdn, data, fastRetries):
+    # Enough refused connections to open the circuit
+    cdn.refuse = fastRetries.policy.breakerThreshold
+    start = monotonic()
+    output = BytesIO()
+    streamTrack(output, fakeTrack(cdn.url))
+    assert output.getvalue() == data
+    assert monotonic() - start >= fastRetries.policy.breakerCooldown * 0.9
+    assert getRetryStats()[cdn.host]["circuitOpened"] == 1
+
+
+def test_queued_tracks_wait_for_the_open_circuit(cdn, data, fastRetries):
+    openCircuit(fastRetries, cdn.host)
+
+    def download(_):
+        output = BytesIO()
+        streamTrack(output, fakeTrack(cdn.url))
+        return output.getvalue()
+
+    start = monotonic()
+    with ThreadPoolExecutor(3) as executor:
+        outputs = list(executor.map(download, range(6)))
+    assert outputs == [data] * 6
+    assert monotonic() - start >= fastRetries.policy.breakerCooldown * 0.9
+
+
+def test_images_wait_for_the_open_circuit(cdn, data, fastRetries, tmp_path):
+    openCircuit(fastRetries, cdn.host)
+    path = downloadImage(cdn.plainURL, tmp_path / "cover.jpg")
+    assert path.read_bytes() == cdn.data
+
+
+def test_async_stream_waits_for_the_open_circuit(cdn, data, fastRetries):
+    aiohttp = pytest.importorskip("aiohttp")
+    from deemix.asyncdownloader import streamTrackAsync
+
+    async def download():
+        output = BytesIO()
+        async with aiohttp.ClientSession() as session:
+            await streamTrackAsync(session, output, fakeTrack(cdn.url))
+        return output.getvalue()
+
+    openCircuit(fastRetries, cdn.host)
+    cdn.drop = 1
+    cdn.dropAfter = 1024 * 1024
+    start = monotonic()
+    assert asyncio.run(download()) == data
+    assert monotonic() - start >= fastRetries.policy.breakerCooldown * 0.9
@@ -0,0 +1,71 @@
+from io import BytesIO
+import re
+
+from deemix.decryption import (
+    STREAM_BUFFER_SIZE,
+    STRIPE_GRID_SIZE,
+    streamTrack,
+    streamTrackSegmented,
+)
+from deemix.utils.retry import getRetryStats
+from stubs import CDN, TRACK_ID, encrypt, fakeTrack
+
+
+def streamSegmented(path, url, segments=4):
+    with open(path, "w+b") as f:
+        streamTrackSegmented(f, fakeTrack(url), segments, 64 * 1024)
+    return path.read_bytes()
+
+
+def getRanges(cdn):
+    """The (start, end) of the range requests, sorted"""
+    return sorted(
+        tuple(int(group) for group in re.match(r"bytes=(\d+)-(\d+)", header).groups())
+        for header in cdn.requests
+        if header
+    )
+
+
+def test_segments_follow_the_stripe_grid(cdn, data, tmp_path):
+    assert streamSegmented(tmp_path / "track", cdn.url) == data
+
+    ranges = getRanges(cdn)
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data) - 1
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert start == end + 1
+        assert start % STRIPE_GRID_SIZE == 0
+
+
+def test_leading_nulls_are_stripped_like_a_single_stream(data, tmp_path):
+    cdn = CDN(encrypt(TRACK_ID, bytes(5000) + data))
+    try:
+        expected = BytesIO()
+        streamTrack(expected, fakeTrack(cdn.url))
+        segmented = streamSegmented(tmp_path / "track", cdn.url)
+    finally:
+        cdn.close()
+    assert expected.getvalue() == data
+    assert segmented == data
+
+
+def test_failed_segment_is_retried_from_its_last_buffer(cdn, data, tmp_path):
+    cdn.drop = 1
+    cdn.dropAfter = STREAM_BUFFER_SIZE + 17
+    assert streamSegmented(tmp_path / "track", cdn.url) == data
+    assert getRetryStats()[cdn.host]["retries"] == 1
+
+    # The retry asks for the rest of its segment, after the buffer received
+    ranges = getRanges(cdn)
+    assert len(ranges) == 5
+    retried = [
+        (start, end)
+        for start, end in ranges
+        if any(
+            start == first + STREAM_BUFFER_SIZE and end == last
+            for first, last in ranges
+        )
+    ]
+    assert len(retried) == 1
+    assert retried[0][0] % STRIPE_GRID_SIZE == 0
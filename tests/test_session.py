@@ -0,0 +1,59 @@
+from io import BytesIO
+
+import pytest
+
+import deemix.utils.session
+from deemix.decryption import streamTrack
+from deemix.settings import DEFAULTS
+from deemix.utils.retry import RETRYABLE_ERRORS
+from deemix.utils.session import PooledAdapter, configureSession, sessionManager
+from stubs import fakeTrack
+
+http2 = pytest.importorskip("deemix.utils.http2")
+
+
+@pytest.fixture
+def transport():
+    """Restores the HTTP/1.1 session after the test"""
+    yield
+    configureSession(DEFAULTS)
+
+
+def getAdapter():
+    return sessionManager.get().get_adapter("http://")
+
+
+def test_http1_by_default(transport):
+    configureSession(DEFAULTS)
+    assert isinstance(getAdapter(), PooledAdapter)
+
+
+def test_http2_setting_mounts_the_http2_adapter(transport, cdn, data):
+    configureSession({**DEFAULTS, "httpTransport": "http2"})
+    assert isinstance(getAdapter(), http2.HTTP2Adapter)
+    output = BytesIO()
+    streamTrack(output, fakeTrack(cdn.url))
+    assert output.getvalue() == data
+
+
+def test_http2_resumes_after_dropped_connections(transport, cdn, data):
+    configureSession({**DEFAULTS, "httpTransport": "http2"})
+    cdn.drop = 1
+    cdn.dropAfter = 1024 * 1024 + 17
+    output = BytesIO()
+    streamTrack(output, fakeTrack(cdn.url))
+    assert output.getvalue() == data
+    assert cdn.requests[1].startswith("bytes=")
+
+
+def test_http2_errors_are_retryable(transport, cdn):
+    configureSession({**DEFAULTS, "httpTransport": "http2"})
+    cdn.refuse = 100
+    with pytest.raises(RETRYABLE_ERRORS):
+        streamTrack(BytesIO(), fakeTrack(cdn.url))
+
+
+def test_http2_falls_back_without_httpx(transport, monkeypatch):
+    monkeypatch.setattr(deemix.utils.session, "HTTP2Adapter", None)
+    configureSession({**DEFAULTS, "httpTransport": "http2"})
+    assert isinstance(getAdapter(), PooledAdapter)
@@ -0,0 +1,64 @@
+from io import BytesIO
+import os
+
+import pytest
+from mutagen.id3 import ID3, TIT2
+
+from deemix.tagger import TagStream, finishTags, tagFLAC, tagID3
+from stubs import ALL_TAGS, getTaggedTrack, makeFLAC
+
+
+def makeMP3(audioSize, tagged=False):
+    """MPEG frames, after an old ID3v2 tag if tagged is set"""
+    audio = b"\xff\xfb\x90\x64" + os.urandom(audioSize - 4)
+    if not tagged:
+        return audio
+    tag = ID3()
+    tag.add(TIT2(encoding=3, text="old"))
+    header = BytesIO()
+    tag.save(header, v1=0, v2_version=3, padding=lambda info: 500)
+    return header.getvalue() + audio
+
+
+@pytest.fixture
+def track(tmp_path):
+    coverPath = tmp_path / "cover.jpg"
+    coverPath.write_bytes(b"\xff\xd8\xff" + os.urandom(3000))
+    return getTaggedTrack(str(coverPath))
+
+
+def tagInPlace(path, data, track, extension):
+    path.write_bytes(data)
+    if extension == ".mp3":
+        tagID3(path, track, ALL_TAGS)
+    else:
+        tagFLAC(path, track, ALL_TAGS)
+    return path.read_bytes()
+
+
+def tagStreamed(path, data, track, extension, chunkSize):
+    with open(path, "wb") as f:
+        stream = TagStream(f, track, ALL_TAGS, extension, len(data))
+        for position in range(0, len(data), chunkSize):
+            stream.write(data[position : position + chunkSize])
+        stream.finish()
+    finishTags(path, track, ALL_TAGS, extension)
+    return path.read_bytes()
+
+
+@pytest.mark.parametrize("chunkSize", [7, 1000, 64 * 1024])
+@pytest.mark.parametrize(
+    "extension,data",
+    [
+        (".mp3", makeMP3(300 * 1024)),
+        (".mp3", makeMP3(300 * 1024, tagged=True)),
+        (".flac", makeFLAC(300 * 1024)),
+    ],
+    ids=["mp3", "tagged mp3", "flac"],
+)
+def test_streamed_tags_match_the_tagger(tmp_path, track, extension, data, chunkSize):
+    expected = tagInPlace(tmp_path / f"tagged{extension}", data, track, extension)
+    streamed = tagStreamed(
+        tmp_path / f"streamed{extension}", data, track, extension, chunkSize
+    )
+    assert streamed == expected